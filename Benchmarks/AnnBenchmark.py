@@ -0,0 +1,90 @@
+'''
+This script compares the approximate search index in AnnIndex with exact (brute-force) search. For each number of probes,
+it reports the recall@k (the fraction of the exact top k results that the index also finds) and the average time per query.
+Embeddings can either be read from an Encoded Library folder or generated at random in clusters, like real text embeddings.
+
+Usage: python Benchmarks/AnnBenchmark.py [path/to/library/folder] [--rows N] [--dimension N] [--queries N] [--k N] [--seed N]
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import sys # Critical - Used to find the scripts in the 'Scripts' folder.
+import time # Critical - Times each search.
+import argparse # Critical - Reads the command line arguments.
+import numpy as np # Critical - Generates the random sample embeddings.
+import torch # Critical - Runs the exact search.
+
+# Make the scripts in the 'Scripts' folder importable.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+import AnnIndex # Critical - Provides the index that is being benchmarked.
+import EncodedLibrary # Critical - Reads the embeddings of a library.
+
+#####----- Sample Embeddings -----#####
+
+# This function generates embeddings scattered around a number of random topics, so that they form clusters of different sizes.
+def randomEmbeddings(rows, dimension, seed):
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((max(1, rows // 200), dimension)).astype(np.float32)
+    topicOf = rng.zipf(1.3, size=rows) % len(topics) # Some topics are much more common than others.
+    embeddings = topics[topicOf] + rng.standard_normal((rows, dimension)).astype(np.float32) * 0.9
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+# This function reads the embeddings of every segment of a library into one array.
+def libraryEmbeddings(libDir):
+    header = EncodedLibrary.readHeader(libDir)
+    return np.concatenate([np.asarray(EncodedLibrary.mapEmbeddings(libDir, header, segment)) for segment in header['segments']]).astype(np.float32)
+
+# Queries are made by adding noise to random rows, so that they are close to, but not exactly the same as, some of the embeddings.
+def makeQueries(embeddings, count, seed):
+    rng = np.random.default_rng(seed + 1)
+    queries = embeddings[rng.choice(len(embeddings), size=count, replace=False)]
+    queries = queries + rng.standard_normal(queries.shape).astype(np.float32) * 0.05
+    return torch.from_numpy(queries.astype(np.float32))
+
+#####----- Benchmark -----#####
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the recall and speed of the search index with exact search.')
+    parser.add_argument('library', nargs='?', help='An Encoded Library folder to read the embeddings from. Random embeddings are used if this is not given.')
+    parser.add_argument('--rows', type=int, default=200000, help='The number of random embeddings.')
+    parser.add_argument('--dimension', type=int, default=384, help='The dimension of the random embeddings.')
+    parser.add_argument('--queries', type=int, default=200, help='The number of queries.')
+    parser.add_argument('--k', type=int, default=10, help='The number of results per query.')
+    parser.add_argument('--seed', type=int, default=0, help='The seed used to generate the random embeddings and queries.')
+    args = parser.parse_args()
+
+    embeddings = libraryEmbeddings(args.library) if args.library else randomEmbeddings(args.rows, args.dimension, args.seed)
+    queries = makeQueries(embeddings, min(args.queries, len(embeddings)), args.seed)
+    tensor = torch.from_numpy(embeddings)
+    print(f'{len(embeddings)} embeddings with {embeddings.shape[1]} dimensions, {len(queries)} queries, k = {args.k}.')
+
+    start = time.perf_counter()
+    index = AnnIndex.indexTensors(AnnIndex.buildIndex(embeddings, seed=args.seed))
+    print(f'Index with {len(index["centroids"])} clusters built in {time.perf_counter() - start:.2f} s.')
+
+    # Exact search gives the true top k results of every query.
+    exact = []
+    start = time.perf_counter()
+    for query in queries:
+        rows, scores = AnnIndex.searchSegment(query, tensor, None)
+        exact.append(set(rows[torch.topk(scores, k=args.k).indices].tolist()))
+    exactTime = (time.perf_counter() - start) / len(queries)
+    print(f'\n{"Probes":>8} {"Recall@" + str(args.k):>10} {"Scanned":>9} {"ms/query":>10} {"Speed-up":>9}')
+    print(f'{"exact":>8} {1:>10.3f} {1:>9.1%} {exactTime * 1000:>10.2f} {1:>8.1f}x')
+
+    for probes in [1, 2, 4, 8, 16, 32, 64]:
+        if probes > len(index['centroids']):
+            break
+        found, scanned = 0, 0
+        start = time.perf_counter()
+        for query, truth in zip(queries, exact):
+            rows, scores = AnnIndex.searchSegment(query, tensor, index, probes)
+            top = rows[torch.topk(scores, k=min(args.k, len(rows))).indices].tolist()
+            found += len(truth.intersection(top))
+            scanned += len(rows)
+        annTime = (time.perf_counter() - start) / len(queries)
+        print(f'{probes:>8} {found / (args.k * len(queries)):>10.3f} {scanned / (len(queries) * len(embeddings)):>9.1%} {annTime * 1000:>10.2f} {exactTime / annTime:>8.1f}x')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+'''
+This script compares the streaming chunker in ExtractPDF (chunkCorpus) with the original row-by-row loops
+over the pdfTable that it replaced. It checks that both produce the same chunks from the same pages and
+reports how long each one takes. Pages can either be read from a folder of PDFs or generated at random.
+
+Usage: python Benchmarks/ChunkerBenchmark.py [path/to/PDF/folder] [--pages N] [--seed N]
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import sys # Critical - Used to find the scripts in the 'Scripts' folder.
+import time # Critical - Times each chunker.
+import random # Critical - Generates a random sample corpus.
+import argparse # Critical - Reads the command line arguments.
+import pandas as pd # Critical - Runs the original chunking code.
+
+# Make the scripts in the 'Scripts' folder importable.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+import ExtractPDF # Critical - Provides the chunker that is being benchmarked.
+
+#####----- Sample Corpus -----#####
+
+# This function generates page records (in ExtractPDF.tableColumns order) with a mix of long paragraphs that need to be split,
+# short fragments that need to be merged, blank lines and blank pages.
+def randomPages(pageCount, seed):
+    rng = random.Random(seed)
+    words = ['salmon', 'wildfire', 'habitat', 'river', 'sediment', 'temperature', 'spawning', 'survey', 'results', 'effect',
+             'analysis', 'study', 'population', 'restoration', 'forest', 'stream', 'water', 'quality', 'fish', 'data']
+
+    def sentence():
+        return ' '.join(rng.choice(words) for _ in range(rng.randint(4, 30))).capitalize() + '.'
+
+    def paragraph():
+        kind = rng.random()
+        if kind < 0.15: # A long paragraph that will need to be split.
+            return ' '.join(sentence() for _ in range(rng.randint(15, 60)))
+        if kind < 0.45: # A short fragment, such as a heading or a caption.
+            return ' '.join(rng.choice(words) for _ in range(rng.randint(1, 8)))
+        if kind < 0.5: # A blank line.
+            return ''
+        return ' '.join(sentence() for _ in range(rng.randint(1, 8)))
+
+    records = []
+    fileNum = 0
+    while len(records) < pageCount:
+        fileNum += 1
+        path = os.path.join('Sample', f'Document_{fileNum}.pdf')
+        for pageNum in range(rng.randint(1, 40)):
+            text = '' if rng.random() < 0.03 else '\n'.join(paragraph() for _ in range(rng.randint(1, 12)))
+            records.append((os.path.basename(path), path, f'Title {fileNum}', None, None, None, str(pageNum + 1), text))
+    return records
+
+# This function reads the page records from every PDF in a folder.
+def pdfPages(folder):
+    ExtractPDF.makeList(folder)
+    records = []
+    for file in ExtractPDF.fileList:
+        try:
+            records.extend(ExtractPDF.readPages(file))
+        except Exception:
+            print(f'Skipping unreadable PDF: {file}')
+    return records
+
+#####----- Original Chunker -----#####
+
+# This is the chunking code from createLibrary before it was replaced by chunkCorpus, kept here as a reference.
+def legacyChunks(records):
+    pdfTable = pd.DataFrame(records, columns = ExtractPDF.tableColumns)
+
+    pdfTable['Content'] = pdfTable['Content'].str.split('\n')
+    pdfTable = pdfTable.explode('Content').reset_index(drop=True)
+    pdfTable['Content'] = pdfTable['Content'].str.strip()
+    pdfTable['Split'] = 0
+
+    pdfTable['Content'] = pdfTable['Content'].astype(object)
+
+    for i in range(len(pdfTable)):
+        if len(pdfTable.at[i, 'Content']) > 1500:
+            chunks = ExtractPDF.fixChunks(pdfTable.at[i, 'Content'], max_chunk_size = 1500)
+            pdfTable.at[i, 'Content'] = chunks
+            pdfTable.at[i, 'Split'] = 1
+
+    pdfTable = pdfTable.explode('Content').reset_index(drop=True)
+
+    for i in range(len(pdfTable)):
+        if len(pdfTable.at[i, 'Content']) < 280 and pdfTable.at[i, 'Content'] != '':
+            if pdfTable.at[i, 'Split'] == 1 and pdfTable.at[i-1, 'Content'] != '':
+                pdfTable.at[i-1, 'Content'] = f"{pdfTable.at[i-1, 'Content']} {pdfTable.at[i, 'Content']}"
+                pdfTable.at[i, 'Content'] = ''
+            else:
+                try:
+                    if pdfTable.at[i, 'File_Name'] == pdfTable.at[i+1, 'File_Name']:
+                        pdfTable.at[i+1, 'Content'] = f"{pdfTable.at[i, 'Content']} {pdfTable.at[i+1, 'Content']}"
+                        pdfTable.at[i, 'Content'] = ''
+                        pdfTable.at[i+1, 'Split'] = None
+                except:
+                    pdfTable.at[i-1, 'Content'] = f"{pdfTable.at[i-1, 'Content']} {pdfTable.at[i, 'Content']}"
+                    pdfTable.at[i, 'Content'] = ''
+
+    pdfTable['Content'] = pdfTable['Content'].str.strip()
+    pdfTable = pdfTable.replace('', pd.NA)
+    return pdfTable.dropna(subset=['Content']).reset_index(drop=True)
+
+# This is the new chunker, as it is called by createLibrary.
+def streamingChunks(records):
+    pdfTable = pd.DataFrame(ExtractPDF.chunkCorpus(records, maxChunkSize = 1500, minChunkSize = 280), columns = ExtractPDF.tableColumns + ['Split'])
+    return pdfTable.replace('', pd.NA)
+
+#####----- Benchmark -----#####
+
+# Compares the two tables and returns the number of rows that differ in their file, page, content or split flag.
+def countDifferences(legacy, streaming):
+    if len(legacy) != len(streaming):
+        return abs(len(legacy) - len(streaming)) + countDifferences(legacy.head(min(len(legacy), len(streaming))), streaming.head(min(len(legacy), len(streaming))))
+    differences = 0
+    for column in ['File_Path', 'Page', 'Content', 'Split']:
+        a = legacy[column].astype(object).where(legacy[column].notna(), '<NA>')
+        b = streaming[column].astype(object).where(streaming[column].notna(), '<NA>')
+        differences += int((a.reset_index(drop=True) != b.reset_index(drop=True)).sum())
+    return differences
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the streaming chunker with the original pdfTable loops.')
+    parser.add_argument('folder', nargs='?', help='A folder of PDFs to chunk. A random sample corpus is used if this is not given.')
+    parser.add_argument('--pages', type=int, default=2000, help='The number of pages in the random sample corpus.')
+    parser.add_argument('--seed', type=int, default=0, help='The seed used to generate the random sample corpus.')
+    args = parser.parse_args()
+
+    records = pdfPages(args.folder) if args.folder else randomPages(args.pages, args.seed)
+    print(f'Chunking {len(records)} pages from {len(set(record[1] for record in records))} documents.')
+
+    start = time.perf_counter()
+    legacy = legacyChunks(records)
+    legacyTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    streaming = streamingChunks(records)
+    streamingTime = time.perf_counter() - start
+
+    differences = countDifferences(legacy, streaming)
+
+    print(f'Original loops:    {len(legacy)} chunks in {legacyTime:.3f} s')
+    print(f'Streaming chunker: {len(streaming)} chunks in {streamingTime:.3f} s ({legacyTime / max(streamingTime, 1e-9):.1f}x faster)')
+    print('Outputs are identical.' if differences == 0 else f'Outputs differ in {differences} values.')
+
+    return 0 if differences == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
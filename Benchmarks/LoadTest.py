@@ -0,0 +1,149 @@
+'''
+This script load tests the search API (see SearchServer). A number of clients send searches at the same time, each sending its next search
+as soon as the last one is answered, and the script reports the searches per second, the latency seen by the clients, and how many searches
+were turned away because the server was busy.
+
+It can test a server that is already running (--url), or be given a library, in which case it starts two local servers one after the other:
+one that searches every query on its own (no batching), and one that batches searches that arrive together (see SearchServer.batchWindow).
+The same load is sent to both, to show how much faster batching is when many searches arrive at once.
+
+Usage: python Benchmarks/LoadTest.py [path/to/library | --url http://127.0.0.1:8765] [--clients N] [--requests N] [--k N] [--queries file.txt]
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import sys # Critical - Used to find the scripts in the 'Scripts' folder.
+import json # Critical - Sends searches and reads their results.
+import time # Critical - Times each search.
+import argparse # Critical - Reads the command line arguments.
+import threading # Critical - Runs the clients at the same time.
+import http.client # Critical - Sends the searches, keeping each client's connection open.
+import urllib.parse # Critical - Reads the address of the server.
+import numpy as np # Critical - Calculates the latency percentiles.
+
+# Make the scripts in the 'Scripts' folder importable.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+
+#####----- Settings -----#####
+# Sample queries, used when no query file is given. A number is added to each search so that no two searches are the same
+# (repeated searches would be answered from the result cache, which is not what is being tested).
+sampleQueries = ["how does wildfire affect salmon", "what is measured in water samples", "how can erosion be controlled after a fire",
+                 "what are the effects of sediment on fish", "when were the surveys carried out", "which species were recorded at the sites",
+                 "how is riparian vegetation restored", "what causes water temperatures to rise"]
+
+#####----- Load Test -----#####
+
+# Sends one search to the server over an open connection. Returns the HTTP status and how long the search took in seconds.
+def sendSearch(connection, query, k):
+    body = json.dumps({'query': query, 'k': k})
+    start = time.perf_counter()
+    connection.request('POST', '/search', body=body, headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    response.read()
+    return response.status, time.perf_counter() - start
+
+# Reads a page of the server, such as /metrics.
+def getJson(url, path):
+    address = urllib.parse.urlparse(url)
+    connection = http.client.HTTPConnection(address.hostname, address.port, timeout=60)
+    connection.request('GET', path)
+    data = json.loads(connection.getresponse().read())
+    connection.close()
+    return data
+
+# This function sends requests searches to the server at url from clients clients at the same time. Each client sends its next search as soon
+# as its last one is answered. tag is added to every query so that searches are not repeated between runs. Returns a summary of the run.
+def runLoad(url, queries, clients, requests, k, tag=''):
+    address = urllib.parse.urlparse(url)
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+    counter = iter(range(requests)) # Shared by the clients, so that requests searches are sent in total.
+
+    def client():
+        connection = http.client.HTTPConnection(address.hostname, address.port, timeout=120)
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            try:
+                status, seconds = sendSearch(connection, f'{queries[i % len(queries)]} {tag}{i}', k)
+            except (OSError, http.client.HTTPException):
+                connection.close() # Reconnect, in case the server closed the connection.
+                connection = http.client.HTTPConnection(address.hostname, address.port, timeout=120)
+                status, seconds = 0, 0.0
+            with lock:
+                statuses.append(status)
+                if status == 200:
+                    latencies.append(seconds)
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    latencies = np.asarray(latencies) * 1000
+    summary = {'requests': requests, 'ok': statuses.count(200), 'rejected': statuses.count(503), 'errors': len(statuses) - statuses.count(200) - statuses.count(503),
+               'seconds': round(seconds, 2), 'searches_per_second': round(statuses.count(200) / seconds, 1) if seconds > 0 else 0.0}
+    if len(latencies) > 0:
+        summary['latency_ms'] = {name: round(float(np.percentile(latencies, percent)), 1) for name, percent in [('p50', 50), ('p95', 95), ('p99', 99)]}
+    return summary
+
+# Prints a summary of a run (see runLoad), with the mean batch size reported by the server.
+def printSummary(label, summary, metrics):
+    latency = summary.get('latency_ms', {})
+    print(f'{label:<14} {summary["searches_per_second"]:>10.1f} {latency.get("p50", 0):>9.1f} {latency.get("p95", 0):>9.1f} {latency.get("p99", 0):>9.1f} '
+          f'{summary["rejected"]:>9} {summary["errors"]:>7} {metrics.get("mean_batch_size", 0):>11.1f}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the search API, with and without batching.')
+    parser.add_argument('library', nargs='?', help='An Encoded Library to serve from local servers, with and without batching.')
+    parser.add_argument('--url', default=None, help='The address of a server that is already running, such as http://127.0.0.1:8765.')
+    parser.add_argument('--clients', type=int, default=32, help='The number of clients sending searches at the same time.')
+    parser.add_argument('--requests', type=int, default=1000, help='The number of searches sent in each run.')
+    parser.add_argument('--k', type=int, default=10, help='The number of results per search.')
+    parser.add_argument('--queries', default=None, help='A file with one query per line. Sample queries are used if this is not given.')
+    args = parser.parse_args()
+    if (args.library is None) == (args.url is None):
+        parser.error('Give either a library to serve or the --url of a running server.')
+
+    queries = sampleQueries
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    header = f'{"Server":<14} {"Searches/s":>10} {"p50 (ms)":>9} {"p95 (ms)":>9} {"p99 (ms)":>9} {"Rejected":>9} {"Errors":>7} {"Mean batch":>11}'
+    print(f'{args.clients} clients, {args.requests} searches per run, k = {args.k}.\n')
+    if args.url:
+        summary = runLoad(args.url, queries, args.clients, args.requests, args.k, tag=f'{time.time():.0f}-')
+        print(header)
+        printSummary('Running server', summary, getJson(args.url, '/metrics'))
+        return 0
+
+    import SearchServer # Critical - Runs the local servers.
+    print('Loading the AI models and the library...')
+    SearchServer.QuickSearch.initializeEmbedders()
+    SearchServer.QuickSearch.loadLibrary(args.library)
+
+    results = {}
+    for label, window, batchLimit in [('Unbatched', 0, 1), ('Batched', None, None)]:
+        server = SearchServer.startServer(serverPort=0, window=window, batchLimit=batchLimit) # Port 0 picks a free port.
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        runLoad(url, queries, min(4, args.clients), min(20, args.requests), args.k, tag=f'warm-{label}-') # Warm up the models first.
+        results[label] = (runLoad(url, queries, args.clients, args.requests, args.k, tag=f'{label}-'), getJson(url, '/metrics'))
+        SearchServer.stopServer(server)
+
+    print(header)
+    for label, (summary, metrics) in results.items():
+        printSummary(label, summary, metrics)
+    unbatched, batched = results['Unbatched'][0]['searches_per_second'], results['Batched'][0]['searches_per_second']
+    if unbatched > 0:
+        print(f'\nBatching served {batched / unbatched:.1f}x as many searches per second.')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,237 @@
+'''
+This script times every stage of making and searching an Encoded Library, so that changes can be checked for slowdowns and the hardware
+needed for a collection can be estimated. It generates a synthetic corpus of PDFs (see SyntheticCorpus), or uses a folder of real PDFs,
+and then times each stage the way ExtractPDF.createLibrary runs them:
+
+    make_list      Finding the PDFs in the folder (ExtractPDF.makeList).
+    build          Making the whole library with ExtractPDF.createLibrary, which extracts, chunks, encodes and saves at the same time.
+                   Its time can be compared with the sum of the stages below, which time each step on its own. It is run first, so
+                   its peak memory is not raised by the stages below (but it loads the bi-encoder, which the encode stage then reuses).
+    extract        Reading the text of every page (ExtractPDF.extractFiles).
+    chunk          Splitting the text into chunks and removing duplicates (ExtractPDF.chunkTable).
+    encode         Loading the bi-encoder and encoding every chunk (ExtractPDF.encodeChunks).
+    save           Hashing the PDFs and saving the library folder (EncodedLibrary.saveLibrary).
+    load_models    Loading the models used for searches (QuickSearch.initializeEmbedders).
+    load_pickle    Loading the library saved as a .pkl file (QuickSearch.loadPickle).
+    load_library   Loading the library folder (QuickSearch.loadLibrary), which is then searched.
+
+It then times single searches, with the caches cleared before each one, in three ways: the full search of the GUI (Search, which reranks
+and highlights the results), a search that reranks the results (searchMany with rerank), and a search that does not (searchMany without rerank).
+The peak memory (RSS) of the script is recorded after every stage.
+
+The results are printed and saved as JSON (--output). Giving the JSON of an earlier run with --compare prints how much each stage has changed.
+
+Usage: python Benchmarks/PipelineBenchmark.py [path/to/PDF/folder] [--documents N] [--pages N] [--queries N] [--output results.json] [--compare old.json]
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import sys # Critical - Used to find the scripts in the 'Scripts' folder.
+import io # Critical - Keeps the messages printed by makeList and Search out of the results.
+import json # Critical - Saves and reads the results.
+import time # Critical - Times each stage.
+import pickle # Critical - Saves the library as a .pkl file, to time loadPickle.
+import shutil # Critical - Removes the generated corpus and library when the benchmark is done.
+import argparse # Critical - Reads the command line arguments.
+import datetime # Critical - Records when the benchmark was run.
+import platform # Critical - Records the computer the benchmark was run on.
+import tempfile # Critical - Makes a folder for the generated corpus and library.
+import contextlib # Critical - Keeps the messages printed by makeList and Search out of the results.
+import numpy as np # Critical - Calculates the latency percentiles.
+
+# Make the scripts in the 'Scripts' folder importable.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+import ExtractPDF # Critical - Provides the stages of library creation that are being benchmarked.
+import EncodedLibrary # Critical - Saves the library.
+import SearchCache # Critical - Clears the search caches before each timed search.
+import Metrics # Critical - Reads the peak memory, and the time of each stage of the timed searches.
+import SyntheticCorpus # Critical - Generates the sample corpus.
+
+#####----- Settings -----#####
+latencyModes = ['search', 'rerank', 'no_rerank'] # The ways single searches are timed (see timeSearches).
+
+#####----- Measurements -----#####
+
+# This function runs one stage of the benchmark, recording in stages how long it took, the memory of the program after it, and how much it
+# raised the peak memory of the program (see Metrics.stage). Returns the stage's result.
+def timeStage(stages, name, function, *args):
+    print(f'{name}...', file=sys.stderr)
+    peakBefore = Metrics.peakMemory()
+    start = time.perf_counter()
+    result = function(*args)
+    peakAfter = Metrics.peakMemory()
+    stages[name] = {'seconds': round(time.perf_counter() - start, 4), 'rss_end_mb': Metrics.currentMemory(),
+                    'peak_increase_mb': None if peakAfter is None else round(peakAfter - peakBefore, 1)}
+    return result
+
+# Returns the p50, p95 and p99 (and the mean) of a list of latencies in seconds, in milliseconds.
+def percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    summary = {f'p{percent}_ms': round(float(np.percentile(latencies, percent)), 2) for percent in [50, 95, 99]}
+    summary.update({'mean_ms': round(float(latencies.mean()), 2), 'queries': len(latencies)})
+    return summary
+
+#####----- Benchmark -----#####
+
+# These functions are the stages that are not a single call, in the same order as in ExtractPDF.createLibrary.
+def listFiles(folder):
+    with contextlib.redirect_stdout(io.StringIO()): # makeList prints every PDF it finds.
+        ExtractPDF.makeList(folder)
+    return ExtractPDF.fileList
+
+def chunkRecords(records):
+    pdfTable, _ = ExtractPDF.chunkTable(records)
+    pdfTable = pdfTable.drop_duplicates(subset=['Title', 'Author', 'Subject', 'Keywords', 'Page', 'Content'])
+    return pdfTable.reset_index(drop=True)
+
+def buildLibrary(workDir, files, workers):
+    cwd = os.getcwd()
+    os.chdir(workDir) # createLibrary saves the library and its log in the current folder.
+    try:
+        os.makedirs('Logs', exist_ok=True)
+        os.makedirs('Encoded Libraries', exist_ok=True)
+        ExtractPDF.fileList, ExtractPDF.pdfLog = [os.path.abspath(os.path.join(cwd, file)) for file in files], ''
+        with contextlib.redirect_stdout(io.StringIO()): # createLibrary prints the PDFs it could not read.
+            return ExtractPDF.createLibrary(False, workers)[0]
+    finally:
+        os.chdir(cwd)
+
+def saveFolder(libDir, files, pdfTable, embeddings):
+    manifest = EncodedLibrary.buildManifest(files, pdfTable)
+    return EncodedLibrary.saveLibrary(libDir, pdfTable, embeddings, EncodedLibrary.defaultModel, manifest, quantization=ExtractPDF.quantization)
+
+# Makes count queries from the words used in the synthetic corpus, such as 'how does wildfire affect salmon habitat'.
+def makeQueries(count, seed):
+    rng = np.random.default_rng(seed)
+    starts = ['how does', 'what is the effect of', 'why does', 'where is', 'when was']
+    return [f'{rng.choice(starts)} {" ".join(rng.choice(SyntheticCorpus.words, size=rng.integers(2, 5)))}' for _ in range(count)]
+
+# This function times single searches of the loaded library, one mode at a time (see latencyModes), clearing the caches before each search
+# so that every search does all of its work. The first few queries warm up the models and are not counted. The median time of each stage
+# of the searches (such as encoding the query or reranking, see Metrics) is recorded with the latencies of each mode.
+def timeSearches(QuickSearch, queries, k, warmup=3):
+    searches = {'search': lambda query: QuickSearch.Search(query, k, False),
+                'rerank': lambda query: QuickSearch.searchMany([query], k, rerank=True),
+                'no_rerank': lambda query: QuickSearch.searchMany([query], k, rerank=False)}
+    latency = {}
+    for mode in latencyModes:
+        print(f'search ({mode})...', file=sys.stderr)
+        times = []
+        for number, query in enumerate(queries[:warmup] + queries):
+            if number == warmup:
+                Metrics.recentTraces.clear() # Only the stages of the timed searches are summarized.
+            for cache in [QuickSearch.embeddingCache, QuickSearch.resultCache, QuickSearch.rerankCache, QuickSearch.highlightCache]:
+                SearchCache.clearCache(cache)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()): # Search prints its results.
+                searches[mode](query)
+            if number >= warmup:
+                times.append(time.perf_counter() - start)
+        latency[mode] = percentiles(times)
+        for totals in Metrics.metricsSummary().values():
+            latency[mode]['stages_p50_ms'] = {name: stage['p50_ms'] for name, stage in totals['stages'].items()}
+    return latency
+
+# This function runs the whole benchmark in workDir, on the PDFs in folder. Returns the results, ready to be saved as JSON.
+def runBenchmark(folder, workDir, args):
+    stages = {}
+    files = timeStage(stages, 'make_list', listFiles, folder)
+    timeStage(stages, 'build', buildLibrary, workDir, files, args.workers)
+    records, failedFiles = timeStage(stages, 'extract', ExtractPDF.extractFiles, files, args.workers)
+    pageCount = len(records)
+    pdfTable = timeStage(stages, 'chunk', chunkRecords, records)
+    del records
+    embeddings = timeStage(stages, 'encode', ExtractPDF.encodeChunks, pdfTable['Content'].tolist())
+    libDir = timeStage(stages, 'save', saveFolder, os.path.join(workDir, 'Library'), files, pdfTable, embeddings)
+
+    results = {'corpus': {'folder': folder, 'pdfs': len(files), 'failed_pdfs': len(failedFiles), 'pages': pageCount, 'chunks': len(pdfTable),
+                          'megabytes': round(sum(os.path.getsize(file) for file in files) / 2**20, 2), 'chunk_characters': int(pdfTable['Content'].str.len().sum())},
+               'stages': stages}
+    if args.no_search:
+        return results
+
+    # The .pkl format holds the whole table, with the text of every chunk, and the embeddings.
+    pklPath = os.path.join(workDir, 'Library.pkl')
+    with open(pklPath, 'wb') as f:
+        pickle.dump((pdfTable, embeddings), f)
+    del pdfTable, embeddings
+
+    import QuickSearch # Imported here, as it loads the AI packages.
+    timeStage(stages, 'load_models', QuickSearch.initializeEmbedders)
+    timeStage(stages, 'load_pickle', QuickSearch.loadPickle, pklPath)
+    timeStage(stages, 'load_library', QuickSearch.loadLibrary, libDir)
+    results['search'] = timeSearches(QuickSearch, makeQueries(args.queries, args.seed), args.k)
+    results['search']['k'] = args.k
+    QuickSearch.closeLibrary()
+    return results
+
+#####----- Results -----#####
+
+# Prints the time and memory of each stage and the search latencies.
+def printResults(results):
+    print(f'\n{results["corpus"]["pdfs"]} PDFs, {results["corpus"]["pages"]} pages, {results["corpus"]["chunks"]} chunks.\n')
+    print(f'{"Stage":<14} {"Seconds":>9} {"RSS after (MB)":>15} {"Peak increase (MB)":>19}')
+    for name, stage in results['stages'].items():
+        rss, increase = stage.get('rss_end_mb'), stage.get('peak_increase_mb')
+        print(f'{name:<14} {stage["seconds"]:>9.3f} {rss if rss is not None else "-":>15} {increase if increase is not None else "-":>19}')
+    if 'search' in results:
+        print(f'\n{"Search":<14} {"p50 (ms)":>9} {"p95 (ms)":>9} {"p99 (ms)":>9}')
+        for mode in latencyModes:
+            latency = results['search'][mode]
+            print(f'{mode:<14} {latency["p50_ms"]:>9.1f} {latency["p95_ms"]:>9.1f} {latency["p99_ms"]:>9.1f}')
+
+# Prints how much each stage time and search latency has changed since an earlier run. Ratios above 1 are slower than before.
+def compareResults(old, new):
+    print(f'\n{"Compared with":<14} {old.get("created", "the earlier run")}')
+    print(f'{"Measure":<24} {"Before":>10} {"After":>10} {"Ratio":>7}')
+    rows = [(f'{name} (s)', old['stages'][name]['seconds'], stage['seconds']) for name, stage in new['stages'].items() if name in old['stages']]
+    rows += [(f'{mode} {percentile} (ms)', old['search'][mode][f'{percentile}_ms'], new['search'][mode][f'{percentile}_ms'])
+             for mode in latencyModes if mode in old.get('search', {}) and mode in new.get('search', {}) for percentile in ['p50', 'p95']]
+    for label, before, after in rows:
+        ratio = f'{after / before:.2f}' if before > 0 else '-'
+        print(f'{label:<24} {before:>10.3f} {after:>10.3f} {ratio:>7}')
+    if old.get('corpus', {}).get('chunks') != new['corpus']['chunks']:
+        print('Warning: the two runs did not use the same corpus, so their times cannot be compared directly.')
+
+def main():
+    parser = argparse.ArgumentParser(description='Time each stage of making and searching an Encoded Library.')
+    parser.add_argument('folder', nargs='?', help='A folder of PDFs to benchmark with. A synthetic corpus is generated if this is not given.')
+    SyntheticCorpus.addCorpusArguments(parser)
+    parser.add_argument('--workers', type=int, default=None, help='The number of processes used to extract text. Defaults to ExtractPDF.extractWorkers.')
+    parser.add_argument('--queries', type=int, default=50, help='The number of searches timed in each mode.')
+    parser.add_argument('--k', type=int, default=10, help='The number of results per search.')
+    parser.add_argument('--no-search', action='store_true', help='Only time making the library, without loading the search models.')
+    parser.add_argument('--output', default=None, help='The file the results are saved to, as JSON.')
+    parser.add_argument('--compare', default=None, help='The JSON results of an earlier run, to compare this run with.')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated corpus and library, and print where they are.')
+    args = parser.parse_args()
+
+    Metrics.metricsFile = None # The traces of the benchmark are not added to the metrics of this computer's real searches.
+    workDir = tempfile.mkdtemp(prefix='PipelineBenchmark-')
+    try:
+        folder = args.folder
+        if folder is None:
+            print('Generating the synthetic corpus...', file=sys.stderr)
+            folder = os.path.join(workDir, 'Corpus')
+            SyntheticCorpus.makeCorpus(folder, args.documents, args.pages, args.seed, SyntheticCorpus.layoutArguments(args))
+        results = runBenchmark(folder, workDir, args)
+    finally:
+        if args.keep:
+            print(f'The corpus and library were kept in {workDir}', file=sys.stderr)
+        else:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    results.update({'created': datetime.datetime.now().isoformat(timespec='seconds'), 'peak_rss_mb': Metrics.peakMemory(), 'peak_worker_rss_mb': Metrics.peakChildMemory(),
+                    'settings': {'synthetic': args.folder is None, 'documents': args.documents, 'pages': args.pages, 'seed': args.seed,
+                                 'layout': SyntheticCorpus.layoutArguments(args), 'workers': args.workers, 'quantization': ExtractPDF.quantization},
+                    'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count(), 'python': platform.python_version()}})
+    printResults(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compareResults(json.load(f), results)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+'''
+This script compares the quantization modes in Quantize. For each mode, it reports the memory needed to hold the embeddings used by searches,
+the recall@k (the fraction of the exact top k results that are found) with and without rescoring a short list with the full embeddings,
+and the average time per query. Embeddings can either be read from an Encoded Library folder or generated at random (see AnnBenchmark).
+
+Usage: python Benchmarks/QuantizationBenchmark.py [path/to/library/folder] [--rows N] [--dimension N] [--queries N] [--k N] [--rescore N] [--seed N]
+By default, each mode rescores the short list used by QuickSearch (see Quantize.rescoreFactors).
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import sys # Critical - Used to find the scripts in the 'Scripts' folder.
+import time # Critical - Times each search.
+import argparse # Critical - Reads the command line arguments.
+import tempfile # Critical - Holds the compressed embeddings while they are benchmarked.
+import torch # Critical - Runs the searches.
+
+# Make the scripts in the 'Scripts' folder importable.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+import Quantize # Critical - Provides the quantization modes that are being benchmarked.
+import AnnIndex # Critical - Runs the exact search.
+from AnnBenchmark import randomEmbeddings, libraryEmbeddings, makeQueries # Critical - Provides the sample embeddings and queries.
+
+#####----- Benchmark -----#####
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the memory use, recall and speed of the quantization modes.')
+    parser.add_argument('library', nargs='?', help='An Encoded Library folder to read the embeddings from. Random embeddings are used if this is not given.')
+    parser.add_argument('--rows', type=int, default=200000, help='The number of random embeddings.')
+    parser.add_argument('--dimension', type=int, default=384, help='The dimension of the random embeddings.')
+    parser.add_argument('--queries', type=int, default=200, help='The number of queries.')
+    parser.add_argument('--k', type=int, default=10, help='The number of results per query.')
+    parser.add_argument('--rescore', type=int, default=None, help='How many times k rows are rescored with the full embeddings. Defaults to Quantize.rescoreFactors.')
+    parser.add_argument('--seed', type=int, default=0, help='The seed used to generate the random embeddings and queries.')
+    args = parser.parse_args()
+
+    embeddings = libraryEmbeddings(args.library) if args.library else randomEmbeddings(args.rows, args.dimension, args.seed)
+    queries = makeQueries(embeddings, min(args.queries, len(embeddings)), args.seed)
+    tensor = torch.from_numpy(embeddings)
+    print(f'{len(embeddings)} embeddings with {embeddings.shape[1]} dimensions, {len(queries)} queries, k = {args.k}.')
+
+    # Exact search with the full embeddings gives the true top k results of every query.
+    exact = []
+    for query in queries:
+        rows, scores = AnnIndex.searchSegment(query, tensor, None)
+        exact.append(set(rows[torch.topk(scores, k=args.k).indices].tolist()))
+
+    print(f'\n{"Mode":>8} {"Memory":>10} {"Saving":>7} {"Recall@" + str(args.k):>10} {"Shortlist":>10} {"Rescored":>9} {"ms/query":>9}')
+    with tempfile.TemporaryDirectory() as folder:
+        for mode in Quantize.modes:
+            Quantize.writeQuantized(folder, embeddings, mode)
+            quantized = Quantize.loadQuantized(folder, mode, len(embeddings), embeddings.shape[1])
+            memory = Quantize.rowBytes(mode, embeddings.shape[1]) * len(embeddings)
+            shortlist = args.k * (args.rescore if args.rescore is not None else max(1, Quantize.rescoreFactors[mode]))
+
+            found, foundRescored = 0, 0
+            start = time.perf_counter()
+            for query, truth in zip(queries, exact):
+                rows, scores = AnnIndex.searchSegment(query, tensor, None, quantized=quantized)
+                found += len(truth.intersection(rows[torch.topk(scores, k=args.k).indices].tolist()))
+
+                # Rescore the shortlist with the full embeddings, as QuickSearch.rescore does.
+                rows = rows[torch.topk(scores, k=min(shortlist, len(rows))).indices]
+                scores = AnnIndex.searchSegment(query, tensor[rows], None)[1]
+                foundRescored += len(truth.intersection(rows[torch.topk(scores, k=args.k).indices].tolist()))
+            queryTime = (time.perf_counter() - start) / len(queries)
+
+            total = args.k * len(queries)
+            print(f'{mode:>8} {memory / 1e6:>7.1f} MB {len(embeddings) * embeddings.shape[1] * 4 / memory:>6.0f}x {found / total:>10.3f} {shortlist:>10} {foundRescored / total:>9.3f} {queryTime * 1000:>9.2f}')
+            del quantized
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
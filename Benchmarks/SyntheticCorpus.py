@@ -0,0 +1,138 @@
+'''
+This script generates a folder of synthetic PDFs to benchmark library creation and search with (see PipelineBenchmark). The PDFs are made
+with PyMuPDF from random sentences, with the layouts that make text extraction and chunking hard: long paragraphs that need to be split,
+words hyphenated across line breaks, short fragments (such as headings and captions) that need to be merged, blank pages, duplicate
+files saved under other names, and page labels that are not numbers (such as 'ii' or 'A-1'). The same seed and settings always make the same PDFs, so runs on different days (or computers) can be compared.
+
+Usage: python Benchmarks/SyntheticCorpus.py path/to/new/folder [--documents N] [--pages N] [--long F] [--fragments F] [--hyphenate F] [--duplicates F] [--labels F] [--seed N]
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import sys # Critical - Reads the command line arguments.
+import random # Critical - Generates the random text.
+import shutil # Critical - Copies PDFs to make the duplicate files.
+import argparse # Critical - Reads the command line arguments.
+import pymupdf # Critical - Writes the PDFs.
+
+#####----- Settings -----#####
+words = ['salmon', 'wildfire', 'habitat', 'river', 'sediment', 'temperature', 'spawning', 'survey', 'results', 'effect', 'analysis',
+         'study', 'population', 'restoration', 'forest', 'stream', 'water', 'quality', 'fish', 'data', 'watershed', 'vegetation',
+         'erosion', 'monitoring', 'recovery', 'riparian', 'juvenile', 'abundance', 'precipitation', 'management', 'assessment', 'mortality']
+authors = ['Smith', 'Tremblay', 'Nguyen', 'Roy', 'Wilson', 'Gagnon', 'Martin', 'Lee', 'Brown', 'Singh']
+
+# The layout of the corpus. Each value is the fraction of paragraphs, line breaks or files it applies to.
+defaultLayout = {'long': 0.15, # Long paragraphs of 15 to 60 sentences, which the chunker splits.
+                 'fragments': 0.3, # Short fragments of 1 to 8 words, such as headings and captions, which the chunker merges.
+                 'hyphenate': 0.5, # Long words at the end of a line that are hyphenated and continued on the next line.
+                 'blank': 0.03, # Pages with no text.
+                 'duplicates': 0.05, # Extra files that are copies of other files, saved under other names.
+                 'labels': 0.2} # PDFs with page labels like a printed report: roman numerals for the front matter ('i', 'ii'), then an appendix prefix ('A-1').
+
+lineWidth = 95 # The most characters on a line of a page.
+linesPerPage = 60 # The most lines on a page.
+
+#####----- Generate Text -----#####
+
+def sentence(rng):
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(4, 30))).capitalize() + '.'
+
+# Makes the text of one paragraph, which is a long paragraph, a short fragment or an ordinary paragraph (see defaultLayout).
+def paragraph(rng, layout):
+    kind = rng.random()
+    if kind < layout['long']:
+        return ' '.join(sentence(rng) for _ in range(rng.randint(15, 60)))
+    if kind < layout['long'] + layout['fragments']:
+        return ' '.join(rng.choice(words) for _ in range(rng.randint(1, 8))).capitalize()
+    return ' '.join(sentence(rng) for _ in range(rng.randint(1, 8)))
+
+# This function breaks a paragraph into lines of at most lineWidth characters, the way it would be laid out on a page.
+# Some long words that do not fit at the end of a line are hyphenated, with the rest of the word at the start of the next line.
+def wrapLines(text, rng, layout):
+    lines = []
+    line = ''
+    for word in text.split(' '):
+        if len(line) + len(word) + 1 <= lineWidth:
+            line = f'{line} {word}' if line else word
+            continue
+        room = lineWidth - len(line) - 2 # The space before the word and the hyphen after it.
+        if len(word) >= 6 and room >= 3 and rng.random() < layout['hyphenate']:
+            cut = rng.randint(3, min(room, len(word) - 3))
+            lines.append(f'{line} {word[:cut]}-')
+            line = word[cut:]
+        else:
+            lines.append(line)
+            line = word
+    if line:
+        lines.append(line)
+    return lines
+
+#####----- Generate PDFs -----#####
+
+# This function writes one synthetic PDF with pageCount pages to path, with a title, author, subject and keywords.
+# If labelled is True, the pages are labelled 'i', 'ii', ... then 'A-1', 'A-2', ... rather than numbered.
+def writePdf(path, pageCount, rng, layout, number, labelled=False):
+    pdf = pymupdf.open()
+    pdf.set_metadata({'title': f'Synthetic Report {number}', 'author': rng.choice(authors), 'subject': ' '.join(rng.sample(words, 2)),
+                      'keywords': ', '.join(rng.sample(words, 4))})
+    for _ in range(pageCount):
+        page = pdf.new_page()
+        if rng.random() < layout['blank']:
+            continue
+        lines = []
+        while len(lines) < linesPerPage:
+            lines.extend(wrapLines(paragraph(rng, layout), rng, layout))
+        page.insert_text((50, 50), '\n'.join(lines[:linesPerPage]), fontsize=7)
+    if labelled:
+        front = (pageCount + 1) // 2 # The first half of the pages are the front matter.
+        pdf.set_page_labels([{'startpage': 0, 'prefix': '', 'style': 'r', 'firstpagenum': 1},
+                             {'startpage': front, 'prefix': 'A-', 'style': 'D', 'firstpagenum': 1}][:2 if front < pageCount else 1])
+    pdf.save(path, garbage=3, deflate=True)
+    pdf.close()
+
+# This function generates a corpus of synthetic PDFs in folder, with documents PDFs of 1 to maxPages pages each (plus the duplicate files),
+# spread over a few subfolders. Any layout settings that are not given use defaultLayout. Returns the paths of the PDFs.
+def makeCorpus(folder, documents=100, maxPages=20, seed=0, layout=None):
+    layout = {**defaultLayout, **(layout or {})}
+    rng = random.Random(seed)
+    labelRng = random.Random(f'labels-{seed}') # Separate from rng, so that labelling pages does not change the text of the PDFs.
+    paths = []
+    for number in range(documents):
+        subfolder = os.path.join(folder, f'Collection_{number % 4}')
+        os.makedirs(subfolder, exist_ok=True)
+        path = os.path.join(subfolder, f'Report_{number:05d}.pdf')
+        writePdf(path, rng.randint(1, maxPages), rng, layout, number, labelRng.random() < layout['labels'])
+        paths.append(path)
+
+    # Copy some of the PDFs under other names, as happens when the same report is saved in several places.
+    for number in range(round(documents * layout['duplicates'])):
+        path = os.path.join(folder, 'Duplicates', f'Copy_{number:05d}.pdf')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(rng.choice(paths[:documents]), path)
+        paths.append(path)
+    return paths
+
+# Adds the command line arguments that set the size and layout of a corpus to parser. Used by this script and by PipelineBenchmark.
+def addCorpusArguments(parser):
+    parser.add_argument('--documents', type=int, default=100, help='The number of PDFs to generate, not counting the duplicates.')
+    parser.add_argument('--pages', type=int, default=20, help='The most pages in each PDF. Each PDF has between 1 and this many pages.')
+    for name, value in defaultLayout.items():
+        parser.add_argument(f'--{name}', type=float, default=value, help=f'See defaultLayout in SyntheticCorpus (default {value}).')
+    parser.add_argument('--seed', type=int, default=0, help='The seed used to generate the text. The same seed and settings make the same PDFs.')
+
+# Returns the layout settings given on the command line (see addCorpusArguments).
+def layoutArguments(args):
+    return {name: getattr(args, name) for name in defaultLayout}
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a folder of synthetic PDFs to benchmark with.')
+    parser.add_argument('folder', help='The folder to save the PDFs in.')
+    addCorpusArguments(parser)
+    args = parser.parse_args()
+
+    paths = makeCorpus(args.folder, args.documents, args.pages, args.seed, layoutArguments(args))
+    size = sum(os.path.getsize(path) for path in paths)
+    print(f'Generated {len(paths)} PDFs ({size / 2**20:.1f} MB) in {args.folder}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
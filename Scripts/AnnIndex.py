@@ -0,0 +1,206 @@
+'''
+This script builds and searches an approximate nearest-neighbour index for the embeddings of a library segment (see EncodedLibrary).
+Without an index, every search compares the query with every chunk in the library, so searches get slower as the library grows.
+
+The index is an inverted file (IVF): the embeddings are grouped into clusters with k-means, and each cluster keeps the list of rows closest
+to its centre. A search compares the query with the cluster centres first, then only with the rows of the few closest clusters (probes).
+More probes find more of the true best matches (higher recall) but take longer. Segments smaller than minRows are always searched exactly,
+as the index would not make them noticeably faster.
+
+The index of a segment is saved in the segment's folder as index.npz. It is built when the segment is written, or the first time
+a segment without one is loaded, and never changes afterwards, as segments are never changed once written.
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import numpy as np # Critical - Reads and writes the index.
+import torch # Critical - Does the k-means and search arithmetic.
+import Quantize # Critical - Scores the compressed copies of the embeddings.
+
+#####----- Settings -----#####
+indexFile = 'index.npz' # The name of the index file within a segment folder.
+minRows = 20000 # Segments with fewer rows than this are searched exactly and are not given an index.
+trainRows = 50000 # The number of rows sampled to find the cluster centres. The rest are only assigned to their closest centre.
+iterations = 12 # The number of k-means iterations used to find the cluster centres.
+blockRows = 65536 # The number of rows compared with the cluster centres at a time, to limit memory use.
+defaultProbes = 32 # The number of clusters searched for each query, unless another number is given.
+blockScores = 1 << 24 # The most scores held in memory at a time when many queries are searched together.
+
+#####----- Build -----#####
+
+# Scales every row to unit length, so that dot products are cosine similarities.
+def normalize(embeddings):
+    return torch.nn.functional.normalize(embeddings.float(), dim=1)
+
+# Returns one over the length of every row of the embeddings (which can be memory-mapped), a block at a time. Multiplying the dot products
+# of the rows with a normalized query by these gives their cosine similarities, without keeping a normalized copy of the embeddings.
+def inverseNorms(embeddings):
+    norms = torch.empty(len(embeddings))
+    for start in range(0, len(embeddings), blockRows):
+        block = embeddings[start:start + blockRows]
+        block = block.float().cpu() if isinstance(block, torch.Tensor) else torch.as_tensor(np.array(block, dtype=np.float32))
+        norms[start:start + len(block)] = 1 / block.norm(dim=1).clamp_min(1e-12)
+    return norms
+
+# Returns the number of clusters to use for a segment with the given number of rows. Around the square root of the rows keeps both
+# the number of centres and the size of each cluster small.
+def clusterCount(rows):
+    return int(min(4096, max(16, round(np.sqrt(rows)))))
+
+# Finds the closest cluster centre for every row of the embeddings, a block at a time.
+def assignClusters(embeddings, centroids):
+    assignments = np.empty(len(embeddings), dtype=np.int64)
+    for start in range(0, len(embeddings), blockRows):
+        block = normalize(torch.as_tensor(np.array(embeddings[start:start + blockRows])))
+        assignments[start:start + len(block)] = (block @ centroids.T).argmax(dim=1).numpy()
+    return assignments
+
+# This function builds the index of an array of embeddings (which can be memory-mapped). The cluster centres are found with spherical
+# k-means on a sample of the rows, then every row is added to the list of its closest centre.
+# Returns a dictionary with the centres, the rows of every list one after another (order), and where each list starts in order (offsets).
+def buildIndex(embeddings, seed=0):
+    if isinstance(embeddings, torch.Tensor):
+        embeddings = embeddings.numpy()
+    rows = len(embeddings)
+    clusters = clusterCount(rows)
+    generator = np.random.default_rng(seed)
+
+    # Find the cluster centres on a sample of the rows.
+    sample = np.sort(generator.choice(rows, size=min(rows, trainRows), replace=False))
+    sample = normalize(torch.as_tensor(np.array(embeddings[sample])))
+    centroids = sample[torch.as_tensor(generator.choice(len(sample), size=clusters, replace=False))].clone()
+    for _ in range(iterations):
+        nearest = (sample @ centroids.T).argmax(dim=1)
+        sums = torch.zeros_like(centroids).index_add_(0, nearest, sample)
+        counts = torch.bincount(nearest, minlength=clusters)
+        empty = counts == 0 # Clusters that lost all of their rows keep their previous centre.
+        sums[empty] = centroids[empty]
+        centroids = normalize(sums)
+
+    # Add every row to the list of its closest centre.
+    assignments = assignClusters(embeddings, centroids)
+    order = np.argsort(assignments, kind='stable')
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=clusters)))).astype(np.int64)
+
+    return {'centroids': centroids.numpy(), 'order': order.astype(np.int64), 'offsets': offsets}
+
+# Saves the index of a segment in the segment's folder.
+def saveIndex(folder, index):
+    tmpPath = os.path.join(folder, 'index.tmp.npz')
+    np.savez(tmpPath, **index)
+    os.replace(tmpPath, os.path.join(folder, indexFile))
+
+# Loads the index of a segment. Returns None if the segment does not have one.
+def loadIndex(folder, rows):
+    path = os.path.join(folder, indexFile)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        index = {name: data[name] for name in data.files}
+    if index['offsets'][-1] != rows: # An index that does not match the segment is ignored (and can be rebuilt).
+        return None
+    return indexTensors(index)
+
+# Turns the arrays of an index into the torch tensors used by searchSegment.
+def indexTensors(index):
+    return {'centroids': torch.as_tensor(index['centroids']), 'order': torch.as_tensor(index['order']), 'offsets': index['offsets']}
+
+# Loads the index of a segment, building and saving one first if the segment is large enough to need one and does not have it yet.
+# Returns None for segments that are searched exactly.
+def ensureIndex(folder, embeddings):
+    if len(embeddings) < minRows:
+        return None
+    index = loadIndex(folder, len(embeddings))
+    if index is None:
+        print(f'Building search index for {folder}...')
+        index = buildIndex(embeddings)
+        try:
+            saveIndex(folder, index)
+        except OSError: # If the index cannot be saved (e.g. the library is read-only), it is simply built again next time.
+            pass
+        index = indexTensors(index)
+    return index
+
+#####----- Search -----#####
+
+# This function scores some rows of a segment (select is a slice or a tensor of row numbers) against a batch of normalized queries (one per row).
+# The compressed copy of the embeddings is used if there is one (see Quantize). Otherwise, the rows are multiplied by their inverse
+# lengths (norms, see inverseNorms) if these are given, or normalized first if not. Returns a matrix with the scores of each query in a column.
+def scoreRows(queries, embeddings, select, quantized=None, norms=None):
+    if quantized is not None:
+        return Quantize.scoreQuantized(quantized, queries, select)
+    block = embeddings[select].float().cpu()
+    if norms is None:
+        return normalize(block) @ queries.T
+    return (block @ queries.T) * norms[select].unsqueeze(1)
+
+# This function finds the rows of a segment that may be close to a query, and scores them. With an index, only the rows of the
+# clusters whose centres are closest to the query are scored. Without one (index is None), every row is scored.
+# If the segment has a compressed copy of its embeddings (quantized, see Quantize), the rows are scored with it instead of the full embeddings.
+# Returns the scored rows (counted from the start of the segment) and their cosine similarities.
+def searchSegment(queryEmbedding, embeddings, index, probes=defaultProbes, quantized=None, norms=None):
+    query = normalize(queryEmbedding.cpu().reshape(1, -1))
+    rows = None # None means every row of the segment.
+    if index is not None:
+        probes = min(probes, len(index['centroids']))
+        lists = torch.topk((query @ index['centroids'].T)[0], k=probes).indices.tolist()
+        offsets = index['offsets']
+        rows = torch.cat([index['order'][offsets[l]:offsets[l + 1]] for l in lists])
+        rows = torch.sort(rows).values # Reading the rows in order is faster for memory-mapped embeddings.
+
+    if len(embeddings) == 0 or (rows is not None and len(rows) == 0):
+        return torch.zeros(0, dtype=torch.int64), torch.zeros(0)
+    scores = scoreRows(query, embeddings, slice(None) if rows is None else rows, quantized, norms)[:, 0]
+    return (torch.arange(len(embeddings)) if rows is None else rows), scores
+
+# Keeps the k best rows for each query, given the best rows and scores found so far (topRows and topScores, one row per query)
+# and the scores of some more rows (scores, one row per query, with a column for each of rows). Returns the new best rows and scores.
+def mergeTop(topRows, topScores, rows, scores, k):
+    scores = torch.cat([topScores, scores], dim=1)
+    rows = torch.cat([topRows, rows.expand(len(scores), -1)], dim=1)
+    topScores, positions = torch.topk(scores, k=min(k, scores.shape[1]), dim=1)
+    return torch.gather(rows, 1, positions), topScores
+
+# This function searches a segment for many queries at once (one per row of queries), keeping the k best rows of each. Without an index,
+# the rows are read a block at a time and every block is scored against all of the queries with one matrix multiply. With an index,
+# each cluster is read once and scored against all of the queries that probe it. Rows marked in excluded (a boolean tensor) are skipped.
+# If rows (a sorted tensor of row numbers) is given, only those rows are scored, in blocks, and the index is not used (for searches limited to some documents).
+# Returns the best rows of each query (counted from the start of the segment) and their scores, best first, with one row per query.
+# Queries with fewer than k matches are padded with rows of -1, scored -inf.
+def searchSegmentMany(queries, embeddings, index, k, probes=defaultProbes, quantized=None, norms=None, excluded=None, rows=None):
+    queries = normalize(queries.cpu().reshape(-1, embeddings.shape[1]))
+    topRows = torch.full((len(queries), k), -1, dtype=torch.int64)
+    topScores = torch.full((len(queries), k), -torch.inf)
+    if len(queries) == 0 or k == 0:
+        return topRows, topScores
+
+    if index is None or rows is not None:
+        step = max(1, min(blockRows, blockScores // len(queries))) # Fewer rows are scored at a time for larger batches of queries.
+        for start in range(0, len(embeddings) if rows is None else len(rows), step):
+            if rows is None:
+                select = slice(start, min(start + step, len(embeddings)))
+                selected = torch.arange(select.start, select.stop)
+            else:
+                select = selected = rows[start:start + step]
+            scores = scoreRows(queries, embeddings, select, quantized, norms).T
+            if excluded is not None:
+                scores[:, excluded[select]] = -torch.inf
+            topRows, topScores = mergeTop(topRows, topScores, selected, scores, k)
+    else:
+        # Find the clusters probed by each query, then group the queries by cluster.
+        probes = min(probes, len(index['centroids']))
+        lists = torch.topk(queries @ index['centroids'].T, k=probes, dim=1).indices.flatten()
+        order = torch.argsort(lists, stable=True)
+        queriesOf = torch.split(order // probes, torch.bincount(lists, minlength=len(index['centroids'])).tolist())
+        offsets = index['offsets']
+        for l, members in enumerate(queriesOf):
+            rows = index['order'][offsets[l]:offsets[l + 1]]
+            if len(members) == 0 or len(rows) == 0:
+                continue
+            rows = torch.sort(rows).values # Reading the rows in order is faster for memory-mapped embeddings.
+            scores = scoreRows(queries[members], embeddings, rows, quantized, norms).T
+            if excluded is not None:
+                scores[:, excluded[rows]] = -torch.inf
+            topRows[members], topScores[members] = mergeTop(topRows[members], topScores[members], rows, scores, k)
+
+    topRows[topScores == -torch.inf] = -1 # Skipped rows are never returned, even when a query has fewer than k matches.
+    return topRows, topScores
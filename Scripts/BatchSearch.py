@@ -0,0 +1,186 @@
+'''
+This script searches an Encoded Library for many queries from the command line, without the GUI, such as for nightly evaluations on a
+server. Queries are read from a file (or from stdin), one per line, either as plain text or as JSON objects with a "query" (and optionally
+an "id"). They are split into batches, and each batch is searched with QuickSearch.searchMany, which encodes, searches and reranks all of
+its queries together. Several batches can be searched at the same time by worker threads (which share the models and the library) or
+worker processes (which each load their own copy of the models, so they use more memory but run the models in parallel).
+
+The results are written as JSON Lines, one line per query in the same order as the queries, to a file or to stdout. When every query has
+been searched, the number of queries per second and the latency of the batches are printed to stderr (and saved as JSON with --stats).
+
+Usage: python Scripts/BatchSearch.py path/to/library [--queries queries.txt] [--output results.jsonl] [--k 10] [--workers 2] [--processes]
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import sys # Critical - Reads queries from stdin and writes results to stdout.
+import json # Critical - Reads JSON queries and writes the JSON Lines results.
+import time # Critical - Times each batch of queries.
+import argparse # Critical - Reads the command line arguments.
+import collections # Critical - Holds the batches that are being searched, in order.
+import contextlib # Critical - Keeps messages printed while loading out of the results.
+import concurrent.futures # Critical - Searches several batches at the same time, using threads or processes.
+import numpy as np # Critical - Calculates the latency percentiles.
+
+#####----- Settings -----#####
+batchSize = 64 # The number of queries searched together by each call to QuickSearch.searchMany.
+
+#####----- Read Queries -----#####
+
+# This function reads queries from an open file, one per line. Lines can be plain text, or JSON objects with a "query" and optionally an "id".
+# Queries without an id are given their line number. Blank lines are skipped. Yields (id, query) pairs.
+def readQueries(file):
+    for lineNumber, line in enumerate(file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('{'):
+            record = json.loads(line)
+            yield record.get('id', lineNumber), str(record['query'])
+        else:
+            yield lineNumber, line
+
+# Splits (id, query) pairs into lists of at most size pairs.
+def batches(pairs, size):
+    batch = []
+    for pair in pairs:
+        batch.append(pair)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+#####----- Search -----#####
+QuickSearch = None # Imported by loadSearch, so that --help does not wait for the AI packages to load.
+settings = {} # The search settings, set by loadSearch in the main process and in every worker process.
+
+# This function loads the models and the library, with the search settings to use for every batch. It is run once by the main process
+# and, with --processes, once by every worker process. Anything printed while loading is sent to stderr, so that it does not end up in the results.
+def loadSearch(libPath, searchSettings, threads=None):
+    global QuickSearch
+    if threads is not None: # Each worker process only uses its share of the processor cores.
+        import torch
+        torch.set_num_threads(threads)
+    with contextlib.redirect_stdout(sys.stderr):
+        import QuickSearch
+        QuickSearch.initializeEmbedders()
+        QuickSearch.loadLibrary(libPath)
+    settings.update(searchSettings)
+
+# This function searches a batch of (id, query) pairs. Returns the result of each query (see makeRecord) and how long the batch took in seconds.
+def searchBatch(batch):
+    start = time.perf_counter()
+    results = QuickSearch.searchMany([query for _, query in batch], settings['k'], settings['probes'], settings['rerank'], settings['filters'])
+    seconds = time.perf_counter() - start
+    return [makeRecord(queryId, query, queryResults, settings['text']) for (queryId, query), queryResults in zip(batch, results)], seconds
+
+# Turns the results of one query (see QuickSearch.searchMany) into the record written to the output file.
+def makeRecord(queryId, query, results, text=False):
+    record = {'id': queryId, 'query': query, 'results': []}
+    for result in results:
+        entry = {'chunk': int(result['Chunk']), 'bi_encoder_score': float(result['Bi_Encoder_Score']),
+                 'cross_encoder_score': None if result['Cross_Encoder_Score'] is None else float(result['Cross_Encoder_Score']),
+                 'file': str(result['File_Name']), 'path': str(result['File_Path']), 'page': str(result['Page']), 'library': str(result['Library'])}
+        if text:
+            entry['paragraph'] = result['Paragraph']
+        record['results'].append(entry)
+    return record
+
+# This function searches every batch of queries with a pool of workers, and writes the results to output in the order of the queries.
+# At most twice as many batches as there are workers are read ahead, so that large query files are never held in memory all at once.
+# Returns the number of queries searched and the time taken by each batch.
+def runBatches(queryBatches, output, executor, workers):
+    pending = collections.deque()
+    queryCount = 0
+    latencies = []
+
+    # Writes the results of the oldest batch, once it has been searched.
+    def writeOldest():
+        nonlocal queryCount
+        records, seconds = pending.popleft().result()
+        for record in records:
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        queryCount += len(records)
+        latencies.append(seconds)
+
+    for batch in queryBatches:
+        pending.append(executor.submit(searchBatch, batch))
+        if len(pending) >= 2 * workers:
+            writeOldest()
+    while pending:
+        writeOldest()
+    output.flush()
+    return queryCount, latencies
+
+# This function summarizes a batch search: how many queries were searched, how many per second, and the latency of the batches.
+def summarize(queryCount, latencies, seconds, batchSize):
+    latencies = np.asarray(latencies) * 1000
+    stats = {'queries': queryCount, 'batches': len(latencies), 'batch_size': batchSize, 'seconds': round(seconds, 3),
+             'queries_per_second': round(queryCount / seconds, 2) if seconds > 0 else 0.0}
+    if len(latencies) > 0:
+        stats['batch_latency_ms'] = {name: round(float(np.percentile(latencies, percent)), 2) for name, percent in [('p50', 50), ('p95', 95), ('p99', 99), ('max', 100)]}
+    return stats
+
+#####----- Command Line -----#####
+
+def main():
+    parser = argparse.ArgumentParser(description='Search an Encoded Library for many queries at once, writing the results as JSON Lines.')
+    parser.add_argument('library', help='The Encoded Library to search (a library folder or a .pkl file).')
+    parser.add_argument('--queries', default='-', help='A file with one query per line (plain text or JSON with a "query"). Reads stdin if this is not given.')
+    parser.add_argument('--output', default='-', help='The file the results are written to. Writes to stdout if this is not given.')
+    parser.add_argument('--k', type=int, default=10, help='The number of results per query.')
+    parser.add_argument('--probes', type=int, default=None, help='The number of clusters searched in large libraries (see AnnIndex). Defaults to AnnIndex.defaultProbes.')
+    parser.add_argument('--no-rerank', action='store_true', help='Skip the cross-encoder, and keep the results in bi-encoder order.')
+    parser.add_argument('--text', action='store_true', help='Include the text of each paragraph in the results.')
+    parser.add_argument('--filter', action='append', default=[], metavar='NAME=VALUE', help="Limit the search to some PDFs, such as --filter author=smith (see LibraryFilter). Can be given more than once.")
+    parser.add_argument('--batch-size', type=int, default=batchSize, help='The number of queries searched together.')
+    parser.add_argument('--workers', type=int, default=1, help='The number of batches searched at the same time.')
+    parser.add_argument('--processes', action='store_true', help='Use worker processes (each with its own copy of the models) instead of threads.')
+    parser.add_argument('--stats', default=None, help='A file the throughput and latency stats are also saved to, as JSON.')
+    args = parser.parse_args()
+
+    filters = {}
+    for item in args.filter:
+        name, separator, value = item.partition('=')
+        if not separator:
+            parser.error(f'Filters must be given as NAME=VALUE, not {item}.')
+        filters[name.strip()] = value
+
+    import AnnIndex
+    searchSettings = {'k': args.k, 'probes': AnnIndex.defaultProbes if args.probes is None else args.probes, 'rerank': not args.no_rerank,
+                      'text': args.text, 'filters': filters or None}
+    workers = max(1, args.workers)
+
+    print('Loading the AI models and the library...', file=sys.stderr)
+    loadStart = time.perf_counter()
+    if args.processes:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        executor = concurrent.futures.ProcessPoolExecutor(workers, initializer=loadSearch, initargs=(args.library, searchSettings, threads))
+        list(executor.map(time.sleep, [0] * workers)) # Start the workers, so that loading is not counted as search time.
+    else:
+        loadSearch(args.library, searchSettings)
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+    print(f'Loaded in {time.perf_counter() - loadStart:.1f} seconds. Searching...', file=sys.stderr)
+
+    queryFile = sys.stdin if args.queries == '-' else open(args.queries, 'r', encoding='utf-8')
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    start = time.perf_counter()
+    try:
+        with executor:
+            queryCount, latencies = runBatches(batches(readQueries(queryFile), max(1, args.batch_size)), output, executor, workers)
+    finally:
+        if queryFile is not sys.stdin:
+            queryFile.close()
+        if output is not sys.stdout:
+            output.close()
+
+    stats = summarize(queryCount, latencies, time.perf_counter() - start, args.batch_size)
+    stats.update({'workers': workers, 'mode': 'processes' if args.processes else 'threads'})
+    print(json.dumps(stats, indent=2), file=sys.stderr)
+    if args.stats:
+        with open(args.stats, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
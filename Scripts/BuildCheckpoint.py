@@ -0,0 +1,128 @@
+'''
+This script saves the progress of a library build (see ExtractPDF.createLibrary) as it goes, so that a build that is interrupted (by a crash,
+running out of memory or the Command Prompt window being closed) can carry on from where it stopped instead of starting again.
+
+Each build has a checkpoint folder in 'Encoded Libraries/Checkpoints', named after the list of PDFs being added, which holds:
+    pages.pkl               The text extracted from each PDF, appended one PDF at a time as soon as it is read (see writePages).
+    embeddings-N-HASH.npy   The embeddings of each batch of ExtractPDF.encodeBatchRows chunks, saved as soon as it is encoded. HASH identifies
+                            the chunks in the batch (and the model), so a batch is only reused for exactly the same chunks.
+When the same folder of PDFs is built again, the PDFs in pages.pkl that have not changed since are not read again, and the chunks are made
+from the saved text in the same way, so every batch that was already encoded is loaded rather than encoded again. The checkpoint folder
+is removed once the library has been saved.
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import time # Critical - Limits how often the extracted text is flushed to the disk.
+import pickle # Critical - Saves the text extracted from each PDF.
+import shutil # Critical - Removes the checkpoint folder once the library has been saved.
+import hashlib # Critical - Names the checkpoint folder and identifies the chunks in each batch.
+import numpy as np # Critical - Saves the embeddings of each batch.
+import torch # Critical - The embeddings are used as torch tensors by the rest of the program.
+
+#####----- Settings -----#####
+checkpointFolder = os.path.join('Encoded Libraries', 'Checkpoints') # The folder the checkpoint folder of each build is kept in.
+syncSeconds = 5 # How often (in seconds) the extracted text is forced onto the disk, so that it survives a power cut as well as a crash.
+
+#####----- Checkpoint Folder -----#####
+
+# Returns the checkpoint folder of a build of the PDFs in files. The same PDFs (in any order) always have the same folder.
+def checkpointDir(files):
+    key = hashlib.sha256('\n'.join(sorted(os.path.realpath(file) for file in files)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(checkpointFolder, f'Build-{key}')
+
+# Removes the checkpoint folder of a build, once its library has been saved.
+def removeCheckpoint(ckDir):
+    shutil.rmtree(ckDir, ignore_errors=True)
+
+#####----- Extracted Text -----#####
+
+# The size and modification time of a PDF, used to tell whether it has changed since its text was saved.
+def fileStamp(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+# This function finds the text saved by an earlier build of the same PDFs. Returns a dictionary with where the page records (see
+# ExtractPDF.readPages) of each PDF that was read without errors and has not changed since are in the file, so that they can be read one
+# PDF at a time with loadPages. If the build stopped while a PDF was being saved, that PDF is ignored and the end of the file is cut off,
+# so that more PDFs can be added after the last complete one.
+def readPages(ckDir):
+    path = os.path.join(ckDir, 'pages.pkl')
+    saved = {}
+    if not os.path.exists(path):
+        return saved
+
+    with open(path, 'rb') as f:
+        good = 0 # The end of the last complete PDF in the file.
+        while True:
+            try:
+                file, stamp, records, error = pickle.load(f)
+            except Exception: # The end of the file, or a PDF that was only partly saved when the build stopped.
+                break
+            if error is None and os.path.exists(file) and fileStamp(file) == stamp:
+                saved[file] = good
+            else:
+                saved.pop(file, None) # A PDF that failed or changed is read again.
+            good = f.tell()
+
+    if good < os.path.getsize(path):
+        with open(path, 'r+b') as f:
+            f.truncate(good)
+    return saved
+
+# Reads the page records of one PDF saved in the checkpoint, from the position given by readPages.
+def loadPages(ckDir, position):
+    with open(os.path.join(ckDir, 'pages.pkl'), 'rb') as f:
+        f.seek(position)
+        return pickle.load(f)[2]
+
+# Opens the file the text of each PDF is saved to, creating the checkpoint folder if needed. New PDFs are added to the end of the file.
+def openPages(ckDir):
+    os.makedirs(ckDir, exist_ok=True)
+    return {'file': open(os.path.join(ckDir, 'pages.pkl'), 'ab'), 'synced': time.monotonic()}
+
+# This function saves the page records of one PDF (or the error that stopped it being read) to the end of the file opened by openPages.
+# Each PDF is written in full and flushed, so it survives the program being closed. It is forced onto the disk every syncSeconds seconds.
+def writePages(pages, file, records, error=None):
+    try:
+        stamp = fileStamp(file)
+    except OSError: # The PDF was moved or deleted while it was being read, so there is nothing to resume from.
+        return
+    pickle.dump((file, stamp, records, error), pages['file'], protocol=pickle.HIGHEST_PROTOCOL)
+    pages['file'].flush()
+    if time.monotonic() - pages['synced'] > syncSeconds:
+        os.fsync(pages['file'].fileno())
+        pages['synced'] = time.monotonic()
+
+# Forces the saved text onto the disk and closes the file opened by openPages.
+def closePages(pages):
+    pages['file'].flush()
+    os.fsync(pages['file'].fileno())
+    pages['file'].close()
+
+#####----- Embeddings -----#####
+
+# Returns the name of the file the embeddings of a batch of chunks are saved in. The hash identifies the model and the chunks in the batch.
+def batchName(number, contents, modelName):
+    digest = hashlib.sha256(modelName.encode('utf-8'))
+    for content in contents:
+        digest.update(b'\0' + content.encode('utf-8'))
+    return f'embeddings-{number:05d}-{digest.hexdigest()[:16]}.npy'
+
+# This function returns the embeddings of one batch of chunks (numbered from 0 in the order the batches are made), as a numpy array.
+# If an earlier run of the same build saved this batch (with exactly the same chunks and model), it is loaded instead of encoded.
+# Otherwise encode (the function that encodes a list of chunks) is called, and the embeddings are saved as soon as they are done.
+# Returns the embeddings and whether they were loaded from the checkpoint.
+def encodeBatch(ckDir, number, contents, encode, modelName):
+    path = os.path.join(ckDir, batchName(number, contents, modelName))
+    if os.path.exists(path):
+        return np.load(path), True
+
+    embeddings = encode(contents)
+    embeddings = embeddings.cpu().numpy() if isinstance(embeddings, torch.Tensor) else np.asarray(embeddings)
+    os.makedirs(ckDir, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f: # Written under another name first, so a batch file is never left half-written.
+        np.save(f, embeddings)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+    return embeddings, False
@@ -0,0 +1,217 @@
+'''
+This script compacts an Encoded Library. Every time PDFs are added to or synced with a library, a new segment is written (see EncodedLibrary),
+and the rows of changed or deleted PDFs are only marked as deleted. Over time a library can collect many small segments and many deleted rows,
+which make it larger and slower to search. Compacting merges every segment into one and leaves out the deleted rows.
+
+Compaction streams the rows through in blocks, so it never needs more memory than one block of embeddings and the library's metadata.
+The merged segment is written alongside the old ones and only swapped in when it is complete, by replacing the library header. If the
+program stops part way through, the library is left exactly as it was. PDFs can still be searched, added or synced while a compaction runs:
+segments added in the meantime are kept, and rows deleted in the meantime stay deleted.
+
+It can be run in the background by the Interface (see compactInBackground), or by hand: python Scripts/CompactLibrary.py path/to/library
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import time # Critical - Finds files that have been left behind for a while.
+import threading # Critical - Runs compactions in the background.
+import numpy as np # Critical - Reads and writes the raw embeddings array.
+import pandas as pd # Critical - Necessary for working with extracted PDF content and metadata.
+import EncodedLibrary # Critical - Python script that saves and reads the Encoded Libraries.
+import AnnIndex # Critical - Builds the search index of the compacted segment.
+import Quantize # Critical - Writes the compressed copy of the compacted segment's embeddings.
+
+#####----- Settings -----#####
+blockRows = 20000 # The number of rows copied at a time. Each block of embeddings takes about blockRows * dimension * 4 bytes of memory.
+maxSegments = 8 # Libraries with more segments than this are compacted automatically (see needsCompaction).
+maxDeletedFraction = 0.25 # Libraries where more than this fraction of the rows have been deleted are compacted automatically.
+orphanAge = 3600 # Files not used by the library are only removed once they are this many seconds old, in case another program is still writing them.
+
+compactLock = threading.Lock() # Stops two background compactions of the same program from running at once.
+
+#####----- Compaction -----#####
+
+# Checks whether a library has collected enough segments or deleted rows that it should be compacted.
+def needsCompaction(libDir):
+    header = EncodedLibrary.readHeader(libDir)
+    deleted = len(EncodedLibrary.readDeleted(libDir, header))
+    return len(header['segments']) > maxSegments or (header['rows'] > 0 and deleted / header['rows'] > maxDeletedFraction)
+
+# Moves a list of row numbers to their place in the compacted library. rowMap gives the new row of every compacted row (or -1 if it was left out),
+# and rows after the compacted segments (from segments added during the compaction) are moved along by shift. Rows that were left out are dropped.
+def remapRows(rows, rowMap, shift):
+    rows = np.asarray(rows, dtype=np.int64)
+    compacted = rows < len(rowMap)
+    newRows = np.where(compacted, rowMap[np.minimum(rows, len(rowMap) - 1)] if len(rowMap) > 0 else -1, rows + shift)
+    return newRows[newRows >= 0]
+
+# Applies remapRows to every entry of a manifest.
+def remapManifest(manifest, rowMap, shift):
+    for entry in manifest.values():
+        rows = np.concatenate([np.arange(start, end, dtype=np.int64) for start, end in entry['rows']] + [np.zeros(0, dtype=np.int64)])
+        entry['rows'] = EncodedLibrary.rowRanges(np.sort(remapRows(rows, rowMap, shift)))
+    return manifest
+
+# Copies the rows of a library that have not been deleted into one new segment, a block at a time.
+# Returns the new segment's entry for the header, and rowMap (see remapRows).
+def writeCompacted(libDir, header, deleted):
+    dtype = np.dtype(header['dtype'])
+    keep = np.ones(header['rows'], dtype=bool)
+    keep[deleted] = False
+    rowMap = np.full(header['rows'], -1, dtype=np.int64)
+    rowMap[keep] = np.arange(int(keep.sum()), dtype=np.int64)
+
+    name = EncodedLibrary.newSegmentName()
+    finalDir = os.path.join(libDir, EncodedLibrary.segmentsFolder, name)
+    tmpDir = finalDir + '.partial'
+    os.makedirs(tmpDir)
+
+    metadata = []
+    keys = [np.zeros(0, dtype='S16')] # The key of every chunk that is kept (see EncodedLibrary.chunkKey).
+    position = 0 # The byte offset in the new text file at which the next chunk's text will be written.
+    segmentStart = 0 # The library row at which the current segment starts.
+    with open(os.path.join(tmpDir, EncodedLibrary.embeddingsFile), 'wb') as embFile, open(os.path.join(tmpDir, EncodedLibrary.textFile), 'wb') as textFile:
+        for segment in header['segments']:
+            folder = EncodedLibrary.segmentDir(libDir, segment)
+            embeddings = EncodedLibrary.mapEmbeddings(libDir, header, segment)
+            table = pd.read_parquet(os.path.join(folder, segment['metadata'])).iloc[:segment['rows']]
+            segmentKeys = EncodedLibrary.segmentKeys(libDir, header, segment)
+            text = EncodedLibrary.openText(folder)
+            segmentKeep = keep[segmentStart:segmentStart + segment['rows']]
+
+            for start in range(0, segment['rows'], blockRows):
+                blockKeep = np.flatnonzero(segmentKeep[start:start + blockRows]) + start
+                if len(blockKeep) == 0:
+                    continue
+                np.ascontiguousarray(embeddings[blockKeep], dtype=dtype).tofile(embFile)
+
+                block = table.iloc[blockKeep].copy()
+                block['Content'] = [EncodedLibrary.readText(text, offset, length) for offset, length in zip(block['Text_Offset'], block['Text_Length'])]
+                blockMetadata, position = EncodedLibrary.writeText(textFile, block, position)
+                metadata.append(blockMetadata)
+                keys.append(segmentKeys[blockKeep])
+
+            EncodedLibrary.closeText([text])
+            del embeddings
+            segmentStart += segment['rows']
+
+        for f in (embFile, textFile):
+            f.flush()
+            os.fsync(f.fileno())
+
+    if metadata:
+        metadata = pd.concat(metadata, ignore_index=True)
+    else: # If every row was deleted, keep the columns of the library.
+        metadata = EncodedLibrary.loadMetadata(libDir, header).drop(columns=['Segment']).iloc[:0]
+    metadata.to_parquet(os.path.join(tmpDir, EncodedLibrary.metadataFile), index=False)
+    np.save(os.path.join(tmpDir, EncodedLibrary.keysFile), np.concatenate(keys))
+
+    # Build the search index of the compacted segment (if it is large enough to need one) and its compressed copy (if the library uses one).
+    # The embeddings are memory-mapped so they are not all read into RAM.
+    embeddings = np.zeros((0, header['dimension']), dtype=dtype)
+    if len(metadata) > 0:
+        embeddings = np.memmap(os.path.join(tmpDir, EncodedLibrary.embeddingsFile), dtype=dtype, mode='r', shape=(len(metadata), header['dimension']))
+    if len(metadata) >= AnnIndex.minRows:
+        AnnIndex.saveIndex(tmpDir, AnnIndex.buildIndex(embeddings))
+    Quantize.writeQuantized(tmpDir, embeddings, header['quantization'])
+    del embeddings
+
+    os.replace(tmpDir, finalDir)
+    return {'name': name, 'rows': int(len(metadata)), 'textBytes': position, 'metadata': EncodedLibrary.metadataFile}, rowMap
+
+# This function compacts an Encoded Library, merging its segments into one and leaving out its deleted rows.
+# Returns True if the library was compacted, or False if there was nothing to compact.
+def compactLibrary(libDir):
+    header = EncodedLibrary.readHeader(libDir)
+    deleted = EncodedLibrary.readDeleted(libDir, header)
+    if len(header['segments']) <= 1 and len(deleted) == 0 and header['segments'][0]['name'] != '.':
+        return False
+
+    print(f'Compacting {libDir}: {len(header["segments"])} segments, {header["rows"]} rows, {len(deleted)} deleted...')
+    segment, rowMap = writeCompacted(libDir, header, deleted)
+    compacted = header['segments']
+
+    # Swap the compacted segment in. The header is re-read under the library lock, in case PDFs were added or synced during the compaction.
+    with EncodedLibrary.lockLibrary(libDir):
+        current = EncodedLibrary.readHeader(libDir)
+        if [s['name'] for s in current['segments'][:len(compacted)]] != [s['name'] for s in compacted]: # If another compaction finished first...
+            EncodedLibrary.removeQuietly(os.path.join(libDir, EncodedLibrary.segmentsFolder, segment['name']))
+            print(f'{libDir} was changed by another compaction, so this one has been discarded.')
+            return False
+
+        shift = segment['rows'] - header['rows'] # Segments added during the compaction move by the number of rows that were left out.
+        manifest = EncodedLibrary.readManifest(libDir, current)
+        if manifest is not None:
+            manifest = remapManifest(manifest, rowMap, shift)
+        newDeleted = remapRows(EncodedLibrary.readDeleted(libDir, current), rowMap, shift) # Rows deleted during the compaction stay deleted.
+
+        current['segments'] = [segment] + current['segments'][len(compacted):]
+        EncodedLibrary.commitHeader(libDir, current, manifest, newDeleted)
+
+    # Remove the old segments, now that they are no longer used.
+    for old in compacted:
+        if old['name'] == '.': # Segments from older versions of the format keep their files at the top of the library folder.
+            for name in EncodedLibrary.segmentFiles(old):
+                EncodedLibrary.removeQuietly(os.path.join(libDir, name))
+        else:
+            EncodedLibrary.removeQuietly(EncodedLibrary.segmentDir(libDir, old))
+    removeOrphans(libDir)
+
+    print(f'Compacted {libDir} to {current["rows"]} rows in {len(current["segments"])} segment(s).')
+    return True
+
+# Removes files and segments that are no longer used by a library, such as those left behind by a program that stopped part way through
+# writing, or old segments that could not be removed because they were still open. Only files older than orphanAge are removed.
+def removeOrphans(libDir):
+    with EncodedLibrary.lockLibrary(libDir):
+        header = EncodedLibrary.readHeader(libDir)
+        used = {EncodedLibrary.headerFile, EncodedLibrary.lockFile, EncodedLibrary.segmentsFolder, header['manifest'], header['deleted']}
+        for segment in header['segments']:
+            if segment['name'] == '.':
+                used.update(EncodedLibrary.segmentFiles(segment))
+            else:
+                used.add(segment['name'])
+
+        segmentsDir = os.path.join(libDir, EncodedLibrary.segmentsFolder)
+        candidates = [os.path.join(libDir, name) for name in os.listdir(libDir)]
+        if os.path.isdir(segmentsDir):
+            candidates += [os.path.join(segmentsDir, name) for name in os.listdir(segmentsDir)]
+
+        for path in candidates:
+            if os.path.basename(path) in used:
+                continue
+            try:
+                if time.time() - os.path.getmtime(path) < orphanAge:
+                    continue
+            except OSError:
+                continue
+            EncodedLibrary.removeQuietly(path)
+
+# Compacts a library in a background thread, so that searches can continue while it runs. onDone is called with the result
+# (see compactLibrary) when the compaction finishes. If a compaction is already running, nothing happens and None is returned.
+def compactInBackground(libDir, onDone=None):
+    if not compactLock.acquire(blocking=False):
+        return None
+
+    def run():
+        try:
+            result = compactLibrary(libDir)
+        except Exception as e: # A failed compaction leaves the library as it was, so the error is only reported.
+            print(f'Error: Could not compact {libDir}: {e}')
+            result = False
+        finally:
+            compactLock.release()
+        if onDone is not None:
+            onDone(result)
+
+    thread = threading.Thread(target=run, name='CompactLibrary', daemon=True)
+    thread.start()
+    return thread
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2:
+        print('Usage: python Scripts/CompactLibrary.py path/to/library')
+        sys.exit(1)
+
+    if not compactLibrary(sys.argv[1]):
+        print('The library is already compact.')
@@ -0,0 +1,186 @@
+'''
+This script keeps the embeddings of every chunk that has been encoded, in a cache on the disk that is shared by every library build and sync,
+so that the same text is never encoded twice. The same PDFs often end up in several libraries (such as per-project folders that overlap),
+and changing how PDFs are chunked leaves most chunks unchanged, so most of the encoding of a new library can often be skipped.
+
+Embeddings are found by the model, the exact version of the model as it is run (see InferenceBackend.modelRevision), and a hash of the
+chunk's text, so a different model, a new version of a model or a different backend never reuses another's embeddings.
+
+The cache is an SQLite database (Encoded Libraries/EmbeddingCache.sqlite) that can be used by several programs at once. When it is larger
+than maxCacheBytes, the embeddings that were used least recently are removed. It can be removed at any time, and is made again when it
+is next needed. Running this script directly shows what is in the cache: python Scripts/EmbeddingCache.py [--clear]
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import sys # Critical - Reads the command line arguments.
+import time # Critical - Records when each embedding was last used.
+import sqlite3 # Critical - Saves the embeddings in a database that several programs can use at once.
+import hashlib # Critical - Hashes the text of each chunk.
+import numpy as np # Critical - Converts the embeddings to and from bytes.
+import torch # Critical - Converts embeddings returned as torch tensors.
+
+#####----- Settings -----#####
+cacheEnabled = True # Whether library builds and syncs use the cache. Set to False to always encode every chunk.
+cacheFile = os.path.join('Encoded Libraries', 'EmbeddingCache.sqlite') # The file the cache is saved in.
+maxCacheBytes = 4 * 2**30 # The most embeddings (in bytes) the cache holds. The embeddings of a million chunks from a 384-dimension model take about 1.5 GB.
+evictFraction = 0.9 # When the cache is too large, the least recently used embeddings are removed until it is this fraction of maxCacheBytes.
+evictEvery = 50000 # How many new embeddings can be added before the size of the cache is checked again (it is also checked when it is closed).
+lookupRows = 500 # The number of hashes looked up with each query. SQLite limits the number of values in one query.
+
+#####----- Cache Database -----#####
+
+# Opens the cache, creating it if needed. Returns the cache (a dictionary holding the database connection), or None if the cache is
+# turned off or cannot be opened, in which case every chunk is simply encoded.
+def openCache(path=None):
+    if not cacheEnabled:
+        return None
+    path = cacheFile if path is None else path
+    try:
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        db = sqlite3.connect(path, timeout=60)
+        db.execute('PRAGMA journal_mode=WAL') # Lets other programs read the cache while embeddings are being added.
+        db.execute('''CREATE TABLE IF NOT EXISTS embeddings (model TEXT NOT NULL, revision TEXT NOT NULL, hash BLOB NOT NULL,
+                      dtype TEXT NOT NULL, dimension INTEGER NOT NULL, vector BLOB NOT NULL, used REAL NOT NULL)''')
+        db.execute('CREATE UNIQUE INDEX IF NOT EXISTS embeddingKey ON embeddings (model, revision, hash)')
+        db.execute('CREATE INDEX IF NOT EXISTS embeddingUsed ON embeddings (used)')
+        db.commit()
+    except (sqlite3.Error, OSError) as error: # The cache should never stop a build, such as when the folder cannot be written to.
+        print(f'Warning: The embedding cache could not be opened ({error}). Every chunk will be encoded.')
+        return None
+    return {'db': db, 'path': path, 'added': 0}
+
+# Removes the least recently used embeddings if the cache is too large, then closes it.
+def closeCache(cache):
+    if cache is None:
+        return
+    try:
+        evict(cache)
+    except sqlite3.Error as error:
+        print(f'Warning: The embedding cache could not be trimmed ({error}).')
+    cache['db'].close()
+
+# Returns the hash of a chunk's text, which is how its embedding is found in the cache.
+def textHash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+# Returns the total size (in bytes) and number of the embeddings in the cache.
+def cacheSize(cache):
+    size, count = cache['db'].execute('SELECT SUM(LENGTH(vector)), COUNT(*) FROM embeddings').fetchone()
+    return size or 0, count
+
+# Looks up the embeddings of a list of hashes (see textHash) for a model. Returns a dictionary with the embedding (a numpy array) of
+# each hash that was found, and marks them as just used, so that they are the last to be removed.
+def lookup(cache, modelName, revision, hashes):
+    found = {}
+    hashes = list(dict.fromkeys(hashes)) # Each hash is only looked up once.
+    for start in range(0, len(hashes), lookupRows):
+        part = hashes[start:start + lookupRows]
+        rows = cache['db'].execute(f'SELECT hash, dtype, dimension, vector FROM embeddings WHERE model = ? AND revision = ? AND hash IN ({",".join("?" * len(part))})',
+                                   [modelName, revision, *part]).fetchall()
+        for key, dtype, dimension, vector in rows:
+            found[bytes(key)] = np.frombuffer(vector, dtype=dtype).reshape(dimension)
+    if found:
+        with cache['db']:
+            cache['db'].executemany('UPDATE embeddings SET used = ? WHERE model = ? AND revision = ? AND hash = ?',
+                                    [(time.time(), modelName, revision, key) for key in found])
+    return found
+
+# Saves the embeddings (an array with one row per hash) of a list of hashes for a model. Checks the size of the cache every evictEvery embeddings.
+def store(cache, modelName, revision, hashes, embeddings):
+    now = time.time()
+    with cache['db']:
+        cache['db'].executemany('INSERT OR REPLACE INTO embeddings (model, revision, hash, dtype, dimension, vector, used) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                [(modelName, revision, key, embedding.dtype.str, int(embedding.shape[0]), embedding.tobytes(), now)
+                                 for key, embedding in zip(hashes, embeddings)])
+    cache['added'] += len(hashes)
+    if cache['added'] >= evictEvery:
+        evict(cache)
+
+# This function removes the least recently used embeddings once the cache is larger than maxCacheBytes, until it is evictFraction of
+# that size. Returns the number of embeddings removed.
+def evict(cache):
+    cache['added'] = 0
+    size, count = cacheSize(cache)
+    if size <= maxCacheBytes:
+        return 0
+
+    # Find the time of last use before which every embedding needs to be removed.
+    toFree = size - maxCacheBytes * evictFraction
+    freed = 0
+    cutoff = None
+    for used, length in cache['db'].execute('SELECT used, LENGTH(vector) FROM embeddings ORDER BY used'):
+        freed += length
+        cutoff = used
+        if freed >= toFree:
+            break
+    with cache['db']:
+        removed = cache['db'].execute('DELETE FROM embeddings WHERE used <= ?', (cutoff,)).rowcount
+    return removed
+
+#####----- Encoding -----#####
+
+# This function returns the embeddings of a list of chunks (as a numpy array), using the embeddings in the cache for every chunk that has
+# been encoded before by the same model (modelName, at the version given by revision). encode is the function that encodes a list of
+# chunks, and is only called for the chunks that are not in the cache (each distinct text once), whose embeddings are then saved to it.
+# The number of chunks found and not found are added to stats['hits'] and stats['misses']. If cache or revision is None, every chunk is encoded.
+def encodeCached(cache, contents, encode, modelName, revision, stats):
+    if cache is None or revision is None:
+        stats['misses'] += len(contents)
+        return toNumpy(encode(contents))
+
+    hashes = [textHash(text) for text in contents]
+    try:
+        found = lookup(cache, modelName, revision, hashes)
+    except sqlite3.Error as error:
+        print(f'Warning: The embedding cache could not be read ({error}).')
+        found = {}
+
+    # Encode each chunk that was not found, once.
+    missing = {}
+    for key, text in zip(hashes, contents):
+        if key not in found and key not in missing:
+            missing[key] = text
+    if missing:
+        embeddings = toNumpy(encode(list(missing.values())))
+        try:
+            store(cache, modelName, revision, list(missing), embeddings)
+        except sqlite3.Error as error:
+            print(f'Warning: The embedding cache could not be saved ({error}).')
+        found.update(zip(missing, embeddings))
+
+    hits = sum(key not in missing for key in hashes)
+    stats['hits'] += hits
+    stats['misses'] += len(hashes) - hits
+    if len(hashes) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([found[key] for key in hashes])
+
+# Converts embeddings returned by an encoder (a torch tensor or an array) to a numpy array.
+def toNumpy(embeddings):
+    return embeddings.detach().cpu().numpy() if isinstance(embeddings, torch.Tensor) else np.asarray(embeddings)
+
+# Describes the hit rate of stats (see encodeCached), for the build and sync logs.
+def hitRate(stats):
+    total = stats['hits'] + stats['misses']
+    if total == 0:
+        return 'no chunks were encoded'
+    return f"{stats['hits']} of {total} chunks were already encoded ({100 * stats['hits'] / total:.1f}%)"
+
+if __name__ == '__main__':
+    if '--clear' in sys.argv[1:]:
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(cacheFile + suffix):
+                os.remove(cacheFile + suffix)
+        print(f'Removed {cacheFile}.')
+        sys.exit(0)
+    if not os.path.exists(cacheFile):
+        print(f'{cacheFile} was not found. It is made the first time a library is created.')
+        sys.exit(0)
+    cache = openCache()
+    size, count = cacheSize(cache)
+    print(f'{cacheFile}: {count} embeddings, {size / 2**20:.1f} MB of {maxCacheBytes / 2**20:.0f} MB.')
+    for modelName, revision, rows, modelSize in cache['db'].execute('SELECT model, revision, COUNT(*), SUM(LENGTH(vector)) FROM embeddings GROUP BY model, revision'):
+        print(f'    {modelName} ({revision}): {rows} embeddings, {modelSize / 2**20:.1f} MB')
+    cache['db'].close()
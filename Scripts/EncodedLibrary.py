@@ -0,0 +1,717 @@
+'''
+This script saves and loads Encoded Libraries. An Encoded Library is a folder made of one or more immutable segments:
+
+    header.json       The format version, the name of the model that encoded the library, the dimension and dtype of the embeddings,
+                      the segments of the library (in row order), and the names of the current manifest and deleted row files.
+                      The header is always written last, so a library only changes once its new header is in place.
+    manifest-N.json   Every PDF the library was built from, with its size, modification time, content hash and the rows of the library it owns.
+    deleted-N.npy     The rows of the library that belong to PDFs which have since been changed or deleted. These rows are skipped by searches.
+    segments/         One folder per segment, each holding:
+        embeddings.bin    The embeddings as one raw array (one row per chunk). It is memory-mapped when loaded, so it is not read into RAM
+                          up front and can be shared by several processes.
+        metadata.parquet  The metadata of every chunk (file, page, title, etc.) in a columnar file, plus where its text is found in text.bin.
+        text.bin          The UTF-8 text of every chunk, one after another. Paragraphs are only read from it when they are displayed.
+        index.npz         The search index of the segment (see AnnIndex). Only segments large enough to need one have it.
+        embeddings-*.bin  A compressed copy of the embeddings, used by searches when the library uses a quantization mode (see Quantize).
+        keys.npy          A 16-byte hash of every chunk (see chunkKey), so that new chunks can be checked for duplicates without reading any text.
+
+Rows are numbered across the whole library, in segment order. Adding PDFs to a library writes a new, small segment (see addSegment)
+instead of rewriting the library, and segments are never changed once written. CompactLibrary merges the segments back together.
+
+Libraries written by versions 1 and 2 of the format keep the files of their only segment at the top of the folder. They can still be
+loaded and added to, and are treated as if that segment were named '.'.
+
+Older libraries saved as a single .pkl file can still be loaded by QuickSearch, and can be converted to the new format
+with convertPickle, or by running this script directly: python Scripts/EncodedLibrary.py path/to/library.pkl
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import json # Critical - Reads and writes the library header and manifest.
+import mmap # Critical - Reads paragraphs from the text file without loading all of it.
+import time # Critical - Waits for other processes to finish changing a library.
+import uuid # Critical - Gives every segment a unique name.
+import shutil # Critical - Removes partially written libraries.
+import pickle # Critical - Reads the Encoded Libraries saved by older versions of this program.
+import hashlib # Critical - Hashes the contents of PDFs for the manifest.
+import contextlib # Critical - Makes the lock that stops two processes from changing a library at the same time.
+import concurrent.futures # Critical - Hashes several PDFs at the same time.
+import numpy as np # Critical - Reads and writes the raw embeddings array.
+import pandas as pd # Critical - Necessary for working with extracted PDF content and metadata.
+import torch # Critical - The embeddings are used as torch tensors by the rest of the program.
+import AnnIndex # Critical - Builds the search index of large segments.
+import Quantize # Critical - Writes the compressed copies of the embeddings.
+
+#####----- Library Format -----#####
+formatVersion = 3 # The version of the library format written by this script. Increase this if the format changes.
+defaultModel = 'Snowflake/snowflake-arctic-embed-s' # The model assumed to have encoded libraries that do not record one (such as .pkl files).
+
+# The names of the files within an Encoded Library folder. Files that are rewritten when the library changes are given a
+# generation number (e.g. manifest-3.json), and the header records which generation is current.
+headerFile = 'header.json'
+embeddingsFile = 'embeddings.bin'
+metadataFile = 'metadata.parquet'
+textFile = 'text.bin'
+keysFile = 'keys.npy'
+keyColumns = ['Title', 'Author', 'Subject', 'Keywords', 'Page', 'Content'] # Chunks with the same values in all of these columns are duplicates.
+segmentsFolder = 'segments'
+lockFile = 'library.lock'
+
+# Checks whether a path points to an Encoded Library folder (rather than a .pkl file or something else).
+def isLibrary(path):
+    return os.path.isfile(os.path.join(path, headerFile))
+
+# Reads the header of an Encoded Library. Headers written by versions 1 and 2 of the format are given a list with their one segment.
+def readHeader(libDir):
+    with open(os.path.join(libDir, headerFile), 'r', encoding='utf-8') as f:
+        header = json.load(f)
+
+    if header.get('version', 0) > formatVersion: # If the library was written by a newer version of the program...
+        raise ValueError(f'{libDir} uses library format version {header["version"]}, but this program only reads up to version {formatVersion}.')
+
+    if 'segments' not in header:
+        textBytes = header.pop('textBytes', None)
+        if textBytes is None: # Libraries written by version 1 of the format do not record the size of their text.
+            textBytes = os.path.getsize(os.path.join(libDir, textFile))
+        segment = {'name': '.', 'rows': header['rows'], 'textBytes': textBytes, 'metadata': header.pop('metadata', metadataFile)}
+        header['segments'] = [segment]
+    header.setdefault('generation', 0)
+    header.setdefault('quantization', 'float32') # Libraries made before quantization was added search with their full embeddings.
+    header.setdefault('manifest', None)
+    header.setdefault('deleted', None)
+    return header
+
+# Returns the folder that holds the files of a segment.
+def segmentDir(libDir, segment):
+    if segment['name'] == '.':
+        return libDir
+    return os.path.join(libDir, segmentsFolder, segment['name'])
+
+# Returns the names of every file that can belong to a segment. This is needed for segments named '.', whose files are at the top of the library folder.
+def segmentFiles(segment):
+    return [embeddingsFile, textFile, segment['metadata'], keysFile, AnnIndex.indexFile] + Quantize.segmentFiles()
+
+# Makes a new, unique segment name.
+def newSegmentName():
+    return f'seg-{uuid.uuid4().hex[:16]}'
+
+# Writes a JSON file by writing a temporary file and then renaming it, so the file is never left half-written.
+def writeJson(path, data):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+# Removes a file or folder, ignoring errors. Files that are still open (e.g. memory-mapped on Windows) are simply left behind,
+# and are removed by a later compaction (see CompactLibrary.removeOrphans).
+def removeQuietly(path):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    except OSError:
+        pass
+
+# Stops two processes (or threads) from changing the header of a library at the same time. The lock is only held for the moment it takes to
+# read, update and write the header, never while PDFs are encoded or segments are written, so a lock older than staleAfter seconds must have
+# been left behind by a program that stopped, and is removed.
+@contextlib.contextmanager
+def lockLibrary(libDir, timeout=120, staleAfter=60):
+    lockPath = os.path.join(libDir, lockFile)
+    start = time.time()
+    while True:
+        try:
+            fd = os.open(lockPath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lockPath) > staleAfter:
+                    os.remove(lockPath)
+                    continue
+            except OSError: # If the lock was released in the meantime, try again.
+                continue
+            if time.time() - start > timeout:
+                raise TimeoutError(f'{libDir} is being changed by another program.')
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lockPath)
+
+# Writes a new generation of the manifest and deleted rows, then the header that points to them. This is the moment the library changes.
+# The files of the previous generation are removed afterwards.
+def commitHeader(libDir, header, manifest, deleted):
+    generation = header['generation'] + 1
+    oldFiles = [header['manifest'], header['deleted']]
+
+    manifestName = None
+    if manifest is not None:
+        manifestName = f'manifest-{generation}.json'
+        writeJson(os.path.join(libDir, manifestName), manifest)
+
+    deletedName = None
+    if deleted is not None and len(deleted) > 0:
+        deletedName = f'deleted-{generation}.npy'
+        np.save(os.path.join(libDir, deletedName), np.unique(np.asarray(deleted, dtype=np.int64)))
+
+    header.update({
+        'version': formatVersion,
+        'rows': sum(segment['rows'] for segment in header['segments']),
+        'generation': generation,
+        'manifest': manifestName,
+        'deleted': deletedName,
+    })
+    writeJson(os.path.join(libDir, headerFile), header)
+
+    # Remove the previous generation, now that it is no longer used.
+    for name in oldFiles:
+        if name and name not in (manifestName, deletedName):
+            removeQuietly(os.path.join(libDir, name))
+
+    return header
+
+#####----- Manifest -----#####
+
+# Hashes the contents of a file with SHA-256, reading it in blocks so large PDFs are not loaded into memory.
+def hashFile(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Records the size, modification time and content hash of a PDF. The hash is used to tell whether a PDF that appears to have changed actually has.
+def fileInfo(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': hashFile(path)}
+
+# Turns a sorted array of row numbers into a list of [start, end) ranges of consecutive rows.
+def rowRanges(rows):
+    rows = np.asarray(rows, dtype=np.int64)
+    if len(rows) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1 # Find where one run of consecutive rows ends and the next begins.
+    starts = np.concatenate(([rows[0]], rows[breaks]))
+    ends = np.concatenate((rows[breaks - 1] + 1, [rows[-1] + 1]))
+    return [[int(start), int(end)] for start, end in zip(starts, ends)]
+
+# Returns the fileInfo of every PDF in files, hashing several at the same time. PDFs that cannot be read are left out.
+def fileInfos(files, workers=8):
+    def tryInfo(file):
+        try:
+            return fileInfo(file)
+        except OSError:
+            return None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool: # Hashing reads the disk and releases the GIL, so threads are enough.
+        return {file: info for file, info in zip(files, pool.map(tryInfo, files)) if info is not None}
+
+# This function finds the PDFs in files that are byte-for-byte copies of another PDF, so that they do not need to be extracted or encoded.
+# owners holds the content hash of each PDF whose chunks are already in the library (see fileOwners), and is added to as files are checked,
+# so the first of several copies in files (in the order given) is the one that is kept. infos is the fileInfo of each PDF (see fileInfos).
+# Returns a dictionary with the PDF that each copy is a copy of.
+def findCopies(files, infos, owners):
+    copies = {}
+    for file in files:
+        if file not in infos:
+            continue
+        fileHash = infos[file]['hash']
+        if fileHash in owners:
+            copies[file] = owners[fileHash]
+        else:
+            owners[fileHash] = file
+    return copies
+
+# Returns the content hash of each PDF in a manifest whose chunks are in the library, except for the PDFs in skipPaths (such as PDFs being removed).
+def fileOwners(manifest, skipPaths=()):
+    skipPaths = set(skipPaths)
+    return {entry['hash']: path for path, entry in manifest.items() if entry.get('hash') and 'copyOf' not in entry and path not in skipPaths}
+
+# Builds the manifest of a library: an entry for every PDF in files, with the rows of the pdfTable that hold its chunks.
+# PDFs that produced no chunks (unreadable, blank or duplicates) are still recorded, so they are not extracted again by every sync.
+# The rows can be offset, for when the pdfTable is being added after the existing rows of a library. The fileInfo of the PDFs can be given
+# if it is already known (see fileInfos), and PDFs that were skipped as copies of another PDF (see findCopies) record which PDF that is.
+# PDFs in failed (those that caused errors while their text was extracted) are tried again by the next sync: they are left out, unless some
+# of their pages were read before the error, in which case they own those rows but have no size, modification time or hash, so the next
+# sync treats them as changed and replaces the rows.
+def buildManifest(files, pdfTable, rowOffset=0, infos=None, copies=None, failed=()):
+    fileRows = pdfTable.reset_index(drop=True).groupby('File_Path', sort=False).indices # The rows of the table that belong to each PDF.
+
+    manifest = {}
+    for file in failed:
+        if file in fileRows:
+            manifest[file] = {'size': None, 'mtime': None, 'hash': None, 'rows': rowRanges(np.asarray(fileRows[file], dtype=np.int64) + rowOffset)}
+    failed = set(failed)
+    for file in files:
+        if file in failed:
+            continue
+        try:
+            entry = dict(infos[file]) if infos is not None and file in infos else fileInfo(file)
+        except OSError: # If the PDF cannot be read at all, leave it out so it is tried again next time.
+            continue
+        entry['rows'] = rowRanges(np.asarray(fileRows.get(file, []), dtype=np.int64) + rowOffset)
+        if copies is not None and file in copies:
+            entry['copyOf'] = copies[file]
+        manifest[file] = entry
+    return manifest
+
+# For libraries without a manifest (such as those converted from .pkl files), this makes a manifest from the rows of the library.
+# The size, modification time and hash of each PDF are unknown, so every PDF that is still in the folder will be extracted again by the first sync (see SyncLibrary).
+def manifestFromTable(pdfTable):
+    manifest = {}
+    for file, rows in pdfTable.reset_index(drop=True).groupby('File_Path', sort=False).indices.items():
+        manifest[file] = {'size': None, 'mtime': None, 'hash': None, 'rows': rowRanges(rows)}
+    return manifest
+
+# Reads the manifest of a library. Returns None if the library does not have one (such as libraries converted from .pkl files).
+def readManifest(libDir, header=None):
+    if header is None:
+        header = readHeader(libDir)
+    if not header['manifest']:
+        return None
+    with open(os.path.join(libDir, header['manifest']), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# Reads the manifest of a library, or makes one from its rows if it does not have one.
+def readOrBuildManifest(libDir, header=None):
+    if header is None:
+        header = readHeader(libDir)
+    manifest = readManifest(libDir, header)
+    if manifest is None:
+        manifest = manifestFromTable(loadMetadata(libDir, header, columns=['File_Path']))
+    return manifest
+
+# Reads the rows of a library that have been deleted. Returns an empty array if there are none.
+def readDeleted(libDir, header=None):
+    if header is None:
+        header = readHeader(libDir)
+    if not header['deleted']:
+        return np.zeros(0, dtype=np.int64)
+    deleted = np.load(os.path.join(libDir, header['deleted']))
+    return deleted[deleted < header['rows']]
+
+# Returns the rows owned by some of the PDFs in a manifest, as one array.
+def manifestRows(manifest, paths):
+    rows = [np.zeros(0, dtype=np.int64)]
+    for path in paths:
+        if path in manifest:
+            for start, end in manifest[path]['rows']:
+                rows.append(np.arange(start, end, dtype=np.int64))
+    return np.concatenate(rows)
+
+# Moves the rows of a manifest entry along by rowOffset.
+def offsetEntry(entry, rowOffset):
+    entry = dict(entry)
+    entry['rows'] = [[start + rowOffset, end + rowOffset] for start, end in entry['rows']]
+    return entry
+
+#####----- Duplicate Chunks -----#####
+
+# Returns a 16-byte hash that identifies duplicate chunks: chunks with the same title, author, subject, keywords, page and content.
+# Takes the values of those six columns (keyColumns), in that order. Missing values are treated as blank, as pdfTable.replace('', pd.NA) does.
+def chunkKey(values):
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        digest.update(b'\0' + ('' if value is None or pd.isna(value) else str(value)).encode('utf-8'))
+    return digest.digest()
+
+# Returns the key of every chunk in a pdfTable (with a Content column), as an array of 16-byte strings.
+def tableKeys(pdfTable):
+    return np.array([chunkKey(values) for values in pdfTable.reindex(columns=keyColumns).itertuples(index=False, name=None)], dtype='S16').reshape(-1)
+
+# Returns the keys of the chunks in one segment of a library. Segments written before keys were saved have theirs worked out from their
+# text, and saved, so that this is only done once.
+def segmentKeys(libDir, header, segment):
+    folder = segmentDir(libDir, segment)
+    path = os.path.join(folder, keysFile)
+    if os.path.exists(path):
+        return np.load(path)[:segment['rows']]
+
+    table = pd.read_parquet(os.path.join(folder, segment['metadata'])).iloc[:segment['rows']]
+    text = openText(folder)
+    table['Content'] = [readText(text, offset, length) for offset, length in zip(table['Text_Offset'], table['Text_Length'])]
+    closeText([text])
+    keys = tableKeys(table)
+    try:
+        np.save(path + '.tmp.npy', keys)
+        os.replace(path + '.tmp.npy', path)
+    except OSError: # The library may be read-only, in which case the keys are worked out again next time.
+        pass
+    return keys
+
+# Returns the keys of every chunk in a library (see chunkKey) as a sorted array, leaving out deleted rows and any rows in skipRows
+# (such as the rows of PDFs that are about to be replaced). Only the keys are read, so this is fast however large the library is.
+def libraryKeys(libDir, header=None, skipRows=None):
+    if header is None:
+        header = readHeader(libDir)
+    keys = np.concatenate([np.zeros(0, dtype='S16')] + [segmentKeys(libDir, header, segment) for segment in header['segments']])
+    skip = np.concatenate([readDeleted(libDir, header), np.zeros(0, dtype=np.int64) if skipRows is None else np.asarray(skipRows, dtype=np.int64)])
+    if len(skip) > 0:
+        keys = np.delete(keys, skip[skip < len(keys)])
+    return np.unique(keys)
+
+# Makes the index used to remove duplicate chunks while a library is being built or synced. Chunks whose keys are in libraryKeys (a sorted
+# array, see libraryKeys) are already in the library, and the keys of the chunks that are kept are added to the index as they are checked.
+def dedupIndex(libraryKeys=None):
+    return {'library': np.zeros(0, dtype='S16') if libraryKeys is None else np.asarray(libraryKeys, dtype='S16'), 'added': set()}
+
+# This function checks a list of chunk keys against a dedupIndex, in order. Returns a boolean array that is True for the chunks to keep:
+# those that are not in the library and have not been kept already (including earlier in the same list).
+# Each check takes time in proportion to the number of new keys, not the size of the library.
+def dropDuplicates(index, keys):
+    keep = np.ones(len(keys), dtype=bool)
+    if len(keys) == 0:
+        return keep
+    if len(index['library']) > 0:
+        found = np.searchsorted(index['library'], np.array(keys, dtype='S16'))
+        keep = index['library'][np.minimum(found, len(index['library']) - 1)] != np.array(keys, dtype='S16')
+    for i, key in enumerate(keys):
+        if keep[i]:
+            if key in index['added']:
+                keep[i] = False
+            else:
+                index['added'].add(key)
+    return keep
+
+#####----- Save Libraries -----#####
+
+# Writes the text of every chunk in the pdfTable to an open text file, one after another, starting at the given byte offset.
+# Returns the metadata of the chunks (the pdfTable without its text, plus where each chunk's text starts and how long it is in bytes),
+# and the byte offset at which the next chunk's text would start.
+def writeText(f, pdfTable, position):
+    offsets = np.zeros(len(pdfTable), dtype=np.int64)
+    lengths = np.zeros(len(pdfTable), dtype=np.int64)
+    for i, content in enumerate(pdfTable['Content']):
+        encoded = str(content).encode('utf-8')
+        f.write(encoded)
+        offsets[i] = position
+        lengths[i] = len(encoded)
+        position += len(encoded)
+
+    metadata = pdfTable.drop(columns=['Content', 'Text_Offset', 'Text_Length', 'Segment'], errors='ignore').reset_index(drop=True)
+    metadata['Text_Offset'] = offsets
+    metadata['Text_Length'] = lengths
+    return metadata, int(position)
+
+# Starts writing a new segment of a library, which can then be written a batch of chunks at a time with appendSegment, so that a library
+# can be saved while it is still being built (see ExtractPDF.createLibrary) without holding all of its text and embeddings in memory.
+# The segment is written to a temporary folder, which closeSegment renames, so a crash part way through never leaves half a segment behind.
+# Returns the writer, which holds the open files and the metadata of the chunks written so far (the metadata is much smaller than the text).
+def openSegment(libDir, dtype=None):
+    name = newSegmentName()
+    finalDir = os.path.join(libDir, segmentsFolder, name)
+    tmpDir = finalDir + '.partial'
+    os.makedirs(tmpDir)
+    return {'name': name, 'finalDir': finalDir, 'tmpDir': tmpDir, 'dtype': dtype, 'dimension': None, 'rows': 0, 'textBytes': 0, 'metadata': [], 'keys': [],
+            'embeddings': open(os.path.join(tmpDir, embeddingsFile), 'wb'), 'text': open(os.path.join(tmpDir, textFile), 'wb')}
+
+# Appends a batch of chunks (a pdfTable with a Content column) and their embeddings to a segment opened by openSegment.
+def appendSegment(writer, pdfTable, libraryEmbeddings):
+    if isinstance(libraryEmbeddings, torch.Tensor):
+        libraryEmbeddings = libraryEmbeddings.detach().cpu().numpy()
+    libraryEmbeddings = np.ascontiguousarray(libraryEmbeddings, dtype=writer['dtype'])
+    if writer['dimension'] is None: # The first batch sets the dimension and dtype of the segment.
+        writer['dimension'], writer['dtype'] = int(libraryEmbeddings.shape[1]), libraryEmbeddings.dtype
+    elif libraryEmbeddings.shape[1] != writer['dimension']:
+        raise ValueError(f'The new embeddings have {libraryEmbeddings.shape[1]} dimensions, but the segment has {writer["dimension"]}.')
+
+    libraryEmbeddings.tofile(writer['embeddings'])
+    metadata, writer['textBytes'] = writeText(writer['text'], pdfTable, writer['textBytes'])
+    writer['metadata'].append(metadata)
+    writer['keys'].append(tableKeys(pdfTable))
+    writer['rows'] += len(pdfTable)
+
+# Finishes a segment written with appendSegment: the files are forced onto the disk, the search index and compressed copy of the embeddings
+# are made (reading the embeddings back from the disk a block at a time), and the metadata is saved. Returns the segment's entry for the header.
+# The metadata of every chunk (without its text) is left in writer['table'], so that a manifest can be built from it (see buildManifest).
+def closeSegment(writer, quantization='float32'):
+    for key in ['embeddings', 'text']:
+        writer[key].flush()
+        os.fsync(writer[key].fileno())
+        writer[key].close()
+
+    if writer['rows'] > 0:
+        libraryEmbeddings = np.memmap(os.path.join(writer['tmpDir'], embeddingsFile), dtype=writer['dtype'], mode='r', shape=(writer['rows'], writer['dimension']))
+    else:
+        libraryEmbeddings = np.zeros((0, writer['dimension'] or 0), dtype=writer['dtype'])
+
+    # Build the search index of the segment, if it is large enough to need one.
+    if len(libraryEmbeddings) >= AnnIndex.minRows:
+        AnnIndex.saveIndex(writer['tmpDir'], AnnIndex.buildIndex(libraryEmbeddings))
+
+    # Save the compressed copy of the embeddings, if the library uses one.
+    Quantize.writeQuantized(writer['tmpDir'], libraryEmbeddings, quantization)
+    del libraryEmbeddings # Close the memory map before the folder is renamed.
+
+    # Save the metadata and key (see chunkKey) of every chunk.
+    writer['table'] = pd.concat(writer['metadata'], ignore_index=True) if writer['metadata'] else pd.DataFrame()
+    writer['metadata'] = []
+    writer['table'].to_parquet(os.path.join(writer['tmpDir'], metadataFile), index=False)
+    np.save(os.path.join(writer['tmpDir'], keysFile), np.concatenate([np.zeros(0, dtype='S16')] + writer['keys']))
+    writer['keys'] = []
+
+    os.replace(writer['tmpDir'], writer['finalDir'])
+    return {'name': writer['name'], 'rows': int(writer['rows']), 'textBytes': writer['textBytes'], 'metadata': metadataFile}
+
+# Closes the files of a segment that will not be finished (such as when the build it belongs to fails), and removes it.
+def discardSegment(writer):
+    writer['embeddings'].close()
+    writer['text'].close()
+    removeQuietly(writer['tmpDir'])
+
+# Writes a pdfTable (with a Content column) and its embeddings as a new segment of a library, and returns the segment's entry for the header.
+# The segment is not part of the library until a header that lists it is written.
+def writeSegment(libDir, pdfTable, libraryEmbeddings, dtype=None, quantization='float32'):
+    writer = openSegment(libDir, dtype)
+    try:
+        appendSegment(writer, pdfTable, libraryEmbeddings)
+    except BaseException:
+        discardSegment(writer)
+        raise
+    return closeSegment(writer, quantization)
+
+# Starts saving a new Encoded Library folder. Everything is written to a temporary folder (which is returned), so a crash part way
+# through cannot leave a broken library behind. Segments are written into it (see writeSegment and openSegment), then finishLibrary moves it into place.
+def startLibrary(libDir):
+    tmpDir = libDir + '.partial'
+    removeQuietly(tmpDir) # Remove anything left over from an earlier save that did not finish.
+    os.makedirs(tmpDir)
+    return tmpDir
+
+# Writes the header of a library started with startLibrary, listing its segments, then moves the finished library into place.
+def finishLibrary(libDir, segments, dimension, dtype, modelName=defaultModel, manifest=None, deleted=None, quantization='float32'):
+    tmpDir = libDir + '.partial'
+    header = {
+        'version': formatVersion,
+        'model': modelName,
+        'rows': 0,
+        'dimension': int(dimension),
+        'dtype': str(np.dtype(dtype)),
+        'generation': 0,
+        'quantization': quantization,
+        'segments': segments,
+        'manifest': None,
+        'deleted': None,
+    }
+
+    # Save the header last. A folder without a header is never treated as a library.
+    commitHeader(tmpDir, header, manifest, deleted)
+
+    os.replace(tmpDir, libDir) # Move the finished library into place.
+    return libDir
+
+# This function saves a pdfTable (with a Content column) and its embeddings as an Encoded Library folder with a single segment.
+# A manifest (see buildManifest) and an array of deleted rows can also be saved with the library, and a quantization mode (see Quantize) chosen for searches.
+def saveLibrary(libDir, pdfTable, libraryEmbeddings, modelName=defaultModel, manifest=None, deleted=None, quantization='float32'):
+    tmpDir = startLibrary(libDir)
+
+    if isinstance(libraryEmbeddings, torch.Tensor):
+        libraryEmbeddings = libraryEmbeddings.detach().cpu().numpy()
+
+    segment = writeSegment(tmpDir, pdfTable, libraryEmbeddings, quantization=quantization)
+    return finishLibrary(libDir, [segment], libraryEmbeddings.shape[1], libraryEmbeddings.dtype, modelName, manifest, deleted, quantization)
+
+# This function adds new chunks to an Encoded Library as a new segment, so nothing that is already in the library is rewritten.
+# The cost depends on the number of new chunks rather than the size of the library.
+# The manifest is updated at the same time: newEntries (see buildManifest, with rows counted from the start of the new chunks) replace any
+# entries for the same PDFs, the PDFs in removedPaths are removed, and touchedEntries update the size and modification time of PDFs whose
+# content has not changed. The old rows of replaced and removed PDFs are marked as deleted.
+# The header is re-read under the library lock just before it is replaced, so this is safe to run while the library is being compacted.
+def addSegment(libDir, pdfTable, libraryEmbeddings, newEntries, removedPaths=(), touchedEntries=None):
+    header = readHeader(libDir)
+
+    # Write the new segment first. This is the slow part, so it is done before the library is locked.
+    segment = None
+    if len(pdfTable) > 0:
+        if libraryEmbeddings.shape[1] != header['dimension']:
+            raise ValueError(f'The new embeddings have {libraryEmbeddings.shape[1]} dimensions, but the library has {header["dimension"]}.')
+        segment = writeSegment(libDir, pdfTable, libraryEmbeddings, dtype=header['dtype'], quantization=header['quantization'])
+
+    with lockLibrary(libDir):
+        header = readHeader(libDir) # Re-read the header, in case the library was changed while the segment was being written.
+        manifest = readOrBuildManifest(libDir, header)
+
+        # Mark the old rows of removed and replaced PDFs as deleted.
+        deleted = np.concatenate([readDeleted(libDir, header), manifestRows(manifest, list(removedPaths) + list(newEntries))])
+        for path in removedPaths:
+            manifest.pop(path, None)
+
+        # The new rows come after every existing row of the library.
+        for path, entry in newEntries.items():
+            manifest[path] = offsetEntry(entry, header['rows'])
+        for path, entry in (touchedEntries or {}).items():
+            if path in manifest:
+                manifest[path].update(entry)
+
+        if segment is not None:
+            header['segments'].append(segment)
+        return commitHeader(libDir, header, manifest, deleted)
+
+# Makes a hard link to a file of a segment, so that the same file is in two libraries without being copied. If the file system cannot
+# link the file (such as when the libraries are on different drives), it is copied instead.
+def linkFile(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+# This function adds the segments of another library to this one, after this library's rows, and combines their manifests and deleted rows.
+# Nothing is re-encoded, and the files of each segment are hard linked rather than copied where possible, so this is fast however large the
+# libraries are. The other library is only removed once the header of this one lists its segments, so if the program stops part way
+# through, the other library is left as it was (and the unfinished links are removed as orphans, see CompactLibrary.removeOrphans).
+# If a PDF is in both libraries, the other library's record of its size, modification time and hash is kept, along with the rows of both.
+def attachLibrary(libDir, otherDir):
+    otherHeader = readHeader(otherDir)
+    otherManifest = readOrBuildManifest(otherDir, otherHeader)
+    otherDeleted = readDeleted(otherDir, otherHeader)
+
+    with lockLibrary(libDir):
+        header = readHeader(libDir)
+        if otherHeader['dimension'] != header['dimension'] or otherHeader['dtype'] != header['dtype']:
+            raise ValueError(f'{otherDir} cannot be added to {libDir}, as their embeddings do not match.')
+        if otherHeader.get('model') != header.get('model'):
+            print(f'Warning: {otherDir} was encoded with {otherHeader.get("model")}, but {libDir} was encoded with {header.get("model")}.')
+
+        manifest = readOrBuildManifest(libDir, header)
+        rowOffset = header['rows']
+
+        # Link the files of each segment of the other library into a new segment folder of this one. A segment from an older format
+        # (saved in the library folder itself) only has its own files linked.
+        os.makedirs(os.path.join(libDir, segmentsFolder), exist_ok=True)
+        newDirs = []
+        try:
+            for segment in otherHeader['segments']:
+                segment = dict(segment)
+                newDir = os.path.join(libDir, segmentsFolder, newSegmentName())
+                os.makedirs(newDir)
+                newDirs.append(newDir)
+                oldDir = segmentDir(otherDir, segment)
+                names = segmentFiles(segment) if segment['name'] == '.' else os.listdir(oldDir)
+                for name in names:
+                    if os.path.exists(os.path.join(oldDir, name)):
+                        linkFile(os.path.join(oldDir, name), os.path.join(newDir, name))
+                segment['name'] = os.path.basename(newDir)
+                header['segments'].append(segment)
+
+            for path, entry in otherManifest.items():
+                entry = offsetEntry(entry, rowOffset)
+                if path in manifest:
+                    entry['rows'] = manifest[path]['rows'] + entry['rows']
+                manifest[path] = entry
+
+            commitHeader(libDir, header, manifest, np.concatenate([readDeleted(libDir, header), otherDeleted + rowOffset]))
+        except BaseException: # If the header was not committed, remove the new segment folders. The other library has not been changed.
+            try:
+                committed = {segment['name'] for segment in readHeader(libDir)['segments']}
+            except Exception:
+                committed = set()
+            for newDir in newDirs:
+                if os.path.basename(newDir) not in committed:
+                    removeQuietly(newDir)
+            raise
+
+    removeQuietly(otherDir) # Only removed now that this library's header lists its segments.
+    return libDir
+
+# This function changes the quantization mode (see Quantize) of a library, writing the compressed copy of every segment that does not have one yet.
+# The full embeddings are not changed, so the mode can be changed back at any time.
+def setQuantization(libDir, mode):
+    if mode not in Quantize.modes:
+        raise ValueError(f'Unknown quantization mode: {mode}. Choose from {Quantize.modes}.')
+
+    while True:
+        # The compressed copies are written before the library is locked, as they can take a while.
+        header = readHeader(libDir)
+        for segment in header['segments']:
+            if not Quantize.hasQuantized(segmentDir(libDir, segment), mode):
+                Quantize.writeQuantized(segmentDir(libDir, segment), mapEmbeddings(libDir, header, segment), mode)
+
+        with lockLibrary(libDir):
+            header = readHeader(libDir)
+            if all(Quantize.hasQuantized(segmentDir(libDir, segment), mode) for segment in header['segments']):
+                header['quantization'] = mode
+                return commitHeader(libDir, header, readManifest(libDir, header), readDeleted(libDir, header))
+        # If segments were added in the meantime, compress those too.
+
+#####----- Load Libraries -----#####
+
+# Reads the metadata of every segment of a library into one table, in row order, with a Segment column recording which segment each row is in.
+def loadMetadata(libDir, header=None, columns=None):
+    if header is None:
+        header = readHeader(libDir)
+    tables = []
+    for i, segment in enumerate(header['segments']):
+        table = pd.read_parquet(os.path.join(segmentDir(libDir, segment), segment['metadata']), columns=columns)
+        if len(table) < segment['rows']:
+            raise ValueError(f'The metadata of segment {segment["name"]} of {libDir} does not match its number of embeddings.')
+        table = table.iloc[:segment['rows']].copy() # Only the rows recorded in the header are used, so anything left over from an unfinished write is ignored.
+        table['Segment'] = i
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+# Memory-maps the embeddings of one segment. Copy-on-write mode lets torch use the array without ever changing the file.
+def mapEmbeddings(libDir, header, segment):
+    embeddingsPath = os.path.join(segmentDir(libDir, segment), embeddingsFile)
+    rows, dimension = segment['rows'], header['dimension']
+    expectedSize = rows * dimension * np.dtype(header['dtype']).itemsize
+    if os.path.getsize(embeddingsPath) < expectedSize: # Make sure the file matches the header before mapping it.
+        raise ValueError(f'{embeddingsPath} is smaller than the size recorded in its header.')
+    if rows == 0: # Empty files cannot be memory-mapped.
+        return np.zeros((0, dimension), dtype=header['dtype'])
+    return np.memmap(embeddingsPath, dtype=header['dtype'], mode='c', shape=(rows, dimension))
+
+# This function loads an Encoded Library folder. The embeddings are memory-mapped rather than read into RAM, and the text is left on disk.
+# Returns the metadata table of every segment (see loadMetadata), a list with the embeddings of each segment (as torch tensors),
+# the header, and a list with the opened text file of each segment (see readText).
+def loadLibrary(libDir):
+    header = readHeader(libDir)
+
+    pdfTable = loadMetadata(libDir, header)
+    libraryEmbeddings = [torch.from_numpy(mapEmbeddings(libDir, header, segment)) for segment in header['segments']]
+    libraryText = [openText(segmentDir(libDir, segment)) for segment in header['segments']]
+
+    return pdfTable, libraryEmbeddings, header, libraryText
+
+# Opens the text file of a segment so that paragraphs can be read from it as needed.
+def openText(folder):
+    with open(os.path.join(folder, textFile), 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0: # Empty files cannot be memory-mapped.
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# Closes the text files opened by loadLibrary.
+def closeText(libraryText):
+    for text in libraryText:
+        if isinstance(text, mmap.mmap):
+            text.close()
+
+# Reads the text of one chunk from an opened text file, using the Text_Offset and Text_Length of its row in the metadata table.
+def readText(libraryText, offset, length):
+    return libraryText[int(offset):int(offset) + int(length)].decode('utf-8')
+
+# Reads the text of every chunk in the metadata table, in order, from the text files of its segments.
+def readAllText(pdfTable, libraryText):
+    return [readText(libraryText[segment], offset, length) for segment, offset, length in zip(pdfTable['Segment'], pdfTable['Text_Offset'], pdfTable['Text_Length'])]
+
+#####----- Convert Libraries -----#####
+
+# This function converts an Encoded Library saved as a .pkl file into an Encoded Library folder.
+# The folder is saved next to the .pkl file with the same name, unless another path is given. The .pkl file is not changed.
+def convertPickle(pklPath, libDir=None, modelName=defaultModel):
+    if libDir is None:
+        libDir = os.path.splitext(pklPath)[0]
+
+    with open(pklPath, 'rb') as f:
+        pdfTable, libraryEmbeddings = pickle.load(f)
+
+    return saveLibrary(libDir, pdfTable, libraryEmbeddings, modelName)
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2:
+        print('Usage: python Scripts/EncodedLibrary.py path/to/library.pkl [path/to/new/library/folder]')
+        sys.exit(1)
+
+    newPath = convertPickle(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f'Converted library saved here: {newPath}')
@@ -10,16 +10,31 @@ in should be relatively straightforward with PyMuPDF and Tesseract.
 import os # Critical - Base Python package needed for many functions.
 import pandas as pd # Critical - Necessary for working with extracted PDF content and metadata.
 import re # Critical - Base Python package used to modify strings.
-from sentence_transformers import SentenceTransformer # Critical - Runs Small Language Models used for semantic search.
-import pickle # Critical - Saves and reads the Encoded Libraries.
+import EncodedLibrary # Critical - Python script that saves and reads the Encoded Libraries.
+import InferenceBackend # Critical - Python script that runs the encoder with PyTorch or ONNX Runtime.
+import Metrics # Critical - Python script that records how long each stage of creating a library takes.
+import BuildCheckpoint # Critical - Python script that saves the progress of a build, so that an interrupted build can be resumed.
+import EmbeddingCache # Critical - Python script that keeps the embeddings of every chunk encoded, so that the same text is never encoded twice.
 import pymupdf # Optional - Reads the contents of PDFs. Note: If the AGPL licence is problematic, this package can be easily substituted for a different PDF reading package. 
 import tqdm # Optional - Provides progress tracking.
 import datetime # Optional - Makes a datetime string that is used to name files.
+import itertools # Critical - Base Python package used to group extracted pages by document.
+import queue # Critical - Passes batches of chunks from the extraction thread to the encoder.
+import threading # Critical - Extracts text from PDFs while earlier chunks are being encoded.
+import concurrent.futures # Optional - Extracts text from several PDFs at the same time, using multiple processes.
 
 # Raise the current working directory to the main program folder, if it is currently set to 'Scripts'.
 if os.getcwd()[-7:] == 'Scripts':
     os.chdir("..")
 
+#####----- Extraction Settings -----#####
+extractWorkers = None # The number of processes used to extract text from PDFs. None uses one per CPU core, while 1 extracts the PDFs one at a time.
+pagesPerTask = 200 # PDFs with more pages than this are split into page ranges of this size, which can be extracted by different processes.
+tasksPerWorker = 4 # The most page ranges waiting to be read (or to be collected) per process, so that the text read ahead of the encoder stays bounded.
+encodeBatchRows = 4096 # The number of chunks encoded (and saved to the checkpoint, see BuildCheckpoint) at a time.
+queuedBatches = 4 # The most batches of chunks waiting to be encoded. When the queue is full, extraction waits for the encoder to catch up.
+quantization = 'float32' # How new libraries store the embeddings used by searches: 'float32', 'float16', 'int8' or 'binary' (see Quantize).
+
 #####----- Identify PDFs -----#####
 
 #This function creates a list of file paths to all of the PDFs in the folder the user specifies.
@@ -50,42 +65,218 @@ def makeList(uPDF):
 
 #####----- Extract Text -----#####
 
-# This function will extract all of the readable text and metadata we need from the PDFs in fileList.
-# It is called within a for loop in the createLibrary function that is defined below.
-def extractText(file): # Takes the file path of a single PDF as an argument.
+# The columns of the table that is built from the extracted text. Each record produced by readPages follows this order.
+tableColumns = ['File_Name', 'File_Path', 'Title', 'Author', 'Subject', 'Keywords', 'Page', 'Content']
+
+# This generator reads the text and metadata from the pages of a single PDF and yields one record per page.
+# By default it reads the whole document, but a range of pages can be given so that very large PDFs can be split between workers.
+def readPages(file, startPage=0, endPage=None): # Takes the file path of a single PDF, and optionally the first page and the page after the last one to read.
     pdf = pymupdf.open(file) # Open a pdf
     metadata = pdf.metadata # Extract metadata if available
 
-    for i, page in enumerate(pdf): # Iterate through the document's pages. Count the pages as it goes.
-        text = page.get_text() # Extract the text content of the current page.
-        
+    if endPage is None: # If no end page was given...
+        endPage = pdf.page_count # Read to the end of the document.
+
+    try:
+        for i in range(startPage, endPage): # Iterate through the requested pages.
+            page = pdf[i]
+            text = page.get_text() # Extract the text content of the current page.
+            
+            try:
+                pageNum = str(page.get_label()) # Attempts to get the page label...
+                if not pageNum:  #But if page label is blank or None...
+                    pageNum = str(i + 1)  # Label the page number manually.
+            except IndexError: # If getting the label fails completely...
+                pageNum = str(i + 1)  # Label the page manually.
+            
+            # Clean up the extracted text by removing new lines that are unlikely to denote the end of a paragraph.
+            cText = re.sub(r'(-)\n', '', text) # Concatenate hyphenated words and remove the new line.
+            cText = re.sub(r'(?<!\.)\n', ' ', cText) # Remove any new lines that aren't preceded by a period.
+            cText = re.sub(r'(?<=e\.g\.)\n', ' ', cText) # Remove any new lines that are preceded by e.g.
+            cText = re.sub(r'(?<=i\.e\.)\n', ' ', cText) # Remove any new lines that are preceded by i.e.
+            cText = re.sub(r'(?<=et al\.)\n', ' ', cText) # Remove any new lines that are preceded by et al.
+            cText = re.sub(r'(?<=p\.)\n', ' ', cText) # Remove any new lines that are preceded by p.
+            pageNum = re.sub(r'<.*?>', '', pageNum) # Remove likely html labels from page numbers.
+
+            # Yield the metadata and text content of the page in the same order as tableColumns.
+            yield (os.path.basename(file), # The file name of the PDF.
+                   file, # The full path of the PDF.
+                   metadata.get('title'), # The title of the PDF (if available).
+                   metadata.get('author'), # The authors of the PDF (if available).
+                   metadata.get('subject'), # The subjects of the PDF (if available).
+                   metadata.get('keywords'), # The keywords of the PDF (if available).
+                   pageNum, # The page number of the current content.
+                   cText) # The content of the current page.
+    finally:
+        pdf.close() # Close the PDF, even if reading one of its pages failed.
+
+# This function will extract all of the readable text and metadata we need from a single PDF, returning one record per page.
+# It is called within a for loop in the extractFiles function that is defined below, when text is extracted serially.
+def extractText(file): # Takes the file path of a single PDF as an argument.
+    return list(readPages(file))
+
+#####----- Parallel Extraction -----#####
+
+# These functions are run inside the worker processes. They must be defined at the top level of the script so that they can be sent to the workers.
+# Errors are returned rather than raised, so that one unreadable PDF does not stop the rest of the pool.
+
+# Counts the pages in a PDF so that the work can be split into page ranges.
+def countPages(file):
+    try:
+        with pymupdf.open(file) as pdf:
+            return pdf.page_count, None
+    except Exception as e:
+        return 0, repr(e)
+
+# Reads one range of pages from a PDF. The task is a tuple of (file number, file path, first page, page after the last).
+# If a page cannot be read, the pages before it are still returned, along with the error.
+def extractRange(task):
+    fileIdx, file, startPage, endPage = task
+    records = []
+    try:
+        for record in readPages(file, startPage, endPage):
+            records.append(record)
+        return fileIdx, startPage, records, None
+    except Exception as e:
+        return fileIdx, startPage, records, repr(e)
+
+# This function extracts the text from a list of PDFs using several processes at once.
+# Every PDF is split into ranges of at most pagesPerTask pages, so a single very large PDF is shared between workers instead of holding one up.
+# Records are returned in the same order as the serial loop would produce them (by file, then by page), no matter which worker finishes first.
+# If onFile is given, it is called with the path, page records and error (or None) of each PDF as soon as all of its pages have been read,
+# in whichever order the PDFs finish, and the records are not returned (see extractFiles).
+def extractParallel(files, workers=None, pagesPerTask=200, onFile=None): # Takes the list of PDF paths, the number of worker processes (None uses every core), the page range size and the optional callback.
+
+    if workers is None: # If no worker count was given...
+        workers = os.cpu_count() or 1 # Use one worker per CPU core.
+
+    failed = {} # The PDFs that could not be read, and the first error that was returned for each of them.
+    results = {} # The records from each page range, keyed by (file number, first page) so they can be put back in order.
+    remaining = {} # The number of page ranges of each PDF that have not been read yet.
+
+    # Passes the records of a PDF to onFile once every range of its pages has been read, then forgets them.
+    def finishFile(fileIdx):
+        starts = sorted(startPage for idx, startPage in results if idx == fileIdx)
+        onFile(files[fileIdx], [record for startPage in starts for record in results.pop((fileIdx, startPage))], failed.get(fileIdx))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+
+        # Count the pages in every PDF, then break each PDF into page ranges.
+        tasks = []
+        for fileIdx, (file, (pageCount, error)) in enumerate(zip(files, pool.map(countPages, files, chunksize=16))):
+            if error is not None: # If the PDF could not be opened, it will be reported as an error below.
+                failed[fileIdx] = error
+            for startPage in range(0, pageCount, pagesPerTask):
+                tasks.append((fileIdx, file, startPage, min(startPage + pagesPerTask, pageCount)))
+            remaining[fileIdx] = -(-pageCount // pagesPerTask)
+            if onFile is not None and remaining[fileIdx] == 0: # PDFs that could not be opened or have no pages are finished straight away.
+                finishFile(fileIdx)
+
+        # Extract each page range in whichever worker is free, tracking the progress with tqdm (which is also displayed in the GUI).
+        # Only tasksPerWorker ranges per worker are handed out at a time, in file order, so that if onFile is slow (such as when the
+        # encoder is behind), the workers wait for it instead of reading the whole collection into memory.
+        taskIter = iter(tasks)
+        pending = set()
+        with tqdm.tqdm(total=len(tasks), desc='Extracting text') as progress:
+            while True:
+                for task in itertools.islice(taskIter, workers * tasksPerWorker - len(pending)):
+                    pending.add(pool.submit(extractRange, task))
+                if not pending:
+                    break
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    fileIdx, startPage, records, error = future.result()
+                    results[(fileIdx, startPage)] = records
+                    if error is not None:
+                        failed.setdefault(fileIdx, error) # Each PDF is only counted once, even if several of its page ranges failed.
+                    remaining[fileIdx] -= 1
+                    if onFile is not None and remaining[fileIdx] == 0:
+                        finishFile(fileIdx)
+                    progress.update(1)
+
+    # Put the records back in file and page order. As with the serial loop, pages that were read before an error are kept.
+    records = []
+    for key in sorted(results):
+        records.extend(results[key])
+
+    failedFiles = [files[fileIdx] for fileIdx in sorted(failed)]
+    return records, failedFiles # Returns the page records and the list of PDFs that caused errors.
+
+# This function extracts the text from a list of PDFs, either one at a time or with several processes (see extractParallel).
+# It returns the page records (in file and page order) and the list of PDFs that could not be read. The pages read from a PDF before an error are kept.
+# If onFile is given, the records of each PDF are passed to it (with the path of the PDF, and the error if it could not be read) as soon as
+# the PDF is done, instead of being returned, so that they can be saved as they go (see BuildCheckpoint).
+def extractFiles(files, workers=None, onFile=None): # Takes the list of PDF paths, the number of worker processes (defaults to extractWorkers) and the optional callback.
+
+    if workers is None: # If no worker count was given, use the setting at the top of this script.
+        workers = extractWorkers
+    if workers is None: # If that is not set either, use one worker per CPU core.
+        workers = os.cpu_count() or 1
+
+    # If several workers can be used, extract the text from several PDFs (or page ranges of large PDFs) at the same time.
+    if workers > 1 and len(files) > 1:
+        return extractParallel(files, workers, pagesPerTask, onFile)
+
+    # Otherwise, loop over all of the PDFs in the file list and extract the text from them in this process.
+    records = []
+    failedFiles = []
+    for file in files:
+        fileRecords, error = [], None
         try:
-            pageNum = str(page.get_label()) # Attempts to get the page label...
-            if not pageNum:  #But if page label is blank or None...
-                pageNum = str(i + 1)  # Label the page number manually.
-        except IndexError: # If getting the label fails completely...
-            pageNum = str(i + 1)  # Label the page manually.
-        
-        # Clean up the extracted text by removing new lines that are unlikely to denote the end of a paragraph.
-        cText = re.sub(r'(-)\n', '', text) # Concatenate hyphenated words and remove the new line.
-        cText = re.sub(r'(?<!\.)\n', ' ', cText) # Remove any new lines that aren't preceded by a period.
-        cText = re.sub(r'(?<=e\.g\.)\n', ' ', cText) # Remove any new lines that are preceded by e.g.
-        cText = re.sub(r'(?<=i\.e\.)\n', ' ', cText) # Remove any new lines that are preceded by i.e.
-        cText = re.sub(r'(?<=et al\.)\n', ' ', cText) # Remove any new lines that are preceded by et al.
-        cText = re.sub(r'(?<=p\.)\n', ' ', cText) # Remove any new lines that are preceded by p.
-        pageNum = re.sub(r'<.*?>', '', pageNum) # Remove likely html labels from page numbers.
-
-        #Append the metadata and text content to several lists (will be made into a dataframe later).
-        File_Name.append(os.path.basename(file)) # Append the file name of the PDF.
-        File_Path.append(file) # Append the full path of the PDF.
-        Page.append(pageNum) # Append the page number of the current content.
-        Content.append(cText) # Append the content of the current page.
-        Title.append(metadata.get('title')) # Append the title of the PDF (if available).
-        Author.append(metadata.get('author')) # Append the authors of the PDF (if available).
-        Subject.append(metadata.get('subject')) # Append the subjects of the PDF (if available).
-        Keywords.append(metadata.get('keywords')) # Append the keywords of the PDF (if available).
+            for record in readPages(file): # Extracts text and metadata from PDFs, one page at a time.
+                fileRecords.append(record)
+        except Exception as e: # Sometimes a PDF will be corrupted or unreadable. Rather than stopping the whole process, this will track the problematic PDF so the user can be informed.
+            error = repr(e) # The pages read before the error are kept.
+            failedFiles.append(file)
+        if onFile is not None:
+            onFile(file, fileRecords, error)
+        else:
+            records.extend(fileRecords)
+    return records, failedFiles
+
+# This function turns page records into a table of chunks, ready to be encoded. Chunks are sorted by file (keeping the chunks of each file
+# together and in order), and blank chunks are removed. It also returns the list of PDFs that had pages but no text.
+def chunkTable(records):
+
+    # Split the text content of each page into chunks that are neither too large for the SLMs to read nor too small to be meaningful,
+    # then combine all of the chunks into a dataframe. The maximum size should be well less than 500 tokens for the current SLMs and
+    # take into account the minimum chunk size that might be added back on.
+    pdfTable = pd.DataFrame(chunkCorpus(records, maxChunkSize = 1500, minChunkSize = 280), columns = tableColumns + ['Split'])
+    pdfTable = pdfTable.replace('', pd.NA)
     
-    pdf.close() # Close the PDF
+    # Identify if there are any PDFs from which no text was extracted.
+    noTextFiles = sorted(set(record[1] for record in records) - set(pdfTable['File_Path']))
+
+    pdfTable = pdfTable.sort_values(by=['File_Name', 'File_Path'], kind='stable') # Sort by file name. The sort is stable so that each file's chunks stay together and in order.
+    pdfTable = pdfTable.dropna(subset=['Content']) # Drop rows with no content/chunks.
+    return pdfTable, noTextFiles
+
+# This function loads the model we are using for semantic search (unless it has already been loaded), then uses it to encode a list of chunks.
+def encodeChunks(contents, embedder=None, progress=True):
+    if embedder is None:
+        embedder = InferenceBackend.loadEmbedder(EncodedLibrary.defaultModel)
+    return embedder.encode(contents, convert_to_tensor=True, show_progress_bar=progress)
+
+# This function returns a function that encodes a list of chunks (as a numpy array) using the embedding cache (see EmbeddingCache), so
+# that only the chunks that have never been encoded by this version of the model are encoded. The model is only loaded the first time
+# there is something to encode. The number of chunks found in the cache is added to stats (see EmbeddingCache.encodeCached).
+def cachedEncoder(cache, stats, progress=False):
+    embedder = None
+    revision = None
+    def encode(contents):
+        nonlocal embedder, revision
+        def encodeMissing(missing):
+            nonlocal embedder
+            if embedder is None:
+                embedder = InferenceBackend.loadEmbedder(EncodedLibrary.defaultModel)
+            return encodeChunks(missing, embedder, progress)
+        if cache is not None and revision is None:
+            revision = InferenceBackend.modelRevision(EncodedLibrary.defaultModel)
+            if revision is None: # The model has not been downloaded yet, so it is loaded (and downloaded) to find its version.
+                embedder = InferenceBackend.loadEmbedder(EncodedLibrary.defaultModel)
+                revision = InferenceBackend.modelRevision(EncodedLibrary.defaultModel) or '' # If the version still cannot be found, the cache is not used.
+        return EmbeddingCache.encodeCached(cache, contents, encodeMissing, EncodedLibrary.defaultModel, revision or None, stats)
+    return encode
 
 # This function will break apart any paragraphs longer than the maximum specified length.
 # Paragraphs will be split to the closest period where possible to preserve meaning as much as possible.
@@ -124,133 +315,219 @@ def fixChunks(text, max_chunk_size): # Arguments are content (a string from a PD
     
     return chunks # Returns a list of chunks that don't exceed the maximum character limit.
 
+#####----- Chunk Text -----#####
+
+# This generator splits the pages of a single document into paragraphs (as determined by new lines), then breaks apart any paragraph longer than
+# maxChunkSize with fixChunks. It yields one [page, content, split] list per paragraph, where split is 1 if the paragraph was split unnaturally.
+# Blank paragraphs are kept, as they stop short chunks from being merged into the chunk before them (see chunkDocument).
+def splitParagraphs(pages, maxChunkSize): # Takes an iterable of (page number, page text) pairs and the maximum number of characters to allow.
+    for pageNum, text in pages:
+        for paragraph in text.split('\n'):
+            paragraph = paragraph.strip() # Clean the chunk of text.
+            if len(paragraph) > maxChunkSize: # If the paragraph is greater than the maximum number of characters...
+                for chunk in fixChunks(paragraph, max_chunk_size = maxChunkSize): # Split it to meet the maximum length, and flag each piece as split.
+                    yield [pageNum, chunk, 1]
+            else:
+                yield [pageNum, paragraph, 0]
+
+# This generator turns the pages of a single document into the final chunks that are encoded. Having split everything out based on new lines
+# and other methods, there is a chance some of the chunks may be too small, so very small chunks are joined either back into the previous chunk
+# or to the following chunk. Only one chunk is held back at a time, so documents of any length can be streamed through it.
+# The rules are the same as those of the original row-by-row loop over the pdfTable, except that chunks are never merged across documents.
+# If mergeTail is True, a small chunk at the very end of the document is merged back into the chunk before it. The original loop only did this
+# for the last document in the table, so chunkCorpus sets it for the last document only.
+def chunkDocument(pages, maxChunkSize=1500, minChunkSize=280, mergeTail=False):
+    rows = splitParagraphs(pages, maxChunkSize)
+
+    prev = None # The chunk before the current one. It is only yielded once the current chunk has had the chance to merge into it.
+    cur = next(rows, None)
+
+    while cur is not None:
+        nxt = next(rows, None) # The chunk after the current one (None at the end of the document).
+
+        if len(cur[1]) < minChunkSize and cur[1] != '': # If the chunk is less than the minimum size but not blank...
+
+            # If the content was split from the preceding chunk because it exceeded the maximum character limit and the previous chunk is not blank...
+            if cur[2] == 1 and prev is not None and prev[1] != '':
+                prev[1] = f"{prev[1]} {cur[1]}" # Concatenate the content back into the previous chunk.
+                cur[1] = '' # Blank the current chunk to avoid duplication.
+
+            # Otherwise, concatenate the content with the following chunk of the same document...
+            elif nxt is not None:
+                nxt[1] = f"{cur[1]} {nxt[1]}"
+                cur[1] = ''
+                nxt[2] = None # Clear the split flag of the following chunk to prevent a logic error.
+
+            # Or merge it back into the preceding chunk if it is the last chunk of the last document.
+            elif mergeTail and prev is not None:
+                prev[1] = f"{prev[1]} {cur[1]}"
+                cur[1] = ''
+
+        if prev is not None and prev[1].strip() != '': # Yield the previous chunk (cleaned once more), unless it is blank.
+            yield prev[0], prev[1].strip(), prev[2]
+
+        prev, cur = cur, nxt
+
+    if prev is not None and prev[1].strip() != '':
+        yield prev[0], prev[1].strip(), prev[2]
+
+# This generator turns page records (in tableColumns order, grouped by document as extractText and extractParallel produce them) into chunk records.
+# Each chunk record is in tableColumns order with the Split flag added at the end. Documents are chunked one at a time, so only one document
+# needs to be held in memory at once.
+def chunkCorpus(records, maxChunkSize=1500, minChunkSize=280):
+    documents = (list(pages) for filePath, pages in itertools.groupby(records, key=lambda record: record[1])) # Group the pages by file path.
+
+    pages = next(documents, None)
+    while pages is not None:
+        following = next(documents, None) # Look ahead, so we know whether this is the last document.
+        yield from chunkPages(pages, maxChunkSize, minChunkSize, mergeTail = following is None)
+        pages = following
+
+# This generator turns the page records of a single document into chunk records (see chunkCorpus).
+def chunkPages(pages, maxChunkSize=1500, minChunkSize=280, mergeTail=False):
+    metadata = pages[0][:6] # File_Name, File_Path, Title, Author, Subject and Keywords are the same for every page of a document.
+    for pageNum, chunk, split in chunkDocument(((page[6], page[7]) for page in pages), maxChunkSize, minChunkSize, mergeTail):
+        yield (*metadata, pageNum, chunk, split)
+
+#####----- Build Pipeline -----#####
+
+# The order the PDFs are chunked and saved in: by file name, then by path, as chunkTable sorts its chunks.
+def documentOrder(files):
+    return sorted(files, key=lambda file: (os.path.basename(file), file))
+
+# This function extracts, chunks, removes duplicates from, encodes and saves a list of PDFs all at the same time, so the encoder does not
+# wait for every PDF to be read and only a few batches of chunks are held in memory, however large the collection is.
+#  - A thread extracts the text (see extractFiles) and saves it to the checkpoint (see BuildCheckpoint). As soon as a PDF and every PDF
+#    before it (in documentOrder) are done, it is chunked, and any chunks that are already in index (see EncodedLibrary.dedupIndex) are
+#    dropped, so that they are never encoded. The rest are put on a queue in batches of encodeBatchRows. If the queue already holds queuedBatches batches, the thread waits for the encoder.
+#  - This thread takes each batch off the queue, encodes it with encode (or loads it from the checkpoint), and appends it to the segment
+#    opened with EncodedLibrary.openSegment (writer).
+# The chunks are the same, and in the same order, as those of chunkTable followed by drop_duplicates, except that the last chunk of the
+# last PDF in documentOrder (rather than in the file list) is the one merged back if it is too short (see chunkDocument).
+# Returns a dictionary with the PDFs that could not be read, the PDFs with no text, and the number of PDFs resumed, chunks made and batches resumed.
+def streamLibrary(files, writer, ckDir, index, encode, trace=None, workers=None):
+    files = documentOrder(files)
+    saved = BuildCheckpoint.readPages(ckDir) # Where the text of each PDF read by an earlier, interrupted build is saved.
+    saved = {file: saved[file] for file in files if file in saved}
+    if len(saved) > 0:
+        print(f'Resuming: The text of {len(saved)} of {len(files)} PDFs was already extracted.')
+
+    stats = {'failedFiles': [], 'noTextFiles': [], 'pdfsResumed': len(saved), 'chunks': 0, 'batchesResumed': 0}
+    batches = queue.Queue(maxsize=queuedBatches) # Batches of chunks waiting to be encoded, then None once every PDF has been chunked.
+    stop = threading.Event() # Set if the encoder stops, so that extraction stops too.
+
+    # Puts a batch (or the end of the batches, or an error) on the queue, waiting if it is full.
+    def send(item):
+        while True:
+            if stop.is_set():
+                raise RuntimeError('The encoder has stopped.')
+            try:
+                batches.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    # The extraction thread.
+    def produce():
+        order = {file: idx for idx, file in enumerate(files)}
+        finished = {} # The page records of the PDFs that have been read but not yet chunked, by their place in documentOrder.
+        nextIdx = 0 # The place of the next PDF to be chunked.
+        held = [] # The pages of the last PDF with any pages, which is chunked once it is known whether it is the last one.
+        batch = []
+
+        # Chunks the pages of a PDF, removes duplicate chunks, and adds the rest to the batch, sending it to the encoder once it is full.
+        def chunkFile(pages, last):
+            nonlocal batch
+            with Metrics.stage(trace, 'chunk') as record:
+                chunks = list(chunkPages(pages, maxChunkSize = 1500, minChunkSize = 280, mergeTail = last))
+                record['items'] = record.get('items', 0) + len(chunks)
+            if len(chunks) == 0:
+                stats['noTextFiles'].append(pages[0][1])
+            stats['chunks'] += len(chunks)
+            with Metrics.stage(trace, 'deduplicate'):
+                keep = EncodedLibrary.dropDuplicates(index, [EncodedLibrary.chunkKey(chunk[2:8]) for chunk in chunks])
+                batch.extend(chunk for chunk, kept in zip(chunks, keep) if kept)
+            while len(batch) >= encodeBatchRows:
+                send(batch[:encodeBatchRows])
+                batch = batch[encodeBatchRows:]
+
+        # Chunks every PDF that is ready, in documentOrder. PDFs with no pages are skipped, as they are by chunkCorpus.
+        def release():
+            nonlocal nextIdx, held
+            while nextIdx < len(files) and (nextIdx in finished or files[nextIdx] in saved):
+                file = files[nextIdx]
+                pages = finished.pop(nextIdx) if nextIdx in finished else BuildCheckpoint.loadPages(ckDir, saved[file])
+                if len(pages) > 0:
+                    if held:
+                        chunkFile(held, last=False)
+                    held = pages
+                nextIdx += 1
+
+        # Called with the pages of each PDF as soon as it has been read.
+        def onFile(file, fileRecords, error):
+            BuildCheckpoint.writePages(pagesFile, file, fileRecords, error) # PDFs saved with an error are read again if the build is resumed.
+            if error is not None: # As with extractFiles, the pages read before the error are kept.
+                stats['failedFiles'].append(file)
+            finished[order[file]] = fileRecords
+            release()
+
+        try:
+            pagesFile = BuildCheckpoint.openPages(ckDir) # The checkpoint file the text of each PDF is saved to.
+            try:
+                release() # Start with the PDFs at the front that were saved by an earlier build.
+                with Metrics.stage(trace, 'extract') as record:
+                    extractFiles([file for file in files if file not in saved], workers, onFile=onFile)
+                    record['items'] = len(files) - len(saved) # The number of PDFs read.
+            finally:
+                BuildCheckpoint.closePages(pagesFile)
+            if held:
+                chunkFile(held, last=True)
+            if batch:
+                send(batch)
+            send(None)
+        except BaseException as error: # Pass the error on to the encoder, unless it is the encoder that stopped.
+            if not stop.is_set():
+                send(error)
+
+    producer = threading.Thread(target=produce, name='ExtractPDF', daemon=True)
+    producer.start()
+    try:
+        number = 0
+        with tqdm.tqdm(desc='Encoding', unit='chunk') as progress:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, BaseException):
+                    raise batch
+                with Metrics.stage(trace, 'encode') as record:
+                    embeddings, loaded = BuildCheckpoint.encodeBatch(ckDir, number, [chunk[7] for chunk in batch], encode, EncodedLibrary.defaultModel)
+                    record['items'] = record.get('items', 0) + len(batch)
+                with Metrics.stage(trace, 'save') as record:
+                    pdfTable = pd.DataFrame(batch, columns = tableColumns + ['Split']).replace('', pd.NA)
+                    EncodedLibrary.appendSegment(writer, pdfTable, embeddings)
+                    record['items'] = record.get('items', 0) + len(batch)
+                stats['batchesResumed'] += loaded
+                number += 1
+                progress.update(len(batch))
+    finally:
+        stop.set()
+        producer.join()
+
+    if stats['batchesResumed'] > 0:
+        print(f'Resuming: {stats["batchesResumed"]} of {number} batches of chunks were already encoded.')
+    return stats
+
 # This is the main function used to extract text from PDFs and generate the Encoded Library.
-# The only argument it takes is a boolean as to whether the library that is being created will be merged with another library.
-def createLibrary(mergeL):    
-    global File_Name, File_Path, Title, Author, Subject, Keywords, Page, Content, libName, pdfLog
+# The first argument is a boolean as to whether the library that is being created will be merged with another library.
+# The optional second argument is the number of processes used to extract text (defaults to extractWorkers, see below).
+def createLibrary(mergeL, workers=None):    
+    global libName, pdfLog
     
-    #Initialize several variables, one for each of our columns in the table we are creating
-    File_Name = [] # From file path
-    File_Path = [] 
-    Title = [] # From metadata
-    Author = [] # From metadata
-    Subject = [] # From metadata
-    Keywords = [] # From metadata
-    Page = [] # From document or generated automatically
-    Content = [] # From document
     extractErrCount = 0 # A count of the number of errors that occur when extracting text from PDFs. Displayed in the log file.
     warnFlag = False # A boolean that tracks whether any non-critical errors have occurred.
-    
-    # Loop over all of the PDFs in the file list and extract the text from them.
-    for file in fileList:
-        try:
-            extractText(file) # Extracts text and metadata from PDFs.
-        except: # Sometimes a PDF will be corrupted or unreadable. Rather than stopping the whole process, this will track the problematic PDF so the user can be informed.
-            print(f"Error: Could not extract text from {file}")
-            pdfLog += f"An error occurred while extracting text from {file}. \n" # Save a simple error message for the log file.
-            extractErrCount += 1 # Add to the error count for the log file.
-    
-    # Combine all of the lists into a dataframe
-    pdfTable = pd.DataFrame(list(zip(File_Name, File_Path, Title, Author, Subject, Keywords, Page, Content)), 
-                                     columns = ['File_Name', 'File_Path', 'Title', 'Author', 'Subject', 'Keywords', 'Page', 'Content'])
-    
-    pdfTable['Content'] = pdfTable['Content'].str.split('\n') # Split the text content of each page roughly into paragraphs (as determined by new lines)
-    pdfTable = pdfTable.explode('Content').reset_index(drop=True) # Give each paragraph it's own record
-    pdfTable['Content'] = pdfTable['Content'].str.strip() # Clean the chunks of text
-    pdfTable['Split'] = 0 # Add column to track whether chunk was unnaturally split
-
-    pdfTable['Content'] = pdfTable['Content'].astype(object) # Explicitly set type as object to hold lists
-
-    # This loop will check that each document chunk (paragraph) is not larger than the maximum size, or split it if it is.
-    # The maximum size should be well less than 500 tokens for the current SLMs and take into account the minimum chunk size that might be added back on.
-    for i in range(len(pdfTable)):
-        
-        if len(pdfTable.at[i, 'Content']) > 1500:  # If cell content is greater than 1500 characters...
-            chunks = fixChunks(pdfTable.at[i, 'Content'], max_chunk_size = 1500)  # Split chunks to meet maximum length and...
-            pdfTable.at[i, 'Content'] = chunks  # Replace cell content with list of appropriately sized strings.
-            pdfTable.at[i, 'Split'] = 1 # Add a flag to that record so we know it was split unnaturally.
-    
-    pdfTable = pdfTable.explode('Content').reset_index(drop=True) #Split the lists generated by the fixChunks function so each paragraph is its own record.
-    
-    # Having split everything out based on new lines and other methods, there is a chance some of the chunks may be too small.
-    # The following code will join very small chunks either back into the previous chunk or to the following chunk.
-    for i in range(len(pdfTable)): 
-    
-        if len(pdfTable.at[i, 'Content']) < 280 and pdfTable.at[i, 'Content'] != '': # If cell content is less than 280 characters but not blank...
+    trace = Metrics.startTrace('create_library', pdfs=len(fileList), merge=bool(mergeL)) # Records how long each stage takes (see Metrics).
 
-            # If the content was split from the preceding chunk because it exceeded the maximum character limit and the previous cell is not blank... 
-            if pdfTable.at[i, 'Split'] == 1 and pdfTable.at[i-1, 'Content'] != '': 
-                pdfTable.at[i-1, 'Content'] = f"{pdfTable.at[i-1, 'Content']} {pdfTable.at[i, 'Content']}" # Concatenate the content back into the previous cell.
-                pdfTable.at[i, 'Content'] = '' # Set the content of the cell that we added to the previous cell to now be blank (to avoid duplication).
-    
-            else: # If the content was not split from another cell though...
-                try:
-                    # Concatenate the content with the following cell as long it's from the same document, or if this is not possible...
-                    if pdfTable.at[i, 'File_Name'] == pdfTable.at[i+1, 'File_Name']: 
-                        pdfTable.at[i+1, 'Content'] = f"{pdfTable.at[i, 'Content']} {pdfTable.at[i+1, 'Content']}" 
-                        pdfTable.at[i, 'Content'] = '' # Set the content of the cell that we added to the previous cell to now be blank (to avoid duplication).
-                        pdfTable.at[i+1, 'Split'] = None # Clear the split column if something is there to prevent a logic error.
-                        
-                except: 
-                    # Merge the content back into the preceding cell if i+1 is out of bounds or part of another document.
-                    pdfTable.at[i-1, 'Content'] = f"{pdfTable.at[i-1, 'Content']} {pdfTable.at[i, 'Content']}" #Concatenate the content with the previous cell
-                    pdfTable.at[i, 'Content'] = '' # Set the content of the cell that we added to the previous cell to now be blank (to avoid duplication).
-
-    # Clean the content once more in case the concatenating introduced weird strings.
-    pdfTable['Content'] = pdfTable['Content'].str.strip()
-    pdfTable = pdfTable.replace('', pd.NA)
-    
-    # Identify if there are any PDFs from which no text was extracted.
-    noTextCount = pdfTable.groupby('File_Path')['Content'].count()
-    noTextCount = noTextCount[noTextCount == 0]
-
-    # If applicable, add a message to the Command Prompt window and log file informing the user that no text was extracted from this PDF.
-    for File_Path in noTextCount.index:
-        print(f'Warning: No text was found in {File_Path}. Is it machine-readable?')
-        pdfLog += f'Warning: No text was found in {File_Path}. Is it machine-readable? \n'
-    
-    # Clean up the pdfTable one last time.
-    pdfTable = pdfTable.sort_values(by='File_Name') # Sort by file name.
-    pdfTable = pdfTable.dropna(subset=['Content']) # Drop rows with no content/chunks.
-    pdfTable = pdfTable.drop_duplicates(subset=['Title', 'Author', 'Subject', 'Keywords', 'Page', 'Content']) # Remove any rows that appear to be duplicate PDFs.
-    pdfTable = pdfTable.reset_index(drop=True) # Reset the index of the table.
-    
-    if pdfTable.shape[0] == 0: # If the pdfTable is empty...
-        raise IndexError('PDF Table cannot be blank.') # Raise an error.
-
-    # The following code checks for duplicates in another library if we are going to merge this library into it later.
-    if mergeL == True: # If we are merging this table with another library...
-        from QuickSearch import pdfTable as pdfTable0 # Import the other library (currently loaded).
-
-        # Make a column to identify the source of all the records.
-        pdfTable0['Source'] = 'pdfTable0'
-        pdfTable['Source'] = 'pdfTable'
-
-        # Combine the two libraries and drop from the current library any matching records that are identified in the existing library.
-        pdfTable = pd.concat([pdfTable0, pdfTable]).drop_duplicates(subset=['Title', 'Author', 'Subject', 'Keywords', 'Page', 'Content'])
-        
-        # Remove the existing library so we are only left with records that contain new content in our current library.
-        # This way there will be no duplicates when we merge our new library with the existing one, and we don't waste effort encoding duplicate content.
-        pdfTable = pdfTable[pdfTable['Source'] == 'pdfTable'] 
-        
-        # Drop the Source column and remove the old library to get memory back.
-        pdfTable = pdfTable.drop(columns=['Source'])
-        pdfTable0 = pdfTable0.drop(columns=['Source'])
-        pdfTable = pdfTable.reset_index(drop=True)
-        del pdfTable0 #Remove this now that we no longer need it.
-
-    # After removing duplicates, raise an error message if no new content was left.
-    if pdfTable.shape[0] == 0:
-        raise ValueError('No new PDFs found.')
-    
-    #####----- Encode text blocks -----#####
-    # Load the model we are using for semantic search, then use it to encode the 'content' column of the pdfTable. 
-    
-    embedder = SentenceTransformer('Snowflake/snowflake-arctic-embed-s')
-    print("Made it to the embedding!") #zzzdebugging
-    libraryEmbeddings = embedder.encode(pdfTable['Content'].tolist(), convert_to_tensor=True, show_progress_bar=True)
-    
-    print("Past the embedder!") #zzzDebugging
     # Get the current date and time.
     currentTime = datetime.datetime.now()
 
@@ -259,16 +536,101 @@ def createLibrary(mergeL):
 
     cwd = os.getcwd() # Get the current working directory.
     
-    libName = os.path.join(cwd, 'Encoded Libraries', f'Encoded_Library-{formattedTime}.pkl') # Create a path at which the Encoded Library will be saved.
+    libName = os.path.join(cwd, 'Encoded Libraries', f'Encoded_Library-{formattedTime}') # Create a path at which the Encoded Library will be saved.
 
-    # Save the Encoded Library as a Pickle file.
-    with open(libName, 'wb') as f:
-        pickle.dump([pdfTable, libraryEmbeddings], f)
+    # Hash every PDF, so that PDFs that are byte-for-byte copies of another PDF (such as the same report saved in several folders) can be
+    # skipped before they are extracted. The hashes are also saved in the manifest.
+    with Metrics.stage(trace, 'hash') as record:
+        infos = EncodedLibrary.fileInfos(fileList)
+        record['items'] = len(infos) # The number of PDFs hashed.
+
+    # Duplicate chunks are found by their key (see EncodedLibrary.chunkKey), so that the text of every chunk does not need to be kept to find them.
+    libraryKeys = None
+    owners = {} # The content hash of each PDF that is already in the library.
+
+    # The following code checks for duplicates in another library if we are going to merge this library into it later.
+    # The PDFs and chunks that are already in the other library are dropped before they are extracted or encoded, so there will be no
+    # duplicates when we merge our new library with the existing one, and we don't waste effort encoding duplicate content.
+    if mergeL == True: # If we are merging this table with another library...
+        with Metrics.stage(trace, 'deduplicate'): # Removing the chunks that are already in the other library is part of removing duplicates.
+            import QuickSearch
+            if QuickSearch.libraryMounts: # Library folders save the key of every chunk and the hash of every PDF, so no text needs to be read.
+                otherDir = QuickSearch.libraryMounts[0]['path']
+                otherHeader = EncodedLibrary.readHeader(otherDir)
+                libraryKeys = EncodedLibrary.libraryKeys(otherDir, otherHeader)
+                owners = EncodedLibrary.fileOwners(EncodedLibrary.readOrBuildManifest(otherDir, otherHeader))
+            else: # Libraries saved as a .pkl file only have their text, so the key of each chunk is worked out from it.
+                libraryKeys = EncodedLibrary.tableKeys(QuickSearch.getLibraryTable())
+
+    # Find the copies of other PDFs. The first copy in documentOrder is kept, which is the one whose chunks drop_duplicates would have kept.
+    libraryOwners = set(owners.values()) # The PDFs in the other library.
+    copies = EncodedLibrary.findCopies(documentOrder(fileList), infos, owners)
+    copiedFromLibrary = sum(original in libraryOwners for original in copies.values()) # The number of PDFs that are already in the other library.
+    del owners, libraryOwners
+    if len(copies) > 0:
+        print(f'Skipping {len(copies)} PDFs that are copies of other PDFs.')
+
+    # Chunks that were encoded by an earlier build (of this or any other library) are loaded from the embedding cache rather than
+    # encoded again (see EmbeddingCache). The model we are using for semantic search is loaded the first time there is something to encode.
+    cache = EmbeddingCache.openCache()
+    cacheStats = {'hits': 0, 'misses': 0}
+    encodeBatch = cachedEncoder(cache, cacheStats)
+
+    #####----- Extract, chunk and encode -----#####
+    # The PDFs are extracted, chunked, encoded and saved all at the same time (see streamLibrary), into a library folder that is only
+    # moved into place once it is finished. See the EncodedLibrary script for details of the format.
+    # The text of each PDF and the embeddings of each batch of chunks are also saved to a checkpoint as the build goes (see BuildCheckpoint),
+    # so if an earlier build of the same PDFs was interrupted, the PDFs it already read are not read again, and its batches are not encoded again.
+    ckDir = BuildCheckpoint.checkpointDir(fileList)
+    tmpDir = EncodedLibrary.startLibrary(libName)
+    writer = EncodedLibrary.openSegment(tmpDir)
+    try:
+        index = EncodedLibrary.dedupIndex(libraryKeys)
+        del libraryKeys
+        stats = streamLibrary([file for file in fileList if file not in copies], writer, ckDir, index, encodeBatch, trace, workers)
+        del index
+
+        # If no text was found in any of the PDFs (other than copies of PDFs in the library they will be merged into)...
+        if stats['chunks'] == 0 and copiedFromLibrary == 0:
+            raise IndexError('PDF Table cannot be blank.') # Raise an error.
+
+        # After removing duplicates, raise an error message if no new content was left.
+        if writer['rows'] == 0:
+            raise ValueError('No new PDFs found.')
+
+        # Save the Encoded Library.
+        # The manifest records every PDF in the folder (with its size, modification time and content hash) and the rows of the library it owns,
+        # so that the library can later be synced with the folder without extracting everything again (see SyncLibrary).
+        with Metrics.stage(trace, 'save') as record:
+            segment = EncodedLibrary.closeSegment(writer, quantization)
+            pdfTable = writer.pop('table') # The metadata of every chunk in the library (without the text).
+            manifest = EncodedLibrary.buildManifest(fileList, pdfTable, infos=infos, copies=copies, failed=stats['failedFiles']) # PDFs that failed are tried again by the next sync.
+            EncodedLibrary.finishLibrary(libName, [segment], writer['dimension'], writer['dtype'], EncodedLibrary.defaultModel, manifest, quantization=quantization)
+    except BaseException:
+        if not writer['embeddings'].closed: # The segment was not finished.
+            EncodedLibrary.discardSegment(writer)
+        EncodedLibrary.removeQuietly(tmpDir) # Remove the unfinished library folder.
+        raise
+    finally:
+        EmbeddingCache.closeCache(cache)
+    BuildCheckpoint.removeCheckpoint(ckDir) # The library has been saved, so the build no longer needs to be resumed.
+
+    # Sometimes a PDF will be corrupted or unreadable. Rather than stopping the whole process, this will track the problematic PDFs so the user can be informed.
+    for file in stats['failedFiles']:
+        print(f"Error: Could not extract text from {file}")
+        pdfLog += f"An error occurred while extracting text from {file}. \n" # Save a simple error message for the log file.
+        extractErrCount += 1 # Add to the error count for the log file.
+
+    # If applicable, add a message to the Command Prompt window and log file informing the user that no text was extracted from this PDF.
+    noTextFiles = sorted(stats['noTextFiles'])
+    for File_Path in noTextFiles:
+        print(f'Warning: No text was found in {File_Path}. Is it machine-readable?')
+        pdfLog += f'Warning: No text was found in {File_Path}. Is it machine-readable? \n'
         
     #####----- Generate a Log -----#####
     logPath = os.path.join('Logs', f'{formattedTime} - PDF Extraction Log.txt') # Create a path at which the log will be saved.
     totalPDFs = len(fileList) # Count the total number of PDFs that were detected in the folder the user specified.
-    pdfNoText = len(noTextCount) # Count the number of PDFs from which no text could be extracted.
+    pdfNoText = len(noTextFiles) # Count the number of PDFs from which no text could be extracted.
     pdfsLib = pdfTable['File_Path'].nunique() # Count the number of PDFs that were added to the library in the end (errors and duplicates removed).
 
     # Generate the content of the log.
@@ -276,7 +638,9 @@ def createLibrary(mergeL):
 Total number of PDFs located: {totalPDFs}
 Number of PDFs from which no text could be extracted: {pdfNoText}
 Number of PDFs which caused unexpected errors: {extractErrCount}
+Number of PDFs skipped as copies of other PDFs: {len(copies)}
 Total number of PDFs successfully added to library (duplicates removed): {pdfsLib}
+Embedding cache: {EmbeddingCache.hitRate(cacheStats)}
 
 The encoded library is saved here: {libName}
 
@@ -291,6 +655,10 @@ Errors:
     # This boolean is used to pass a warning message to the user in the GUI if any PDFs were blank or some other error occured.
     if pdfNoText + extractErrCount != 0:
         warnFlag = True
+
+    # Record the time taken by each stage, next to the log (see Metrics).
+    Metrics.finishTrace(trace, chunks=len(pdfTable), pdfs_added=pdfsLib, failed_pdfs=extractErrCount, no_text_pdfs=pdfNoText, copied_pdfs=len(copies), pdfs_resumed=stats['pdfsResumed'],
+                        batches_resumed=stats['batchesResumed'], cache_hits=cacheStats['hits'], cache_misses=cacheStats['misses'], peak_worker_rss_mb=Metrics.peakChildMemory(), library=libName)
     
-    del pdfTable, libraryEmbeddings # Remove these potentially large variables to save memory.
-    return libName, warnFlag, logPath # Return the path to the newly created Encoded Library (.pkl file), the warning flag, and the path to where the log is saved.
\ No newline at end of file
+    del pdfTable # Remove this potentially large variable to save memory.
+    return libName, warnFlag, logPath # Return the path to the newly created Encoded Library (library folder), the warning flag, and the path to where the log is saved.
\ No newline at end of file
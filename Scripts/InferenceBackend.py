@@ -0,0 +1,196 @@
+'''
+This script loads the bi-directional encoder (used to encode PDFs and queries) and the cross-encoder (used to rerank search results)
+with the chosen inference backend. Without a GPU, encoding is the slowest part of creating a library, and ONNX Runtime usually runs
+these models noticeably faster on a CPU than PyTorch does.
+
+    torch       The models are run with PyTorch, as they always have been.
+    onnx        The models are exported to ONNX and run with ONNX Runtime.
+    onnx-int8   As onnx, but the weights of the models are also converted to 8-bit integers (dynamic quantization), which is faster still.
+
+The ONNX backends need the optional packages optimum and onnxruntime (pip install optimum[onnxruntime]). If they are not installed,
+the models are run with PyTorch instead. Exported models are saved in the Models folder, so each model is only exported once.
+
+Quantized models give slightly different embeddings and scores. Running this script directly checks that they stay close to PyTorch's:
+python Scripts/InferenceBackend.py [onnx|onnx-int8] [path/to/library]
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import shutil # Critical - Moves exported models into place.
+import time # Critical - Times the models in the parity check.
+import numpy as np # Critical - Compares the outputs of the backends in the parity check.
+from sentence_transformers import SentenceTransformer, CrossEncoder # Critical - Runs Small Language Models used for semantic search.
+
+#####----- Settings -----#####
+backends = ['torch', 'onnx', 'onnx-int8'] # The available backends.
+backend = 'torch' # The backend used to run the bi-directional encoder and the cross-encoder.
+quantizationConfig = 'avx2' # The processor instructions the int8 models are made for: 'arm64', 'avx2', 'avx512' or 'avx512_vnni'. 'avx2' runs on almost every modern x86 CPU.
+modelFolder = 'Models' # The folder in which exported models are saved.
+
+# The parity check passes when every embedding has at least this cosine similarity with PyTorch's, and the results reranked
+# by the cross-encoder keep the same top rerankDepth results, with a rank correlation of at least rankTolerance overall.
+embeddingTolerance = 0.99
+rankTolerance = 0.95
+rerankDepth = 5
+
+#####----- Load Models -----#####
+
+# Returns the folder in which a model exported to ONNX is saved. Its int8 version is saved in the same folder.
+def exportedPath(modelName):
+    return os.path.join(modelFolder, f"{modelName.replace('/', '--')}-onnx")
+
+# Returns the name of the file holding the int8 version of an exported model, within its folder.
+def quantizedFile():
+    return f'onnx/model_qint8_{quantizationConfig}.onnx'
+
+# Checks whether the packages needed by the ONNX backends are installed.
+def onnxAvailable():
+    try:
+        import onnxruntime # Optional - Runs the ONNX models.
+        import optimum.onnxruntime # Optional - Exports the models to ONNX.
+    except ImportError:
+        return False
+    return True
+
+# This function loads a model (modelClass is SentenceTransformer or CrossEncoder) with the given backend (defaults to backend).
+# The first time a model is used with an ONNX backend, it is exported (and quantized, for onnx-int8) and saved in the Models folder.
+# The export is written to a temporary folder first, so that a model that is only partly exported is never loaded.
+def loadModel(modelClass, modelName, backendName=None, **kwargs):
+    backendName = backend if backendName is None else backendName
+    if backendName not in backends:
+        raise ValueError(f'Unknown inference backend: {backendName}. Choose from {backends}.')
+    if backendName == 'torch':
+        return modelClass(modelName, **kwargs)
+    if not onnxAvailable():
+        print(f'The {backendName} backend needs optimum and onnxruntime (pip install optimum[onnxruntime]). Using PyTorch for {modelName} instead.')
+        return modelClass(modelName, **kwargs)
+
+    # Export the model to ONNX, unless this has already been done.
+    path = exportedPath(modelName)
+    if not os.path.exists(os.path.join(path, 'onnx', 'model.onnx')):
+        print(f'Exporting {modelName} to ONNX. This is only done once...')
+        tmpPath = f'{path}.tmp-{os.getpid()}'
+        modelClass(modelName, backend='onnx', **kwargs).save_pretrained(tmpPath)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmpPath, path)
+
+    if backendName == 'onnx':
+        return modelClass(path, backend='onnx', **kwargs)
+
+    # Quantize the exported model to int8, unless this has already been done.
+    if not os.path.exists(os.path.join(path, quantizedFile())):
+        print(f'Quantizing {modelName} to int8 ({quantizationConfig}). This is only done once...')
+        from sentence_transformers import export_dynamic_quantized_onnx_model # Optional - Quantizes ONNX models.
+        export_dynamic_quantized_onnx_model(modelClass(path, backend='onnx', **kwargs), quantizationConfig, path, file_suffix=f'qint8_{quantizationConfig}')
+    return modelClass(path, backend='onnx', model_kwargs={'file_name': quantizedFile()}, **kwargs)
+
+# Returns a string that identifies the exact version of a model as it is run by a backend, such as 'a1b2c3.../onnx-int8-avx2', so that
+# embeddings saved by one version are never mistaken for another's (see EmbeddingCache). For models downloaded from the Hugging Face Hub,
+# the version is the commit of the downloaded files. For models in a local folder, it is the latest modification time of its files.
+# Returns None if the model has not been downloaded yet.
+def modelRevision(modelName, backendName=None):
+    backendName = backend if backendName is None else backendName
+    if backendName != 'torch' and not onnxAvailable(): # The model is run with PyTorch instead (see loadModel).
+        backendName = 'torch'
+    if backendName == 'onnx-int8':
+        backendName = f'{backendName}-{quantizationConfig}'
+
+    if os.path.isdir(modelName):
+        revision = 'local-' + str(max((os.path.getmtime(os.path.join(root, name)) for root, dirs, names in os.walk(modelName) for name in names), default=0))
+    else:
+        try:
+            from huggingface_hub import try_to_load_from_cache # Optional - Finds the commit of a downloaded model without loading it.
+            configPath = try_to_load_from_cache(modelName, 'config.json')
+        except Exception:
+            configPath = None
+        if not isinstance(configPath, str): # The model has not been downloaded (or the version of huggingface_hub is too old).
+            return None
+        revision = os.path.basename(os.path.dirname(configPath)) # Downloaded files are saved in snapshots/<commit>/.
+    return f'{revision}/{backendName}'
+
+# Loads the bi-directional encoder used to encode PDFs and queries.
+def loadEmbedder(modelName, backendName=None):
+    return loadModel(SentenceTransformer, modelName, backendName)
+
+# Loads the cross-encoder used to rerank search results.
+def loadCrossEncoder(modelName, backendName=None, max_length=512):
+    return loadModel(CrossEncoder, modelName, backendName, max_length=max_length)
+
+#####----- Parity Check -----#####
+
+# Sample paragraphs and queries, used when the parity check is not given a library.
+sampleParagraphs = [
+    "Wildfire smoke can reduce the amount of sunlight reaching streams, lowering water temperatures for several days.",
+    "Juvenile salmon rely on cold, well-oxygenated water and are sensitive to sediment washed into rivers after fires.",
+    "The survey recorded 42 species of birds across the three study sites between April and September.",
+    "Post-fire erosion control measures include mulching, seeding and the installation of log barriers on steep slopes.",
+    "Riparian vegetation shades the channel and stabilizes the banks, which limits sediment inputs during storms.",
+    "The budget for the monitoring program was approved for a further five years, subject to annual review.",
+    "Ash deposited in streams raises turbidity and can temporarily change the pH and nutrient levels of the water.",
+    "Hatchery releases were delayed by two weeks because of high river flows in early spring.",
+    "Prescribed burning reduces fuel loads and the risk of severe wildfire in dry forest types.",
+    "Samples were analyzed for dissolved oxygen, temperature, conductivity and total suspended solids.",
+    "Salmon returns to the upper watershed declined in the three years following the 2017 wildfire.",
+    "The report recommends that culverts be replaced with bridges where fish passage is blocked.",
+]
+sampleQueries = ["how does wildfire affect salmon", "what is measured in water samples", "how can erosion be controlled after a fire"]
+
+# Returns the rank of every score in a list (0 for the highest), used to compare the order of reranked results.
+def ranks(scores):
+    order = np.argsort(-np.asarray(scores))
+    rank = np.empty(len(order))
+    rank[order] = np.arange(len(order))
+    return rank
+
+# This function compares the embeddings and reranked results of a backend with those of PyTorch, on a list of paragraphs and queries.
+# Returns whether they are within tolerance (see the settings above), and prints a report of the differences and the speed of each backend.
+def checkParity(backendName, paragraphs=sampleParagraphs, queries=sampleQueries, embedModel='Snowflake/snowflake-arctic-embed-s',
+                rerankModel='cross-encoder/ms-marco-MiniLM-L-6-v2'):
+    passed = True
+
+    # Compare the embeddings of the paragraphs and queries.
+    times = {}
+    embeddings = {}
+    for name in ['torch', backendName]:
+        embedder = loadEmbedder(embedModel, name)
+        start = time.perf_counter()
+        embeddings[name] = (embedder.encode(paragraphs, normalize_embeddings=True), embedder.encode(queries, prompt_name="query", normalize_embeddings=True))
+        times[name] = time.perf_counter() - start
+    similarity = np.concatenate([(a * b).sum(axis=1) for a, b in zip(embeddings['torch'], embeddings[backendName])])
+    passed &= bool(similarity.min() >= embeddingTolerance)
+    print(f'Embeddings: lowest cosine similarity with PyTorch {similarity.min():.4f}, mean {similarity.mean():.4f} (tolerance {embeddingTolerance}).')
+    print(f'            {times["torch"]:.2f} s with PyTorch, {times[backendName]:.2f} s with {backendName} ({times["torch"] / times[backendName]:.1f}x).')
+
+    # Compare the order in which the cross-encoder ranks the paragraphs for each query.
+    scores = {}
+    for name in ['torch', backendName]:
+        crossEncoder = loadCrossEncoder(rerankModel, name)
+        start = time.perf_counter()
+        scores[name] = [crossEncoder.predict([[query, paragraph] for paragraph in paragraphs]) for query in queries]
+        times[name] = time.perf_counter() - start
+    for query, reference, candidate in zip(queries, scores['torch'], scores[backendName]):
+        n = len(paragraphs)
+        correlation = 1 - 6 * ((ranks(reference) - ranks(candidate)) ** 2).sum() / (n * (n * n - 1)) if n > 1 else 1.0 # Spearman's rank correlation.
+        sameTop = list(np.argsort(-reference)[:rerankDepth]) == list(np.argsort(-candidate)[:rerankDepth])
+        passed &= bool(correlation >= rankTolerance and sameTop)
+        print(f'Rerank:     "{query[:50]}" rank correlation {correlation:.3f}, same top {rerankDepth}: {sameTop}, largest score change {np.abs(reference - candidate).max():.4f}.')
+    print(f'            {times["torch"]:.2f} s with PyTorch, {times[backendName]:.2f} s with {backendName} ({times["torch"] / times[backendName]:.1f}x).')
+
+    print(f'Parity check {"passed" if passed else "FAILED"} for the {backendName} backend.')
+    return passed
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2 or sys.argv[1] not in backends[1:]:
+        print(f'Usage: python Scripts/InferenceBackend.py [{"|".join(backends[1:])}] [path/to/library]')
+        sys.exit(1)
+
+    paragraphs, queries = sampleParagraphs, sampleQueries
+    if len(sys.argv) > 2: # Check with a sample of the paragraphs in a library, using the start of some of them as queries.
+        import EncodedLibrary
+        pdfTable, _, _, libraryText = EncodedLibrary.loadLibrary(sys.argv[2])
+        sample = pdfTable.sample(n=min(200, len(pdfTable)), random_state=0)
+        paragraphs = EncodedLibrary.readAllText(sample, libraryText)
+        queries = [' '.join(paragraph.split()[:8]) for paragraph in paragraphs[:5]]
+        EncodedLibrary.closeText(libraryText)
+
+    sys.exit(0 if checkParity(sys.argv[1], paragraphs, queries) else 1)
@@ -7,24 +7,44 @@ Functions to be used by Gradio are defined in the first half of the script, whil
 second half. If using the program without the included .bat file, this is the script that should be run.
 '''
 
+#####----- Settings -----#####
+searchConcurrency = 4 # The number of searches the GUI runs at the same time, for when several people use it at once.
+apiPort = None # Set to a port number (such as 8765) to also serve searches of the loaded library as an HTTP/JSON API (see SearchServer).
+
 #####----- Prepare Environment -----#####
 print('Loading program...') # Progress message for the Command Prompt window.
-import QuickSearch # Critical - Python script that handles queries and information retrieval. 
-import ExtractPDF # Critical - Python script that handles PDF text extraction and encoding.
+import Startup # Critical - Python script that imports the other scripts and loads the AI models in the background, so that the GUI starts quickly.
 import os # Critical - Base Python package needed for many functions.
 from tkinter import filedialog # Optional - See above.
-import MergeLibraries # Optional - Python script that can add additional PDFs to an existing library. Only used by the addPDFs button.
+
+# The following scripts need large packages, so they are only imported the first time they are used, or by the warm-up (see Startup).
+QuickSearch = Startup.lazyImport('QuickSearch') # Critical - Python script that handles queries and information retrieval. 
+ExtractPDF = Startup.lazyImport('ExtractPDF') # Critical - Python script that handles PDF text extraction and encoding.
+EncodedLibrary = Startup.lazyImport('EncodedLibrary') # Critical - Python script that saves and loads Encoded Libraries.
+MergeLibraries = Startup.lazyImport('MergeLibraries') # Optional - Python script that can add additional PDFs to an existing library. Only used by the addPDFs button.
+SyncLibrary = Startup.lazyImport('SyncLibrary') # Optional - Python script that syncs an existing library with a folder of PDFs. Only used by the syncPDFs button.
+AnnIndex = Startup.lazyImport('AnnIndex') # Optional - Python script that provides the search index of large libraries. Only used for the default of the Probes_slider.
+CompactLibrary = Startup.lazyImport('CompactLibrary') # Optional - Python script that merges the segments of a library. Used after PDFs are added or synced, and by the compactBtn button.
+SearchServer = Startup.lazyImport('SearchServer') # Optional - Python script that serves searches as an HTTP/JSON API. Only used if apiPort is set.
+Metrics = Startup.lazyImport('Metrics') # Optional - Python script that records how long each stage of searches and library builds takes. Only used by the statsBtn button.
+
 import gradio as gr # Optional - Package that provides the GUI from which all the functions below are run.
-import tkinter as tk # Optional - Base Python package that is used to open a Select Folder window. Only used by the addPDFs button.
+import tkinter as tk # Optional - Base Python package that is used to open a Select Folder window. Only used by the addPDFs and syncPDFs buttons.
 
 # If the working directory is currently the scripts folder, change it to be one level higher (to the main Factoid Finder folder).
 if os.getcwd()[-7:] == 'Scripts':
     os.chdir("..")
 
-# Loads the AI models used for semantic search and cross-encoding when the program is started.
-print('Initializing AI models...') # Progress message for the Command Prompt window.
-try: QuickSearch.initializeEmbedders() # Attempts to load the SLMs used for encoding and search.
-except: print('An error occurred while initializing the search AIs.') # If an error occurs, displays a message in the Command Prompt window.
+# Starts loading the AI models used for semantic search and cross-encoding in the background when the program is started, while the GUI is built.
+# This is skipped when the script is imported by one of the worker processes that ExtractPDF uses to read PDFs in parallel.
+if __name__ == '__main__':
+    print('Initializing AI models in the background...') # Progress message for the Command Prompt window.
+    Startup.startWarmUp() # See the Startup script for details.
+
+    # Starts the search API once the AI models are ready, if it is turned on.
+    if apiPort is not None:
+        import threading
+        threading.Thread(target=lambda: Startup.waitForModels() and SearchServer.startServer(serverPort=apiPort), daemon=True).start()
 
 
 #####----- Define Functions -----#####
@@ -47,8 +67,8 @@ def updateLibPath(choice): # Input comes from the variable 'radio'.
     # See above for details of how this if statement works.
     if choice == 'Load Existing': 
 
-        updateLibPathBox = gr.update(label="Paste the path to your .pkl file (found in the same folder as this application).",
-                                     placeholder = r"Path\to\.pkl\file", 
+        updateLibPathBox = gr.update(label="Paste the path to your Encoded Library folder or .pkl file (found in the 'Encoded Libraries' folder of this application).",
+                                     placeholder = r"Path\to\Encoded Library", 
                                      value = "", 
                                      visible = True)
         
@@ -58,7 +78,7 @@ def updateLibPath(choice): # Input comes from the variable 'radio'.
 '''
 The following function will perform all of the steps necessary to either create a new encoded library or load an existing one.
 The arguments it receives are libPath, which specifies the path to either the folder with PDFs to encode or
-the path to the Pickle file that contains an existing encoded library. This path is received from the libPath textbox.
+the path to the library folder (or older Pickle file) that contains an existing encoded library. This path is received from the libPath textbox.
 The argument radio is received from the radio buttons where the user chooses to either make a new library or use an existing
 one. The argument mergeL is received from expandLib function that is defined below, if the user has chosen to add PDFs to an
 existing library. A basic progress bar that displays the results of the encoding process is included as well.
@@ -118,24 +138,28 @@ def loadLib(libPath, radio, mergeL=False, progress=gr.Progress(track_tqdm=True))
             libPath = MergeLibraries.mergeLibs(loadedLibPath, libPath) # Calls a function from MergeLibraries. Takes the path to the active encoded library
                                                                        # and the new folder from which to add PDFs. See script for further details.
         
-        ### The rest of the code in this function is used to load an encoded library, which are saved in .pkl files.
+        ### The rest of the code in this function is used to load an encoded library, which are saved as library folders (or .pkl files by older versions).
         
-        if os.path.isfile(libPath) == False: # If the specified file cannot be located...
+        if os.path.exists(libPath) == False: # If the specified library cannot be located...
             raise gr.Error('The specified file could not be located.') # Raise an error.
 
-        if libPath[-4:] != '.pkl': # If the specified file is not a Pickle file...
-            raise gr.Error(f"The specified path does not point to a .pkl file.") # Raise an error.
+        if not EncodedLibrary.isLibrary(libPath) and libPath[-4:] != '.pkl': # If the specified path is neither a library folder nor a Pickle file...
+            raise gr.Error(f"The specified path does not point to an Encoded Library folder or a .pkl file.") # Raise an error.
 
         # Display a progress message in both the GUI and Command Prompt window.
         print('Loading library...')
 
-        # This function will try to load the specified Pickle file (contains the encoded library), or raise an error if it fails. See QuickSearch script for further details.
-        try: loadedLibPath = QuickSearch.loadPickle(libPath) # Updates the variable that tracks the currently loaded library.
+        # This function will try to load the specified encoded library, or raise an error if it fails. See QuickSearch script for further details.
+        try: loadedLibPath = QuickSearch.loadLibrary(libPath) # Updates the variable that tracks the currently loaded library.
         except: raise gr.Error('An unexpected error occurred while loading the encoded library.')
 
         # Display a progress message in the terminal.
         print('Library successfully loaded.')
 
+        # If PDFs were just added to the library, compact it in the background once it has collected enough segments.
+        if mergeL == True:
+            compactIfNeeded()
+
         # The following variables are used to update the Gradio GUI.
         updateVis = gr.update(visible = True) # Make an element visible.
         clearSBox = gr.update(value = "") # Clear the value of the Search / Query textbox.
@@ -172,18 +196,129 @@ def expandLib(progress=gr.Progress(track_tqdm=True)):
 
     return exOut # Return the variables received from loadLib.
 
+# This function is used to sync the active library with a folder of PDFs. Only PDFs that are new or have changed since the library was built are
+# extracted and encoded, and PDFs that have been deleted from the folder are removed from the library. It is triggered when the button 'syncPDFs' is clicked.
+def syncLib(progress=gr.Progress(track_tqdm=True)):
+
+    # Libraries saved as .pkl files do not record which PDFs they were built from, so they cannot be synced.
+    if not EncodedLibrary.isLibrary(loadedLibPath):
+        raise gr.Error('Only library folders can be synced. Convert this .pkl library first (see README).')
+
+    #Display progress messages in both GUI and Command Prompt window.
+    gr.Info('Folder Selector opened in new window.', duration = 5)
+    print('Folder Selector opened in new window.')
+    
+    #This code will make sure that tkinter opens on the topmost window.
+    root = tk.Tk()
+    root.wm_attributes('-topmost', 1)
+    root.withdraw()
+    
+    #Opens a Select Folder window through tkinter and saves the user's selection.
+    folderPath = filedialog.askdirectory(parent=root)
+    
+    # If the user does not select a path, display a warning message and leave state unchanged.
+    if not folderPath: 
+        gr.Warning('No folder was selected.')
+        return gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), gr.update()
+    
+    print(f"Syncing library with: {folderPath}") # Display a progress message in the Command Prompt window.
+
+    # The sync only adds a new segment to the library, so the loaded library is left untouched if anything goes wrong.
+    try:
+        warnFlag, logPath = SyncLibrary.syncFolder(loadedLibPath, folderPath) # See the SyncLibrary script for details.
+    except:
+        raise gr.Error('An error occurred while syncing the encoded library.')
+
+    # If a non-critical error occurred while extracting text, display a message to the user in the GUI and Command Prompt.
+    if warnFlag == True:
+        gr.Warning(f'One or more PDFs could not be properly encoded and not included in the library. See {logPath} for details.', duration = 15)
+        print(f'One or more PDFs could not be properly encoded and so was not included in the library. See {logPath} for details.')
+
+    compactIfNeeded() # Compact the library in the background once it has collected enough segments or deleted rows.
+
+    # Reload the synced library and update the GUI in the same way as loadLib.
+    return loadLib(loadedLibPath, 'Load Existing')
+
+# This function starts compacting the active library in the background if it has collected enough segments or deleted rows (see CompactLibrary).
+# Searches keep using the loaded library while the compaction runs. The compacted library is used the next time it is loaded.
+def compactIfNeeded():
+    if EncodedLibrary.isLibrary(loadedLibPath) and CompactLibrary.needsCompaction(loadedLibPath):
+        print('Compacting the library in the background...')
+        CompactLibrary.compactInBackground(loadedLibPath)
+
+# This function compacts the active library straight away, merging all of its segments and leaving out deleted rows. It is triggered when the button 'compactBtn' is clicked.
+def compactLib(progress=gr.Progress(track_tqdm=True)):
+
+    if not EncodedLibrary.isLibrary(loadedLibPath):
+        raise gr.Error('Only library folders can be compacted. Convert this .pkl library first (see README).')
+
+    # Wait for any compaction that is already running in the background, so that the two do not repeat the same work.
+    with CompactLibrary.compactLock:
+        try:
+            compacted = CompactLibrary.compactLibrary(loadedLibPath) # See the CompactLibrary script for details.
+        except:
+            raise gr.Error('An error occurred while compacting the encoded library.')
+
+    if compacted == False:
+        gr.Info('The library is already compact.', duration = 5)
+
+    # Reload the compacted library and update the GUI in the same way as loadLib.
+    return loadLib(loadedLibPath, 'Load Existing')
+
 # This block activates the tool's search function with input from the Gradio GUI. 
-# It receives the user's query, maximum number of results, and generative AI checkbox as inputs.
-def searchGr(UInput, Results_slider, genAI):
+# It receives the user's query, maximum number of results, and generative AI checkbox as inputs, followed by the search depth and the search filters.
+# The results are also kept in searchSession (the state of this browser tab), so that more of their answers can be highlighted later (see highlightGr).
+def searchGr(UInput, Results_slider, genAI, Probes_slider, File_filter, Folder_filter, Title_filter, Author_filter, Subject_filter, Keyword_filter, searchSession):
+    filters = {'file': File_filter, 'path': Folder_filter, 'title': Title_filter, 'author': Author_filter, 'subject': Subject_filter, 'keyword': Keyword_filter} # Blank filters are ignored (see LibraryFilter).
 
     # If the user has opted to create a generative AI summary of the top 5 search results, display a message informing them it will be slow.
     if genAI == True:
-        gr.Info("Summarizing with generative AI. This may take 15 minutes or more.", duration = 120) # Displays message in Gradio GUI.
+        gr.Info("Summarizing with generative AI. The first summary may take several minutes while the AI model loads.", duration = 120) # Displays message in Gradio GUI.
         
-    try: qResults = QuickSearch.Search(UInput, Results_slider, genAI) # Calls the Search function from the QuickSearch script. See script for details.
-    except: qResults = 'An error occurred during the search.' # Displays an error message instead of search results if something goes wrong.
-    
-    return qResults # Returns the search results. These are displayed in the searchResults markdown box. 
+    # Wait for the search models if they are still loading in the background.
+    if not Startup.modelsReady.is_set():
+        yield '⏳ Waiting for the AI models to finish loading...'
+    if not Startup.waitForModels():
+        yield 'The AI models used for searching could not be loaded. See the Command Prompt window for details.'
+        return
+
+    # Calls the streamSearch function from the QuickSearch script, which yields the results again as each stage of the search finishes. See script for details.
+    # Each version of the results is displayed in the searchResults markdown box as soon as it is ready.
+    try:
+        for qResults in QuickSearch.streamSearch(UInput, Results_slider, genAI, Probes_slider, filters, searchSession):
+            yield qResults
+    except: yield 'An error occurred during the search.' # Displays an error message instead of search results if something goes wrong.
+
+# Highlights the answers in the next results of the last search in this browser tab that have not been highlighted yet (see QuickSearch.highlightMore),
+# such as the results below the first few in the 'deferred' highlight mode. The results are left as they are if there is nothing left to highlight.
+def highlightGr(searchSession):
+    try: hResults = QuickSearch.highlightMore(searchSession)
+    except: hResults = None
+    if hResults is None:
+        gr.Info("There are no more answers to highlight.")
+        return gr.update()
+    return hResults
+
+# These functions mount another library folder alongside the loaded library, so that searches cover both, or unmount it again (see QuickSearch.mountLibrary).
+# They return a list of the libraries that are searched. Loading another library, or adding, syncing or compacting, unmounts the other libraries.
+def mountGr(mountPath):
+    try: libraries = QuickSearch.mountLibrary(mountPath.strip())
+    except ValueError as error: raise gr.Error(str(error))
+    except: raise gr.Error('An unexpected error occurred while mounting the library.')
+    return listLibraries(libraries), gr.update(value = "")
+
+def unmountGr(mountPath):
+    try: libraries = QuickSearch.unmountLibrary(mountPath.strip())
+    except ValueError as error: raise gr.Error(str(error))
+    return listLibraries(libraries), gr.update(value = "")
+
+# Lists the libraries that are searched, for display in the GUI.
+def listLibraries(libraries):
+    return '**Libraries searched:**<br>' + '<br>'.join(libraries) if len(libraries) > 1 else ''
+
+# Shows how long each stage of the recent searches, library loads and builds took (see Metrics). Every trace is also saved in Logs/Metrics.jsonl.
+def statsGr():
+    return Metrics.summaryMarkdown()
 
 ### The following two functions are used to disable buttons while other functions are running, to prevent interference.
 # This function will disable all of the buttons listed in 'buttons'
@@ -200,6 +335,10 @@ def hideLowerUI():
     clear = gr.update(value = "", visible=False)
     return hide, hide, hide, clear, hide, hide
 
+# Returns the progress of loading the AI models in the background (see Startup). Once they are ready, the timer that checks on them is stopped.
+def readinessGr():
+    return Startup.readiness(), gr.Timer(active = not Startup.modelsReady.is_set())
+
 # Shows the lower UI elements when loading is complete
 def showLowerUI():
     show = gr.update(visible=True)
@@ -220,6 +359,10 @@ theme = gr.themes.Ocean().set(
 with gr.Blocks(fill_height=True, title = "Factoid Finder") as FactoidFinder: # Set the program to take a full page, use the theme specified above, and 
                                                                                             #be titled correctly.
     
+    # Shows whether the AI models are still loading in the background. It is checked every second until they are ready.
+    readiness = gr.Markdown(Startup.readiness)
+    readinessTimer = gr.Timer(1)
+
     # This is the topmost row, and contains the elements needed to create or load a library.
     with gr.Row():
         # Radio button from which users can specify whether to create a new encoded library or load an existing one.
@@ -255,6 +398,8 @@ with gr.Blocks(fill_height=True, title = "Factoid Finder") as FactoidFinder: # S
                                  interactive = False) # Prevent textbox from being edited, as it is only meant to display information.
                      
             addPDFs = gr.Button('Add more PDFs...', scale = 0) # Button to activate the expandLib function.
+            syncPDFs = gr.Button('Sync folder...', scale = 0) # Button to activate the syncLib function.
+            compactBtn = gr.Button('Compact library', scale = 0) # Button to activate the compactLib function.
         
         sep2 = gr.Markdown('---') # Separator between this column and the next set of elements.
 
@@ -268,6 +413,9 @@ with gr.Blocks(fill_height=True, title = "Factoid Finder") as FactoidFinder: # S
                               min_width=100, # Set size of button.
                               variant = 'primary') # Set style of button (used to determine colour).
 
+        # Button which activates the highlightGr function, to highlight the answers in more of the results.
+        highlightBtn = gr.Button("Highlight more", scale = 0, min_width=100)
+
     # This accordion element allows for optional settings to be adjusted. It defaults to being closed and not visible (until loadLib runs successfully).
     with gr.Accordion("Advanced Settings", open=False, visible = False) as advancedSettings:
 
@@ -278,16 +426,50 @@ with gr.Blocks(fill_height=True, title = "Factoid Finder") as FactoidFinder: # S
                                    interactive=True, # Allows slider to be moved.
                                    label="Max Number of Results")
 
+        # The following slider sets how much of a large library is searched for each query (see AnnIndex). Higher values are more accurate but slower.
+        # Small libraries are always searched in full.
+        Probes_slider = gr.Slider(1, 128, # The minimum and maximum values that can be selected.
+                                  value=32, # The default value. This is replaced by AnnIndex.defaultProbes when the page is opened (see below), so that AnnIndex is not imported before the GUI starts.
+                                  step=1, # The step by which to change the slider.
+                                  interactive=True, # Allows slider to be moved.
+                                  label="Search Depth (large libraries only)")
+
+        # The following text boxes limit the search to the PDFs whose metadata matches them (see LibraryFilter). Blank boxes are ignored.
+        # Searches limited to a few PDFs only read the paragraphs of those PDFs, so they are much faster.
+        with gr.Row():
+            File_filter = gr.Textbox(label = "File name(s)", placeholder = "Report.pdf; Other Report.pdf")
+            Folder_filter = gr.Textbox(label = "In folder", placeholder = "Full path to a folder of PDFs")
+            Title_filter = gr.Textbox(label = "Title contains")
+        with gr.Row():
+            Author_filter = gr.Textbox(label = "Author contains")
+            Subject_filter = gr.Textbox(label = "Subject contains")
+            Keyword_filter = gr.Textbox(label = "Keywords contain")
+
+        # The following elements mount other library folders alongside the loaded library, so that one search covers all of them.
+        with gr.Row(equal_height=True):
+            mountPath = gr.Textbox(label = "Search other libraries too", placeholder = "Path to another Encoded Library folder")
+            mountBtn = gr.Button("Mount", scale = 0) # Button to activate the mountGr function.
+            unmountBtn = gr.Button("Unmount", scale = 0) # Button to activate the unmountGr function.
+        mountedLibs = gr.Markdown("") # Lists the libraries that are searched, when there is more than one.
+
+        # The following elements show how long each stage of recent searches took, to help find what makes searches slow.
+        with gr.Row(equal_height=True):
+            gr.Markdown("**Performance** (times of recent searches and library loads)")
+            statsBtn = gr.Button("Refresh", scale = 0) # Button to activate the statsGr function.
+        statsBox = gr.Markdown("") # Shows the latency percentiles of each stage.
+
         # This checkbox is used to enable a summary of the top 5 search results created with Generative AI. It is currently disabled.
         genAI = gr.Checkbox(label = 'Summarize top 5 results with generative AI (Note: Very slow, not recommended. Included only as proof of concept.)',
                                 visible = False) # The option to use generative AI has been disabled in this version of the software.
                                                  # Setting visible = True will re-enable it.
         
     searchResults = gr.Markdown(elem_classes="markdown-wrap") # This is a markdown element that is used to display the search results.
+    searchSession = gr.State({}) # The results of the last search in this browser tab, used to highlight more of their answers (see highlightGr).
 
     ### The following code blocks are used to run functions when buttons are clicked. ###
     
-    buttons = [searchBtn, loadPath, addPDFs, radio] #Specify the buttons to disable when other functions are running.
+    searchInputs = [UInput, Results_slider, genAI, Probes_slider, File_filter, Folder_filter, Title_filter, Author_filter, Subject_filter, Keyword_filter, searchSession] # The inputs of searchGr.
+    buttons = [searchBtn, highlightBtn, loadPath, addPDFs, syncPDFs, compactBtn, radio] #Specify the buttons to disable when other functions are running.
     toToggleVis = [loadedLib, searchBox, advancedSettings, searchResults, sep1, sep2] # Elements to hide during library load
 
     # When Start button is clicked (to load or create a library), the buttons will all be disabled (so no additional functions can be triggered), the function searchGr will then be run with the specified
@@ -319,18 +501,53 @@ with gr.Blocks(fill_height=True, title = "Factoid Finder") as FactoidFinder: # S
     add_event.failure(lambda: enableButtons(buttons), None, buttons)
     add_event.then(lambda: enableButtons(buttons), None, buttons)
 
+    # Same concept as above, but for the 'Sync folder' button.
+    sync_event = syncPDFs.click(lambda: disableButtons(buttons), None, buttons).then(
+        fn = hideLowerUI, inputs = None, outputs = toToggleVis).then(
+        fn = syncLib, inputs = None, outputs = [searchBox, advancedSettings, UInput, libPath, loadedLib, curPath])
+
+    sync_event.success(fn = showLowerUI, inputs = None, outputs = toToggleVis)
+    sync_event.failure(lambda: enableButtons(buttons), None, buttons)
+    sync_event.then(lambda: enableButtons(buttons), None, buttons)
+
+    # Same concept as above, but for the 'Compact library' button.
+    compact_event = compactBtn.click(lambda: disableButtons(buttons), None, buttons).then(
+        fn = hideLowerUI, inputs = None, outputs = toToggleVis).then(
+        fn = compactLib, inputs = None, outputs = [searchBox, advancedSettings, UInput, libPath, loadedLib, curPath])
+
+    compact_event.success(fn = showLowerUI, inputs = None, outputs = toToggleVis)
+    compact_event.failure(lambda: enableButtons(buttons), None, buttons)
+    compact_event.then(lambda: enableButtons(buttons), None, buttons)
+
     # Same concept as previously, but for the 'Search' button.
     searchBtn.click(lambda: disableButtons(buttons), inputs = None, outputs = buttons).then(
-        fn = searchGr, inputs = [UInput, Results_slider, genAI], outputs = searchResults).then(
+        fn = searchGr, inputs = searchInputs, outputs = searchResults, concurrency_limit = searchConcurrency).then(
         lambda: enableButtons(buttons), None, buttons)
 
     #This code is the exact same as that for the search button, except it runs when the user hits the enter key while the search box is selected.
     UInput.submit(lambda: disableButtons(buttons), inputs = None, outputs = buttons).then(
-                  fn = searchGr, inputs = [UInput, Results_slider, genAI], outputs = searchResults).then(
+                  fn = searchGr, inputs = searchInputs, outputs = searchResults, concurrency_limit = searchConcurrency).then(
                   lambda: enableButtons(buttons), None, buttons)
 
+    # Highlights the answers in more of the results of the last search.
+    highlightBtn.click(lambda: disableButtons(buttons), inputs = None, outputs = buttons).then(
+        fn = highlightGr, inputs = searchSession, outputs = searchResults, concurrency_limit = searchConcurrency).then(
+        lambda: enableButtons(buttons), None, buttons)
+
+    mountBtn.click(fn = mountGr, inputs = mountPath, outputs = [mountedLibs, mountPath]) # Mounts the library in the mountPath textbox.
+    unmountBtn.click(fn = unmountGr, inputs = mountPath, outputs = [mountedLibs, mountPath]) # Unmounts the library in the mountPath textbox.
+    statsBtn.click(fn = statsGr, inputs = None, outputs = statsBox) # Shows the times of recent searches.
+    for event in [load_event, submit_event, add_event, sync_event, compact_event]: # Loading (or reloading) a library unmounts the others.
+        event.then(fn = lambda: "", inputs = None, outputs = mountedLibs)
+
     radio.change(fn = updateLibPath, inputs = radio, outputs = [libPath, loadPath]) # Anytime the radio buttons are changed, this code will run. 
+
+    readinessTimer.tick(fn = readinessGr, inputs = None, outputs = [readiness, readinessTimer]) # Updates the readiness message every second.
+    FactoidFinder.load(fn = lambda: AnnIndex.defaultProbes, inputs = None, outputs = Probes_slider) # Sets the default search depth once the page is opened.
     
-print('Program launching in default browser.') # Print message in the Command Prompt window.
+# The GUI is only launched when this script is run directly, and not when it is imported by a worker process.
+if __name__ == '__main__':
+    print('Program launching in default browser.') # Print message in the Command Prompt window.
+    Startup.mark('GUI launched') # Recorded in the startup timing report.
 
-FactoidFinder.queue().launch(quiet = True, inbrowser = True, theme = theme) # Launch the Gradio GUI in the browser.
+    FactoidFinder.queue().launch(quiet = True, inbrowser = True, theme = theme) # Launch the Gradio GUI in the browser.
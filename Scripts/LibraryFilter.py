@@ -0,0 +1,113 @@
+'''
+This script lets searches be limited to some of the documents in a library, chosen by their metadata (file name, folder, title, author,
+subject or keyword). When a library is loaded, buildDocuments makes a table with one row per document, holding its metadata and the ranges
+of library rows that hold its chunks. The chunks of a document are stored together, so each document only has one or a few ranges.
+A scoped search then only needs to score the rows of the documents that match its filters (see scopeRows), rather than the whole library.
+
+Filters are given as a dictionary, such as {'author': 'smith', 'path': 'C:/Reports/2023'}. Every filter that is given must match:
+    file      The name of the PDF (such as 'Report.pdf'). Several names can be separated with ';'.
+    path      The folder the PDF is in (or its full path). Subfolders of the folder also match.
+    title     Text found in the title of the PDF.
+    author    Text found in the author of the PDF.
+    subject   Text found in the subject of the PDF.
+    keyword   Text found in the keywords of the PDF.
+    library   The name or path of the library the PDF is in, when several libraries are mounted (see QuickSearch.mountLibrary). Several can be separated with ';'.
+Filters are not case sensitive. Filters that are missing or blank are ignored.
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import numpy as np # Critical - Holds the row ranges of each document.
+import EncodedLibrary # Critical - Python script that saves and reads the Encoded Libraries. Used to find the row ranges of each document.
+
+#####----- Settings -----#####
+filterNames = ['file', 'path', 'title', 'author', 'subject', 'keyword', 'library'] # The filters that can be used.
+textColumns = {'title': 'Title', 'author': 'Author', 'subject': 'Subject', 'keyword': 'Keywords'} # The filters that match text found in a metadata column.
+
+#####----- Documents -----#####
+
+# Makes a path comparable with others: absolute, with the same separators, and not case sensitive where the file system is not.
+def comparablePath(path):
+    return os.path.normcase(os.path.abspath(str(path)))
+
+# This function makes the table of documents in a library from its pdfTable. It has one row per PDF (per library, when several are mounted) with its metadata, the ranges
+# of library rows that hold its chunks (Rows, as [start, end) pairs) and its number of chunks.
+def buildDocuments(pdfTable):
+    table = pdfTable.reset_index(drop=True)
+    keys = ['Library', 'File_Path'] if 'Library' in table.columns else 'File_Path' # The same PDF can be in more than one mounted library.
+    rowsOf = table.groupby(keys, sort=False, observed=True).indices # The library rows that hold the chunks of each PDF, in order.
+
+    columns = ['File_Name', 'File_Path'] + [column for column in list(textColumns.values()) + ['Library'] if column in table.columns]
+    documents = table.iloc[[rows[0] for rows in rowsOf.values()]][columns].reset_index(drop=True) # Every chunk of a PDF has the same metadata.
+    documents = documents.astype(object).where(documents.notna(), '').astype(str)
+    documents['Rows'] = [EncodedLibrary.rowRanges(rows) for rows in rowsOf.values()]
+    documents['Chunks'] = [len(rows) for rows in rowsOf.values()]
+    documents['Folder'] = [comparablePath(path) for path in documents['File_Path']] # Used to match the path filter.
+    return documents
+
+#####----- Filters -----#####
+
+# Returns the filters that are actually set (not missing or blank), with their values cleaned up, or None if there are none.
+def activeFilters(filters):
+    if not filters:
+        return None
+    unknown = set(filters) - set(filterNames)
+    if unknown:
+        raise ValueError(f'Unknown search filters: {sorted(unknown)}. Choose from {filterNames}.')
+    active = {name: str(value).strip() for name, value in filters.items() if value is not None and str(value).strip()}
+    return active if active else None
+
+# Returns a key that identifies a set of filters, so that results found with different filters are cached separately. None if no filters are set.
+def filterKey(filters):
+    active = activeFilters(filters)
+    return None if active is None else tuple(sorted((name, value.lower()) for name, value in active.items()))
+
+# This function finds the documents that match every filter that is set. Returns a boolean array with one value per document.
+def matchDocuments(documents, filters):
+    matches = np.ones(len(documents), dtype=bool)
+    active = activeFilters(filters)
+    if active is None:
+        return matches
+
+    for name, value in active.items():
+        if name == 'file':
+            names = {part.strip().lower() for part in value.split(';') if part.strip()}
+            matches &= documents['File_Name'].str.lower().isin(names).to_numpy()
+        elif name == 'library':
+            libraries = [part.strip() for part in value.split(';') if part.strip()]
+            if 'Library' not in documents.columns: # A .pkl library is not mounted, so it has no library to match.
+                matches[:] = False
+                continue
+            names = {library.lower() for library in libraries}
+            paths = {comparablePath(library) for library in libraries}
+            matches &= documents['Library'].map(lambda library: os.path.basename(library).lower() in names or comparablePath(library) in paths).to_numpy(dtype=bool)
+        elif name == 'path':
+            folder = comparablePath(value)
+            inFolder = documents['Folder'].str.startswith(folder.rstrip(os.sep) + os.sep) # Files in the folder or its subfolders.
+            matches &= (inFolder | (documents['Folder'] == folder)).to_numpy() # Or the file itself.
+        else:
+            column = textColumns[name]
+            if column not in documents.columns: # Libraries without this metadata have nothing to match.
+                matches[:] = False
+                continue
+            matches &= documents[column].str.contains(value, case=False, regex=False).to_numpy()
+    return matches
+
+# This function returns the library rows (in order) of every document that matches the filters, or None if no filters are set.
+def scopeRows(documents, filters):
+    if activeFilters(filters) is None:
+        return None
+    ranges = [pair for rows in documents['Rows'][matchDocuments(documents, filters)] for pair in rows]
+    if len(ranges) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Expand the ranges into row numbers without a Python loop over the rows.
+    ranges = np.asarray(sorted(ranges), dtype=np.int64)
+    lengths = ranges[:, 1] - ranges[:, 0]
+    firstOfRange = np.repeat(np.cumsum(lengths) - lengths, lengths) # Where each row's range begins in the output.
+    return np.repeat(ranges[:, 0], lengths) + np.arange(lengths.sum()) - firstOfRange
+
+# Returns a short description of the filters that are set, such as "author contains 'smith'", for messages.
+def describeFilters(filters):
+    active = activeFilters(filters) or {}
+    phrases = {'file': 'file is', 'path': 'in folder', 'title': 'title contains', 'author': 'author contains', 'subject': 'subject contains', 'keyword': 'keywords contain', 'library': 'library is'}
+    return ', '.join(f"{phrases[name]} '{value}'" for name, value in active.items())
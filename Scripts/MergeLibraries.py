@@ -1,16 +1,15 @@
-
 '''
 This script is used to add new PDFs to an existing encoded library.
-For reliability and simplicity, it works by merging two libraries together,
-creating a new combined library, then deleting the old one. This allows for 
-many of the other functions in this program to be re-used.
+The new PDFs are first made into a library of their own, whose segments are then
+linked into the active library (see EncodedLibrary.attachLibrary). Nothing that is
+already in the active library is loaded or rewritten, so adding PDFs takes the same
+time however large the library is. The segments are merged later by CompactLibrary.
 '''
 
 #####----- Import packages -----#####
-import pickle # Critical - Saves and reads the Encoded Libraries.
-import pandas as pd # Critical - Necessary for working with extracted PDF content and metadata.
-import torch # Critical - Concatenates tensors.
+import EncodedLibrary # Critical - Python script that saves and reads the Encoded Libraries.
 import os # Critical - Base Python package needed for many functions.
+import Metrics # Critical - Python script that records how long each stage of the merge takes.
 from datetime import datetime # Optional - Makes a datetime string that is used to name files.
 
 #####----- Merge Libraries -----#####
@@ -19,57 +18,24 @@ from datetime import datetime # Optional - Makes a datetime string that is used
 # Interface script, after the new library has been created.
 def mergeLibs(loadedLibPath, libPath): #Takes the path of the active Encoded Library (loadedLibPath) and the path to the new library (libPath) that we want to merge with.
 
-    from QuickSearch import pdfTable, libraryEmbeddings # Retrieve the variables within the active Encoded Library
-
-    # Save the length of the pdfTable and libraryEmbeddings from the active Encoded Library.
-    # These will be used later to double-check that the library merged properly.
-    table1Len = pdfTable.shape[0]
-    eLib1Len = libraryEmbeddings.shape[0]
-
-    # Load the new Encoded Library.
-    with open(libPath, 'rb') as f:
-        pdfTable2, libraryEmbeddings2 = pickle.load(f)
-
-    # Save the length of the pdfTable and libraryEmbeddings from the new Encoded Library.
-    table2Len = pdfTable2.shape[0]
-    eLib2Len = libraryEmbeddings2.shape[0]
-
-    pdfTable = pd.concat([pdfTable, pdfTable2]) # Combine both pdfTables into one.
-    libraryEmbeddings = torch.cat((libraryEmbeddings, libraryEmbeddings2), dim=0) # Combine both libraryEmbeddings tensors into one.
-
-    pdfTable = pdfTable.reset_index(drop = True) # Reset the index of the new pdfTable.
-
-    # Calculate the expected length of the combined data frame and tensor.
-    expectedTableLen = table1Len + table2Len
-    expectedLibLen = eLib1Len + eLib2Len
-
-    # Before we start creating and deleting files, ensure that the expected lengths of the table and tensor match the actual lengths.
-    if (pdfTable.shape[0] == expectedTableLen) & (libraryEmbeddings.shape[0] == expectedLibLen):
-        
-        print('Encoded Library lengths match expectations. Proceeding with join.')
-        
-        currentTime = datetime.now() # Get the current date and time
-        formattedTime = currentTime.strftime("%Y%m%d%H%M%S") # Format the datetime object as a string with only numbers
-        
-        cwd = os.getcwd() # Get the current working directory.
-        
-        libName = os.path.join(cwd, 'Encoded Libraries', f'Combined_Library-{formattedTime}.pkl') # Create a path for saving the new Encoded Library 
-    
-        # Save the new Encoded Library.
-        with open(libName, 'wb') as f:
-            pickle.dump([pdfTable, libraryEmbeddings], f)
-
-        print(f'Currently loaded library is here: {loadedLibPath}')
-        print(f'Temporary library for merge is here: {libPath}')
-        
-        # Delete the old libraries now that they have been combined into one.
-        for path in [loadedLibPath, libPath]:
-            if os.path.exists(path):
-                os.remove(path)
-                print(f"{path} has been deleted.")
-            else:
-                print(f"{path} does not exist.")
-                
-        del pdfTable, pdfTable2, libraryEmbeddings, libraryEmbeddings2 # Delete these variables to get lots of memory back.
-        
-        return libName # Returns the path of the combined library.
\ No newline at end of file
+    print(f'Currently loaded library is here: {loadedLibPath}')
+    print(f'Temporary library for merge is here: {libPath}')
+    trace = Metrics.startTrace('merge_libraries', rows_added=EncodedLibrary.readHeader(libPath)['rows']) # Records how long each stage takes (see Metrics).
+
+    # Libraries saved as .pkl files by older versions cannot hold segments, so they are converted to a library folder first.
+    if not EncodedLibrary.isLibrary(loadedLibPath):
+        formattedTime = datetime.now().strftime("%Y%m%d%H%M%S") # Format the current date and time as a string with only numbers
+        combinedPath = os.path.join(os.getcwd(), 'Encoded Libraries', f'Combined_Library-{formattedTime}') # Create a path for saving the converted Encoded Library
+        with Metrics.stage(trace, 'convert'):
+            EncodedLibrary.convertPickle(loadedLibPath, combinedPath)
+        os.remove(loadedLibPath)
+        print(f"{loadedLibPath} has been converted to {combinedPath} and deleted.")
+        loadedLibPath = combinedPath
+
+    # Move the segments of the new library into the active library. The new library is deleted once this is done.
+    with Metrics.stage(trace, 'attach'):
+        EncodedLibrary.attachLibrary(loadedLibPath, libPath)
+    print(f"{libPath} has been added to {loadedLibPath}.")
+    Metrics.finishTrace(trace, rows=EncodedLibrary.readHeader(loadedLibPath)['rows'])
+
+    return loadedLibPath # Returns the path of the combined library.
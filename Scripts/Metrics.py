@@ -0,0 +1,201 @@
+'''
+This script records how long each stage of the slow operations in this program takes, so that it is clear where the time goes: whether a
+slow search is spent encoding the query, searching the library, reranking with the cross-encoder, highlighting answers or formatting the
+results, or whether a slow build is spent extracting text, chunking or encoding. Searches (QuickSearch.streamSearch and searchMany),
+library builds (ExtractPDF.createLibrary), loading libraries (QuickSearch.loadPickle and mountLibrary) and merges (MergeLibraries.mergeLibs)
+are traced. Each trace records the wall time and number of items processed of each stage, and the memory (RSS) of the program at the start
+and end of the stage, along with how much the stage raised the peak memory of the program (which is 0 unless the stage used more memory than
+anything before it).
+
+Every trace is written as one line of JSON to Logs/Metrics.jsonl, which can be read with any JSON Lines tool (or summarized with
+python Scripts/Metrics.py). The most recent traces of each operation are also kept in memory, so that latency percentiles can be shown
+while the program is running (see metricsSummary, which is shown in the GUI and served by SearchServer at /stats).
+
+Operations are traced like this:
+    trace = Metrics.startTrace('search', k=10)
+    with Metrics.stage(trace, 'encode') as record:
+        ...
+        record['items'] = 1
+    Metrics.finishTrace(trace, results=10)
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import sys # Critical - Used to check which operating system is being used.
+import json # Critical - Writes each trace as a line of JSON.
+import time # Critical - Times each stage.
+import datetime # Critical - Records when each trace started.
+import threading # Critical - Stops two traces being written at the same time.
+import collections # Critical - Keeps the most recent traces of each operation.
+import contextlib # Critical - Times the stages of an operation with a 'with' block.
+import numpy as np # Critical - Calculates the latency percentiles.
+try:
+    import resource # Optional - Reads the peak memory of the program on Linux and macOS.
+except ImportError:
+    resource = None
+try:
+    import psutil # Optional - Reads the memory of the program, and its peak memory on Windows. Without it, only the peak memory is read on Linux and macOS.
+except ImportError:
+    psutil = None
+
+#####----- Settings -----#####
+metricsEnabled = True # Whether operations are traced. Set to False to turn off all tracing.
+metricsFile = os.path.join('Logs', 'Metrics.jsonl') # The file traces are written to. None keeps them in memory only.
+maxFileSize = 50 * 2**20 # When the metrics file is larger than this (in bytes), it is renamed to Metrics.jsonl.1 (replacing the last one) and a new file is started.
+rollingWindow = 1000 # The number of recent traces of each operation kept in memory for the latency percentiles.
+
+recentTraces = collections.defaultdict(lambda: collections.deque(maxlen=rollingWindow)) # The most recent traces of each operation.
+metricsLock = threading.Lock() # Stops two threads from writing traces at the same time.
+
+#####----- Memory -----#####
+
+# Returns the peak memory (RSS) used by this program so far in MB, or None if it cannot be read on this computer.
+# Worker processes (such as those that extract text) are not included (see peakChildMemory).
+def peakMemory():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1) # macOS reports bytes, Linux reports KB.
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / 2**20, 1) # Windows reports the peak working set.
+    return None
+
+# Returns the memory (RSS) used by this program right now in MB, or None if it cannot be read on this computer.
+def currentMemory():
+    if psutil is not None:
+        return round(psutil.Process().memory_info().rss / 2**20, 1)
+    if os.path.exists('/proc/self/statm'): # Linux, without psutil.
+        with open('/proc/self/statm') as f:
+            return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20, 1)
+    return None
+
+# Returns the largest peak memory (RSS) of the worker processes that have finished, in MB, or None if it cannot be read on this computer.
+def peakChildMemory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1)
+
+#####----- Tracing -----#####
+
+# This function starts tracing an operation, such as 'search' or 'create_library'. Any other details of the operation (such as k) can be
+# given as keyword arguments, and are written with the trace. Returns the trace, or None if tracing is turned off.
+def startTrace(operation, **details):
+    if not metricsEnabled:
+        return None
+    return {'operation': operation, 'time': datetime.datetime.now().isoformat(timespec='milliseconds'), 'started': time.perf_counter(),
+            'stages': {}, 'details': details}
+
+# This function times one stage of a traced operation. It is used as a 'with' block, which gives the stage's record, so that the
+# number of items processed can be set (record['items'] = ...). The memory of the program is recorded at the start and end of the stage
+# (rss_start_mb and rss_end_mb), along with how much the stage raised the peak memory of the program (peak_increase_mb). A stage that is run
+# more than once in the same trace adds up its times and peak increases, and keeps the memory at its first start and last end.
+# If trace is None (tracing is turned off), the stage is run without being timed.
+@contextlib.contextmanager
+def stage(trace, name):
+    record = {} if trace is None else trace['stages'].setdefault(name, {'seconds': 0.0, 'rss_start_mb': currentMemory(), 'peak_increase_mb': 0.0})
+    peakBefore = peakMemory() if trace is not None else None
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        if trace is not None:
+            record['seconds'] += time.perf_counter() - start
+            record['rss_end_mb'] = currentMemory()
+            peakAfter = peakMemory()
+            record['peak_increase_mb'] = None if peakAfter is None else round(record['peak_increase_mb'] + peakAfter - peakBefore, 1)
+
+# This function finishes tracing an operation. Any other details (such as the number of results) can be given as keyword arguments.
+# The trace is written to the metrics file and kept for the latency percentiles. Returns the line that was written, as a dictionary.
+def finishTrace(trace, **details):
+    if trace is None:
+        return None
+    trace['details'].update(details)
+    line = {'time': trace['time'], 'operation': trace['operation'], 'seconds': round(time.perf_counter() - trace['started'], 6),
+            'peak_rss_mb': peakMemory(), **trace['details'],
+            'stages': {name: {**record, 'seconds': round(record['seconds'], 6)} for name, record in trace['stages'].items()}}
+
+    with metricsLock:
+        recentTraces[trace['operation']].append(line)
+        if metricsFile is not None:
+            try:
+                writeLine(line)
+            except OSError as error: # Tracing should never stop a search or build, such as when the Logs folder cannot be written to.
+                print(f'Warning: Could not write to {metricsFile}: {error}')
+    return line
+
+# Appends a trace to the metrics file, starting a new file once it is larger than maxFileSize.
+def writeLine(line):
+    folder = os.path.dirname(metricsFile)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    if os.path.exists(metricsFile) and os.path.getsize(metricsFile) > maxFileSize:
+        os.replace(metricsFile, metricsFile + '.1')
+    with open(metricsFile, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(line, ensure_ascii=False, default=str) + '\n')
+
+#####----- Summaries -----#####
+
+# Returns the p50, p95 and p99 of a list of times in seconds, in milliseconds.
+def percentiles(seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    return {f'p{percent}_ms': round(float(np.percentile(milliseconds, percent)), 2) for percent in [50, 95, 99]}
+
+# This function summarizes the recent traces of each operation (or only of the operations given): how many there were, the percentiles of
+# their total time and of the time of each of their stages, the mean number of items each stage processed, and the most any one run of
+# each stage raised the peak memory of the program.
+def metricsSummary(operations=None):
+    with metricsLock:
+        traces = {operation: list(lines) for operation, lines in recentTraces.items() if operations is None or operation in operations}
+
+    summary = {}
+    for operation, lines in traces.items():
+        if len(lines) == 0:
+            continue
+        stages = {}
+        for name in dict.fromkeys(name for line in lines for name in line['stages']): # Every stage, in the order it first appears.
+            records = [line['stages'][name] for line in lines if name in line['stages']]
+            stages[name] = {'count': len(records), **percentiles([record['seconds'] for record in records])}
+            items = [record['items'] for record in records if 'items' in record]
+            if items:
+                stages[name]['mean_items'] = round(float(np.mean(items)), 1)
+            increases = [record['peak_increase_mb'] for record in records if record.get('peak_increase_mb') is not None]
+            if increases:
+                stages[name]['max_peak_increase_mb'] = max(increases)
+        summary[operation] = {'count': len(lines), **percentiles([line['seconds'] for line in lines]), 'stages': stages,
+                              'peak_rss_mb': max((line['peak_rss_mb'] for line in lines if line['peak_rss_mb'] is not None), default=None)}
+    return summary
+
+# Formats metricsSummary as markdown tables, one per operation, for display in the GUI.
+def summaryMarkdown(operations=None):
+    summary = metricsSummary(operations)
+    if not summary:
+        return 'Nothing has been timed yet.'
+
+    text = ''
+    for operation, totals in summary.items():
+        text += f"**{operation}** ({totals['count']} recent, peak memory {totals['peak_rss_mb']} MB)\n\n"
+        text += '| Stage | p50 (ms) | p95 (ms) | p99 (ms) | Mean items | Peak memory increase (MB) |\n| --- | ---: | ---: | ---: | ---: | ---: |\n'
+        for name, stageTotals in list(totals['stages'].items()) + [('total', totals)]:
+            text += f"| {name} | {stageTotals['p50_ms']:.1f} | {stageTotals['p95_ms']:.1f} | {stageTotals['p99_ms']:.1f} | {stageTotals.get('mean_items', '')} | {stageTotals.get('max_peak_increase_mb', '')} |\n"
+        text += '\n'
+    return text
+
+# This function reads the traces in a metrics file into memory, as if they had just been recorded, so that they can be summarized.
+# Only the last rollingWindow traces of each operation are kept. Returns the number of traces read.
+def readTraces(path):
+    count = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                trace = json.loads(line)
+                recentTraces[trace['operation']].append(trace)
+                count += 1
+    return count
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else metricsFile
+    if not os.path.exists(path):
+        print(f'Usage: python Scripts/Metrics.py [path/to/Metrics.jsonl]. {path} was not found.')
+        sys.exit(1)
+    print(f'Read {readTraces(path)} traces from {path}.\n')
+    print(json.dumps(metricsSummary(), indent=2))
@@ -0,0 +1,145 @@
+'''
+This script stores compressed copies of the embeddings of a library, so that searches need much less memory. Each segment of a library
+(see EncodedLibrary) always keeps its full float32 embeddings on disk. When a library uses one of the compressed modes below, searches
+score every chunk with the compressed copy, which is read into memory, and only read the full embeddings of a short list of the best
+chunks to rescore them exactly (see rescoreFactors).
+
+    float32   No compressed copy. Searches use the full embeddings. 4 bytes per dimension.
+    float16   Half-precision copy. 2 bytes per dimension, with almost no loss of accuracy.
+    int8      Every dimension is scaled to the range -127 to 127 (with one scale per dimension for each segment). 1 byte per dimension.
+    binary    Only the sign of every dimension is kept, and chunks are compared by counting the signs that differ (Hamming distance).
+              1 bit per dimension. This is the least accurate, so it should be used with rescoring.
+
+All compressed copies are made from normalized embeddings, so their scores approximate cosine similarity.
+The mode of a library is recorded in its header. It can be chosen when a library is created (see ExtractPDF.quantization),
+or changed later with EncodedLibrary.setQuantization, or by running this script directly: python Scripts/Quantize.py path/to/library int8
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import numpy as np # Critical - Reads and writes the compressed embeddings.
+import torch # Critical - Scores the compressed embeddings.
+
+#####----- Settings -----#####
+modes = ['float32', 'float16', 'int8', 'binary'] # The available modes, from the most to the least accurate.
+blockRows = 65536 # The number of rows compressed at a time, to limit memory use.
+# For each mode, how many times the number of results are rescored with the full embeddings. Less accurate modes need a longer short list.
+rescoreFactors = {'float32': 0, 'float16': 2, 'int8': 4, 'binary': 50}
+
+# The number of bits set in every possible byte, used to count the signs that differ between binary embeddings.
+bitCounts = torch.tensor([bin(i).count('1') for i in range(256)], dtype=torch.int16)
+
+# Returns the name of the file holding the compressed copy of a segment's embeddings, and of the file holding its scales.
+def quantizedFile(mode):
+    return f'embeddings-{mode}.bin'
+
+def scaleFile(mode):
+    return f'scale-{mode}.npy'
+
+# Returns the number of bytes each row takes in the given mode.
+def rowBytes(mode, dimension):
+    return {'float32': 4 * dimension, 'float16': 2 * dimension, 'int8': dimension, 'binary': (dimension + 7) // 8}[mode]
+
+#####----- Compress -----#####
+
+# Scales every row to unit length.
+def normalizeRows(block):
+    block = np.asarray(block, dtype=np.float32)
+    return block / np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+
+# Compresses one block of normalized embeddings.
+def compressBlock(block, mode, scale=None):
+    if mode == 'float16':
+        return block.astype(np.float16)
+    if mode == 'int8':
+        return np.clip(np.rint(block / scale), -127, 127).astype(np.int8)
+    if mode == 'binary':
+        return np.packbits(block > 0, axis=1)
+    raise ValueError(f'Unknown quantization mode: {mode}. Choose from {modes}.')
+
+# This function writes the compressed copy of a segment's embeddings (which can be memory-mapped) to the segment's folder, a block at a time.
+# Nothing is written for float32, as the full embeddings are used directly.
+def writeQuantized(folder, embeddings, mode):
+    if mode == 'float32':
+        return
+    if mode not in modes:
+        raise ValueError(f'Unknown quantization mode: {mode}. Choose from {modes}.')
+
+    # The int8 scale of every dimension is found first, so that the largest value in each dimension becomes 127.
+    scale = None
+    if mode == 'int8':
+        scale = np.zeros(embeddings.shape[1], dtype=np.float32)
+        for start in range(0, len(embeddings), blockRows):
+            scale = np.maximum(scale, np.abs(normalizeRows(embeddings[start:start + blockRows])).max(axis=0))
+        scale = np.maximum(scale, 1e-12) / 127
+        np.save(os.path.join(folder, scaleFile(mode)), scale)
+
+    tmpPath = os.path.join(folder, quantizedFile(mode) + '.tmp')
+    with open(tmpPath, 'wb') as f:
+        for start in range(0, len(embeddings), blockRows):
+            compressBlock(normalizeRows(embeddings[start:start + blockRows]), mode, scale).tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpPath, os.path.join(folder, quantizedFile(mode)))
+
+# Checks whether a segment already has a compressed copy in the given mode.
+def hasQuantized(folder, mode):
+    return mode == 'float32' or os.path.exists(os.path.join(folder, quantizedFile(mode)))
+
+# Returns the names of every file that a compressed copy can use within a segment folder.
+def segmentFiles():
+    return [name for mode in modes[1:] for name in (quantizedFile(mode), scaleFile(mode))]
+
+#####----- Load and Score -----#####
+
+# This function reads the compressed copy of a segment's embeddings into memory. Returns None for float32, as the full embeddings are used directly.
+def loadQuantized(folder, mode, rows, dimension):
+    if mode == 'float32':
+        return None
+    dtype = {'float16': np.float16, 'int8': np.int8, 'binary': np.uint8}[mode]
+    width = rowBytes(mode, dimension) // np.dtype(dtype).itemsize
+    data = np.fromfile(os.path.join(folder, quantizedFile(mode)), dtype=dtype, count=rows * width).reshape(rows, width)
+    quantized = {'mode': mode, 'data': torch.from_numpy(data), 'dimension': dimension}
+    if mode == 'int8':
+        quantized['scale'] = torch.from_numpy(np.load(os.path.join(folder, scaleFile(mode))))
+    return quantized
+
+# Loads the compressed copy of a segment, writing it first if the segment does not have one yet (such as segments added to the
+# library by another program, or made before the mode was chosen). If it cannot be written, None is returned and the full embeddings are used.
+def ensureQuantized(folder, embeddings, mode):
+    if not hasQuantized(folder, mode):
+        print(f'Compressing embeddings in {folder} to {mode}...')
+        try:
+            writeQuantized(folder, embeddings, mode)
+        except OSError:
+            return None
+    return loadQuantized(folder, mode, len(embeddings), embeddings.shape[1])
+
+# This function scores some rows (or every row, if rows is None) of a compressed copy against a normalized query (a 1D float tensor),
+# or against a batch of them (a 2D tensor with one query per row), in which case the scores of each query are returned in a column.
+# float16 and int8 scores approximate cosine similarity. Binary scores are 1 - 2 * (the fraction of signs that differ), which falls
+# in the same range and roughly follows it.
+def scoreQuantized(quantized, query, rows=None):
+    data = quantized['data'] if rows is None else quantized['data'][rows]
+    queries = query.reshape(-1, quantized['dimension'])
+    mode = quantized['mode']
+    if mode == 'float16':
+        scores = data.float() @ queries.T
+    elif mode == 'int8':
+        scores = data.float() @ (queries * quantized['scale']).T # The scale is applied to the queries rather than to every row.
+    elif mode == 'binary':
+        queryBits = torch.from_numpy(np.packbits(queries.numpy() > 0, axis=1))
+        distance = torch.stack([bitCounts[torch.bitwise_xor(data, bits).long()].sum(dim=1) for bits in queryBits], dim=1) # Hamming distance.
+        scores = 1 - 2 * distance.float() / quantized['dimension']
+    else:
+        raise ValueError(f'Unknown quantization mode: {mode}.')
+    return scores[:, 0] if query.dim() == 1 else scores
+
+if __name__ == '__main__':
+    import sys
+    import EncodedLibrary
+    if len(sys.argv) < 3 or sys.argv[2] not in modes:
+        print(f'Usage: python Scripts/Quantize.py path/to/library [{"|".join(modes)}]')
+        sys.exit(1)
+
+    header = EncodedLibrary.setQuantization(sys.argv[1], sys.argv[2])
+    print(f'{sys.argv[1]} now searches with {sys.argv[2]} embeddings ({rowBytes(sys.argv[2], header["dimension"]) * header["rows"] / 1e6:.1f} MB in memory).')
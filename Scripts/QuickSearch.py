@@ -8,83 +8,505 @@ the full PDF. Basic Retrieval Augmented Generation functionality is also include
 #####----- Import Packages -----#####
 import pandas as pd # Critical - Necessary for working with extracted PDF content and metadata.
 import torch # Critical - Provides tools for working with Small Language Models.
-from sentence_transformers import SentenceTransformer, CrossEncoder, util # Critical - Runs Small Language Models used for semantic search.
+import numpy as np # Critical - Holds the cross-encoder scores.
+import time # Critical - Times the reranking of search results.
+import threading # Critical - Stops two searches from running the same model at the same time.
+import concurrent.futures # Critical - Searches several segments (such as those of different mounted libraries) at the same time.
 import pickle # Critical - Saves and reads the Encoded Libraries.
 import os # Critical - Base Python package needed for many functions.
 import re # Critical - Base Python package used to modify strings.
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline, logging # Optional - Allows for Microsoft Phi 3.5 to be run for RAG.
+from transformers import pipeline, logging # Critical - Runs the QA model used to highlight answers.
 import torch.nn as nn # Optional - Allows for the use Sigmoid activation function for the cross-encoder.
+import EncodedLibrary # Critical - Python script that saves and loads Encoded Libraries.
+import AnnIndex # Critical - Python script that narrows down the chunks compared with each query in large libraries.
+import Quantize # Critical - Python script that scores the compressed copies of library embeddings.
+import LibraryFilter # Critical - Python script that limits searches to the documents matching some filters.
+import SearchCache # Critical - Python script that caches query embeddings and search results.
+import InferenceBackend # Critical - Python script that runs the models with PyTorch or ONNX Runtime.
+import Metrics # Critical - Python script that records how long each stage of a search takes.
+import Summarizer # Optional - Python script that summarizes search results with generative AI (Microsoft Phi 3.5) for RAG.
 
 #####----- Load Models and Data -----#####
+# The currently loaded library. These are set by loadLibrary or loadPickle. When several library folders are mounted at once (see mountLibrary),
+# they hold all of the mounted libraries one after the other, as if they were a single library with the segments of each of them.
+libraryMounts = [] # The library folders that are searched together (see openMount). The first is the main library, loaded by loadLibrary.
+pdfTable = None # The metadata (and, for .pkl libraries, the text) of every chunk in the library.
+libraryEmbeddings = None # The embeddings of every chunk in the library. For library folders, this is a list with the embeddings of each segment.
+libraryText = None # The text file of each segment of the library (see EncodedLibrary.readText). None for .pkl libraries.
+libraryHeader = None # The header of the main library (see EncodedLibrary.readHeader). None for .pkl libraries.
+libraryDeleted = None # The rows of the library that belong to PDFs which have been changed or deleted since (see SyncLibrary). None if there are none.
+libraryIndexes = None # The search index of each segment of the library (see AnnIndex), or None for segments that are searched exactly. None for .pkl libraries.
+libraryQuantized = None # The compressed embeddings of each segment of the library (see Quantize), or None for segments that are searched with their full embeddings.
+libraryNorms = None # One over the length of every embedding of each segment (see AnnIndex.inverseNorms), or None for segments searched with compressed embeddings.
+libraryDocuments = None # One row per PDF in the library, with its metadata and the ranges of rows that hold its chunks (see LibraryFilter.buildDocuments).
+
+#####----- Search Settings -----#####
+rescoreResults = True # Whether the best rows found with compressed embeddings are rescored with the full embeddings (see Quantize.rescoreFactors).
+encodeBatchSize = 64 # The number of queries encoded at a time by searchMany.
+rerankBatchSize = 128 # The number of query/paragraph pairs scored at a time by the cross-encoder. Pairs of similar length are batched together (see rerankPairs).
+retrieveWorkers = 4 # The number of segments (such as those of different mounted libraries) searched at the same time by retrieve.
+
+#####----- Highlight Settings -----#####
+# How the answer to the query is highlighted in each relevant result, using the QA model. The results are always shown before they are highlighted (see streamSearch).
+# 'batched' finds the answers in every relevant result at once.
+# 'deferred' only finds the answers in the first few results (see deferredHighlights), as they are the ones the user sees first. The answers
+#     in the rest are found when the user asks for them (the 'Highlight more' button in the GUI, see highlightMore).
+# 'off' only highlights answers that have already been found (such as for a repeated query), or that the user asks for (see highlightMore).
+highlightMode = 'batched'
+highlightThreshold = 0.8 # Only results with a cross-encoder score above this are highlighted.
+highlightBatchSize = 16 # The number of paragraphs the QA model reads at a time.
+deferredHighlights = 10 # In the 'deferred' mode, only this many of the first results are highlighted. highlightMore highlights this many more each time.
+
+#####----- Cache Settings -----#####
+embeddingCacheSize = 1024 # The number of query embeddings kept, so that repeated queries are not encoded again. 0 turns the cache off.
+resultCacheSize = 256 # The number of search results kept, so that repeated queries are not searched again. 0 turns the cache off.
+rerankCacheSize = 20000 # The number of cross-encoder scores kept, so that a paragraph found again for the same query is not scored again. 0 turns the cache off.
+highlightCacheSize = 5000 # The number of highlighted answers kept, so that the QA model is not run again for the same query and paragraph. 0 turns the cache off.
+cacheTTL = 3600 # The number of seconds cached embeddings and results are kept for. None keeps them until the cache is full.
+
+# The caches themselves (see SearchCache). Cached results are only used for the library version they were found in (libraryVersion),
+# and are cleared whenever a library is loaded or closed.
+embeddingCache = SearchCache.newCache(embeddingCacheSize, cacheTTL)
+resultCache = SearchCache.newCache(resultCacheSize, cacheTTL)
+rerankCache = SearchCache.newCache(rerankCacheSize, cacheTTL)
+highlightCache = SearchCache.newCache(highlightCacheSize, cacheTTL)
+libraryVersion = None # Identifies the loaded library and its contents. Set by loadLibrary or loadPickle.
+retrievePool = None # The threads that search segments at the same time (see retrieve). Started the first time they are needed.
+# The tokenizers of the models cannot be used by two threads at once, so searches running at the same time (such as in the GUI or BatchSearch)
+# take turns to run the models. The rest of each search (such as scoring the library and reading paragraphs) still runs at the same time.
+modelLock = threading.Lock()
+
 # This function is used to load the AI models used for semantic search.
-# It is called before the GUI is loaded, so that the GUI is more responsive initially.
+# The GUI loads them one at a time in the background instead, in the order they are needed (see Startup).
 def initializeEmbedders():
+    loadEmbedder()
+    loadCrossEncoder()
+    loadQAModel()
+
+    # Cached embeddings and results were made by the previous models, so they are no longer valid.
+    SearchCache.clearCache(embeddingCache)
+    SearchCache.clearCache(resultCache)
+    SearchCache.clearCache(rerankCache)
+    SearchCache.clearCache(highlightCache)
+
+# The following functions load each of the models used for semantic search.
+# The bi-encoder and cross-encoder are run with the backend set in InferenceBackend (PyTorch by default). The QA model always uses PyTorch.
+# Note: If desired, changing these models to new versions is relatively straight-forward.
+# The bi-directional encoder, which encodes queries.
+def loadEmbedder():
     global embedder
-    global model
-    global QAModel
-
     logging.set_verbosity_error() # Stops HF warning from using old models
+    embedder = InferenceBackend.loadEmbedder('Snowflake/snowflake-arctic-embed-s')
+
+# The cross-encoder, which reranks search results.
+def loadCrossEncoder():
+    global model
+    logging.set_verbosity_error()
+    model = InferenceBackend.loadCrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2', max_length=512)
 
-    # Load the bi-directional encoder and cross-encoder that are used for semantic search.
-    # Note: If desired, changing these models to new versions is relatively straight-forward.
-    embedder = SentenceTransformer('Snowflake/snowflake-arctic-embed-s') 
-    model = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2', max_length=512)
+# The question-answering model, which finds the answers highlighted in search results.
+def loadQAModel():
+    global QAModel
+    logging.set_verbosity_error()
     QAModel = pipeline('question-answering', model="deepset/tinyroberta-squad2", tokenizer="deepset/tinyroberta-squad2")
 
-# This function loads an Encoded Library that was saved previously.
+# This function loads an Encoded Library that was saved previously, either as a library folder or as a .pkl file.
+# Any other libraries that were mounted are released, so that only this library is searched (see mountLibrary to search several at once).
+def loadLibrary(ULibrary):
+
+    # Libraries saved as a .pkl file are loaded the old way.
+    if not EncodedLibrary.isLibrary(ULibrary):
+        return loadPickle(ULibrary)
+
+    closeLibrary() # Release the previous library first, so its files are not held open.
+    mountLibrary(ULibrary)
+
+    return ULibrary # Return the path to the currently loaded Encoded Library.
+
+# This function opens a library folder so that it can be searched. Returns a dictionary (a mount) with its path, header and metadata, and the
+# embeddings, text file, search index, compressed embeddings and embedding lengths of each of its segments, as well as the rows it has deleted.
+def openMount(libDir):
+
+    # Load the Encoded Library. The embeddings are memory-mapped and the text is left on disk until it is displayed.
+    table, embeddings, header, text = EncodedLibrary.loadLibrary(libDir)
+    mount = {'path': os.path.realpath(libDir), 'header': header, 'pdfTable': table, 'embeddings': embeddings, 'text': text}
+
+    # Load the rows that should be skipped by searches, if there are any.
+    mount['deleted'] = EncodedLibrary.readDeleted(libDir, header)
+
+    # Load the search index of each large segment, building any that are missing (such as for libraries made by older versions).
+    mount['indexes'] = [AnnIndex.ensureIndex(EncodedLibrary.segmentDir(libDir, segment), segmentEmbeddings)
+                        for segment, segmentEmbeddings in zip(header['segments'], embeddings)]
+
+    # Load the compressed embeddings of each segment, if the library uses them (see Quantize). These are read into memory, while the full embeddings stay on disk.
+    mount['quantized'] = [Quantize.ensureQuantized(EncodedLibrary.segmentDir(libDir, segment), segmentEmbeddings.numpy(), header['quantization'])
+                          for segment, segmentEmbeddings in zip(header['segments'], embeddings)]
+
+    # Find the length of every embedding that is searched with the full embeddings, so that scores do not need a normalized copy of them.
+    mount['norms'] = [AnnIndex.inverseNorms(segmentEmbeddings) if quantized is None else None for segmentEmbeddings, quantized in zip(embeddings, mount['quantized'])]
+
+    # A library folder changes whenever a new generation of it is committed (see EncodedLibrary.commitHeader), such as when PDFs are merged or synced.
+    mount['version'] = (mount['path'], header['generation'], tuple(segment['name'] for segment in header['segments']))
+
+    # Warn the user if the library was encoded with a different model to the one used for queries.
+    if header['model'] != EncodedLibrary.defaultModel:
+        print(f"Warning: {libDir} was encoded with {header['model']}, but queries are encoded with {EncodedLibrary.defaultModel}.")
+    return mount
+
+# This function mounts a library folder alongside the libraries that are already loaded, so that every search covers all of them: each is searched
+# separately (at the same time, see retrieveWorkers), then the best results of all of them are reranked together. Mounting a library does not change
+# any of the libraries, so libraries can be kept per team or per project and mounted or unmounted at any time instead of being merged.
+# A library that is already mounted is opened again, such as after it has been synced. Returns the paths of the mounted libraries.
+def mountLibrary(libDir):
+    if not EncodedLibrary.isLibrary(libDir):
+        raise ValueError(f'{libDir} is not a library folder. Only library folders can be mounted (see EncodedLibrary.convertPickle for .pkl files).')
+    if libraryMounts == [] and pdfTable is not None:
+        closeLibrary() # A .pkl library cannot be searched alongside other libraries, so it is released.
+    trace = Metrics.startTrace('mount_library') # Loading a library folder (see loadLibrary) is traced as mounting it.
+
+    with Metrics.stage(trace, 'open') as record:
+        mount = openMount(libDir)
+        record['items'] = len(mount['pdfTable'])
+    if libraryMounts and mount['header']['dimension'] != libraryMounts[0]['header']['dimension']:
+        EncodedLibrary.closeText(mount['text'])
+        raise ValueError(f"{libDir} cannot be searched with the loaded libraries, as its embeddings have {mount['header']['dimension']} dimensions rather than {libraryMounts[0]['header']['dimension']}.")
+
+    position = next((i for i, other in enumerate(libraryMounts) if other['path'] == mount['path']), None)
+    if position is None:
+        libraryMounts.append(mount)
+    else: # Replace the old copy of the library, keeping its place.
+        EncodedLibrary.closeText(libraryMounts[position]['text'])
+        libraryMounts[position] = mount
+    with Metrics.stage(trace, 'combine') as record:
+        combineMounts()
+        record['items'] = len(pdfTable)
+    Metrics.finishTrace(trace, rows=len(mount['pdfTable']), segments=len(mount['header']['segments']), mounted=len(libraryMounts))
+    return loadedLibraries()
+
+# This function stops searching a mounted library and closes its files. Returns the paths of the libraries that are still mounted.
+def unmountLibrary(libDir):
+    path = os.path.realpath(libDir)
+    position = next((i for i, mount in enumerate(libraryMounts) if mount['path'] == path), None)
+    if position is None:
+        raise ValueError(f'{libDir} is not mounted.')
+    EncodedLibrary.closeText(libraryMounts.pop(position)['text'])
+    combineMounts()
+    return loadedLibraries()
+
+# Returns the paths of the loaded libraries: every mounted library folder, the main library first, or the .pkl library that is loaded.
+def loadedLibraries():
+    if libraryMounts:
+        return [mount['path'] for mount in libraryMounts]
+    return [libraryVersion[0]] if libraryVersion is not None else []
+
+# This function sets the loaded library from the mounted libraries, placing their rows and segments one after the other.
+def combineMounts():
+    global pdfTable
+    global libraryEmbeddings
+    global libraryText
+    global libraryHeader
+    global libraryDeleted
+    global libraryIndexes
+    global libraryQuantized
+    global libraryNorms
+    global libraryDocuments
+    global libraryVersion
+
+    # Results found before a library was mounted or unmounted must not be shown afterwards.
+    SearchCache.clearCache(resultCache)
+    SearchCache.clearCache(rerankCache)
+    SearchCache.clearCache(highlightCache)
+
+    if not libraryMounts:
+        pdfTable = libraryEmbeddings = libraryText = libraryHeader = libraryDeleted = None
+        libraryIndexes = libraryQuantized = libraryNorms = libraryDocuments = libraryVersion = None
+        return
+
+    tables = []
+    deleted = []
+    rowOffset = 0 # The row at which the current library starts.
+    segmentOffset = 0 # The number of segments before the current library.
+    for mount in libraryMounts:
+        table = mount['pdfTable'].copy()
+        table['Segment'] += segmentOffset # Rows refer to the text file of their segment, whose position has moved along.
+        table['Library'] = mount['path']
+        tables.append(table)
+        deleted.append(mount['deleted'] + rowOffset)
+        rowOffset += len(table)
+        segmentOffset += len(mount['embeddings'])
+
+    pdfTable = pd.concat(tables, ignore_index=True)
+    pdfTable['Library'] = pdfTable['Library'].astype('category') # Each path is only stored once.
+    libraryEmbeddings = [embeddings for mount in libraryMounts for embeddings in mount['embeddings']]
+    libraryText = [text for mount in libraryMounts for text in mount['text']]
+    libraryIndexes = [index for mount in libraryMounts for index in mount['indexes']]
+    libraryQuantized = [quantized for mount in libraryMounts for quantized in mount['quantized']]
+    libraryNorms = [norms for mount in libraryMounts for norms in mount['norms']]
+    libraryHeader = libraryMounts[0]['header']
+    deleted = np.concatenate(deleted)
+    libraryDeleted = torch.from_numpy(deleted) if len(deleted) > 0 else None
+    libraryVersion = tuple(mount['version'] for mount in libraryMounts) if len(libraryMounts) > 1 else libraryMounts[0]['version']
+
+    # List the documents in the library and the rows that hold their chunks, so that searches can be limited to some of them.
+    libraryDocuments = LibraryFilter.buildDocuments(pdfTable)
+
+# This function loads an Encoded Library that was saved previously as a .pkl file.
 def loadPickle(UPickle):
 
     global pdfTable
     global libraryEmbeddings
+    global libraryText
+    global libraryHeader
+    global libraryNorms
+    global libraryDocuments
+    global libraryVersion
     global SearchReady
 
     # Get the path to the Encoded Library, as specified by the user through the GUI.
     Pickle = UPickle
 
+    closeLibrary() # Release the previous library first, so its files are not held open.
+    trace = Metrics.startTrace('load_pickle', megabytes=round(os.path.getsize(Pickle) / 2**20, 2))
+
     # Load the Encoded Library.
-    with open(Pickle, 'rb') as f:  # Python 3: open(..., 'rb')
-        pdfTable, libraryEmbeddings = pickle.load(f)
+    with Metrics.stage(trace, 'read') as record:
+        with open(Pickle, 'rb') as f:  # Python 3: open(..., 'rb')
+            pdfTable, libraryEmbeddings = pickle.load(f)
+        record['items'] = len(pdfTable)
+
+    # The text of .pkl libraries is held in the Content column of the pdfTable, so there is no text file.
+    libraryText = None
+    libraryHeader = None
+    with Metrics.stage(trace, 'norms'):
+        libraryNorms = [AnnIndex.inverseNorms(libraryEmbeddings)]
+    with Metrics.stage(trace, 'documents') as record:
+        libraryDocuments = LibraryFilter.buildDocuments(pdfTable)
+        record['items'] = len(libraryDocuments)
+    libraryVersion = (os.path.realpath(Pickle), os.path.getmtime(Pickle), os.path.getsize(Pickle))
+    Metrics.finishTrace(trace, rows=len(pdfTable))
 
     return Pickle # Return the path to the currently loaded Encoded Library.
 
-#####----- Semantic Search -----#####
-# This function takes the user's query, retrieves the most relevant text passages from the
-# Encoded Library, then formats the results using markdown to present to the user.
-# Semantic search functionality is based on code provided in the Sentence-Transformers documentation.
-# See here for further details: https://www.sbert.net/examples/applications/semantic-search/README.html.
-def Search(UInput, Results_slider, genAI): # Arguments are the user's query, the max number of results to return, and whether to include a RAG summary.
-    query = UInput
-    topK = min(Results_slider, len(pdfTable['Content'])) # Ensure that max number of results is not longer than the total number of records.
-
-    # Find the closest n sentences of the corpus for each query sentence based on cosine similarity.
-    queryEmbedding = embedder.encode(query, prompt_name="query", convert_to_tensor=True)
-    
-    # Use cosine similarity and torch.topk to find the highest k scores
-    similarity_scores = util.cos_sim(queryEmbedding, libraryEmbeddings)[0].cpu().tolist()
-    similarity_scores = torch.tensor(similarity_scores)
-    scores, indices = torch.topk(similarity_scores, k=topK)
-
-    # Print the query in the Command Prompt window for debugging.
-    print("\nQuery:", query, "\n------------------------------------------------------")
-    print(f"Top {topK} most similar paragraphs in document library:\n------------------------------------------------------ \n")
-
-    # Initialize variables
-    pairs = []
-    original_indices = []
-
-    # Create pairs of the query and each paragraph determined to be relevant (based on top k), while keeping track of original indices.
-    for score, idx in zip(scores, indices):
-        paragraph = pdfTable.at[idx.item(), 'Content']
-        pairs.append([query, paragraph])
-        original_indices.append(idx.item())
-
-    # Predict the similarity of each query/paragraph pair using a cross-encoder.
-    cross_encoder_scores = model.predict(pairs, activation_fn=nn.Sigmoid())
-
-    # Combine query/paragraph pairs, their similarity scores, and original indices into a list of tuples. Then sort by score in descending order
-    combined = list(zip(pairs, cross_encoder_scores, original_indices))
-    combined.sort(key=lambda x: x[1], reverse=True)
-
+# This function releases the currently loaded libraries (if any), closing the files that they have open.
+def closeLibrary():
+    global pdfTable
+    global libraryEmbeddings
+    global libraryText
+    global libraryNorms
+    global libraryDocuments
+    global libraryVersion
+
+    for mount in libraryMounts:
+        EncodedLibrary.closeText(mount['text'])
+    libraryMounts.clear()
+    combineMounts() # Also clears the results found in the previous libraries.
+
+    # .pkl libraries are not mounted, so they are released here.
+    pdfTable = None
+    libraryEmbeddings = None
+    libraryText = None
+    libraryNorms = None
+    libraryDocuments = None
+    libraryVersion = None
+
+#####----- Caches -----#####
+# Queries that only differ in their spacing are treated as the same query.
+def normalizeQuery(query):
+    return ' '.join(str(query).split())
+
+# This function encodes a list of (normalized) queries, using the cached embedding of any query that has been encoded before.
+# The rest are encoded together in one batch. Returns a tensor with the embedding of each query in a row.
+def encodeQueries(queries):
+    queryEmbeddings = [None] * len(queries)
+    for i, query in enumerate(queries):
+        queryEmbeddings[i] = SearchCache.getCached(embeddingCache, query)[1]
+
+    missing = [i for i, embedding in enumerate(queryEmbeddings) if embedding is None]
+    if len(missing) > 0:
+        with modelLock:
+            encoded = embedder.encode([queries[i] for i in missing], prompt_name="query", convert_to_tensor=True, batch_size=encodeBatchSize).cpu()
+        for i, embedding in zip(missing, encoded):
+            queryEmbeddings[i] = embedding
+            SearchCache.putCached(embeddingCache, queries[i], embedding)
+    return torch.stack(queryEmbeddings)
+
+# Returns the size, hits and misses of the query embedding, search result and cross-encoder score caches (see SearchCache.cacheStats).
+def cacheStats():
+    return {'embeddings': SearchCache.cacheStats(embeddingCache), 'results': SearchCache.cacheStats(resultCache), 'rerank': SearchCache.cacheStats(rerankCache),
+            'highlights': SearchCache.cacheStats(highlightCache)}
+
+# This function returns the text of a single chunk (paragraph) in the loaded library, given its row number.
+def getParagraph(idx):
+    if libraryText is None: # The text of .pkl libraries is kept in the pdfTable.
+        return pdfTable.at[idx, 'Content']
+    return EncodedLibrary.readText(libraryText[pdfTable.at[idx, 'Segment']], pdfTable.at[idx, 'Text_Offset'], pdfTable.at[idx, 'Text_Length'])
+
+# This function returns a copy of the loaded pdfTable with the text of every chunk in its Content column.
+# It reads the whole library, so it should only be used when the whole library is needed (such as when merging).
+# When several libraries are mounted, only the rows of the main library (the one loaded by loadLibrary) are returned.
+def getLibraryTable():
+    table = pdfTable.copy()
+    if libraryText is not None:
+        table = table.iloc[:len(libraryMounts[0]['pdfTable'])].copy()
+        table['Content'] = EncodedLibrary.readAllText(table, libraryText)
+        table = table.drop(columns=['Text_Offset', 'Text_Length', 'Segment', 'Library'])
+    return table
+
+# This function returns the embeddings, search index, compressed embeddings and embedding lengths of each segment of the loaded library.
+# .pkl libraries are a single segment that is searched exactly.
+def librarySegments():
+    if not isinstance(libraryEmbeddings, list):
+        return [(libraryEmbeddings, None, None, libraryNorms[0])]
+    return list(zip(libraryEmbeddings, libraryIndexes, libraryQuantized, libraryNorms))
+
+# This function returns the library rows of the PDFs that match some search filters (see LibraryFilter) as a sorted tensor, or None if no filters are set.
+def searchScope(filters):
+    scope = LibraryFilter.scopeRows(libraryDocuments, filters)
+    return None if scope is None else torch.from_numpy(scope)
+
+# This function finds the k chunks of the loaded library that are most similar to each of a batch of encoded queries (one per row of queryEmbeddings),
+# skipping the rows of PDFs that have been changed or deleted since the library was built. Every segment is searched for all of the queries
+# at once: large segments only score the chunks in the clusters closest to each query (probes), and small segments score every chunk (see AnnIndex).
+# Up to retrieveWorkers segments are searched at the same time, and the best chunks of every segment (and so of every mounted library) are then merged.
+# For libraries with compressed embeddings, a longer short list is found first and then rescored with the full embeddings.
+# If scope (a sorted tensor of library rows, see searchScope) is given, only those rows are scored, so searches limited to a few documents are much faster.
+# Returns the row numbers of the chunks and their cosine similarities, best first, with one row per query. Missing results are -1.
+def retrieve(queryEmbeddings, k, probes=AnnIndex.defaultProbes, scope=None):
+    queries = AnnIndex.normalize(queryEmbeddings.cpu().reshape(-1, queryEmbeddings.shape[-1]))
+    segments = librarySegments()
+    compressed = rescoreResults and any(quantized is not None for _, _, quantized, _ in segments)
+    shortlist = k * max(1, max(Quantize.rescoreFactors[mount['header']['quantization']] for mount in libraryMounts)) if compressed else k
+
+    excluded = None # Marks the rows that searches should skip.
+    if libraryDeleted is not None:
+        excluded = torch.zeros(len(pdfTable), dtype=torch.bool)
+        excluded[libraryDeleted] = True
+
+    tasks = [] # The segments to search, with the library row at which each starts.
+    segmentStart = 0 # The library row at which the current segment starts.
+    for embeddings, index, quantized, norms in segments:
+        segmentExcluded = None if excluded is None else excluded[segmentStart:segmentStart + len(embeddings)]
+        segmentScope = None # None searches the whole segment.
+        if scope is not None: # Only search the rows of the segment that are in scope, counted from the start of the segment.
+            segmentScope = scope[torch.searchsorted(scope, segmentStart):torch.searchsorted(scope, segmentStart + len(embeddings))] - segmentStart
+        if segmentScope is None or len(segmentScope) > 0:
+            tasks.append((segmentStart, embeddings, index, quantized, norms, segmentExcluded, segmentScope))
+        segmentStart += len(embeddings)
+
+    # Searches one segment, returning its best rows counted from the start of the library.
+    def searchTask(task):
+        segmentStart, embeddings, index, quantized, norms, segmentExcluded, segmentScope = task
+        rows, scores = AnnIndex.searchSegmentMany(queries, embeddings, index, shortlist, probes, quantized, norms, segmentExcluded, segmentScope)
+        return torch.where(rows >= 0, rows + segmentStart, rows), scores
+
+    found = list(startRetrievePool().map(searchTask, tasks)) if len(tasks) > 1 and retrieveWorkers > 1 else [searchTask(task) for task in tasks]
+    allRows = [torch.full((len(queries), 0), -1, dtype=torch.int64)] + [rows for rows, _ in found]
+    allScores = [torch.zeros(len(queries), 0)] + [scores for _, scores in found]
+
+    # Keep the best rows of each query across all of the segments.
+    rows, scores = AnnIndex.mergeTop(allRows[0], allScores[0], torch.cat(allRows[1:], dim=1), torch.cat(allScores[1:], dim=1), shortlist) if len(allRows) > 1 else (allRows[0], allScores[0])
+    if compressed:
+        rows, scores = rescore(queries, rows, scores, k)
+    return rows[:, :k], scores[:, :k]
+
+# Returns the threads that search segments at the same time, starting them the first time they are needed.
+def startRetrievePool():
+    global retrievePool
+    if retrievePool is None:
+        retrievePool = concurrent.futures.ThreadPoolExecutor(retrieveWorkers, thread_name_prefix='Retrieve')
+    return retrievePool
+
+# Processes forked from this one (such as the workers of BatchSearch) do not inherit its threads, so they start their own.
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda: globals().update(retrievePool=None))
+
+# For libraries with compressed embeddings, this function scores the short listed rows of each query (rows, one row per query) again with the
+# full embeddings, which are read from disk for those rows only. Returns the k best rows of each query and their exact scores.
+def rescore(queries, rows, scores, k):
+    scores = scores.clone()
+    step = max(1, AnnIndex.blockScores // max(1, rows.shape[1] * queries.shape[1])) # The number of queries rescored at a time, to limit memory use.
+    for start in range(0, len(queries), step):
+        block = rows[start:start + step]
+        unique, positions = torch.unique(block.clamp_min(0), return_inverse=True) # Each row is read once, in order, however many queries found it.
+        vectors = torch.empty(len(unique), queries.shape[1])
+        segmentStart = 0 # The library row at which the current segment starts.
+        for embeddings in libraryEmbeddings:
+            inSegment = (unique >= segmentStart) & (unique < segmentStart + len(embeddings))
+            if inSegment.any():
+                vectors[inSegment] = AnnIndex.normalize(embeddings[unique[inSegment] - segmentStart])
+            segmentStart += len(embeddings)
+        scores[start:start + step] = torch.bmm(vectors[positions], queries[start:start + step].unsqueeze(2))[:, :, 0]
+
+    scores[rows < 0] = -torch.inf
+    scores, order = torch.topk(scores, k=min(k, scores.shape[1]), dim=1)
+    return torch.gather(rows, 1, order), scores
+
+#####----- Rerank -----#####
+# This function scores query/paragraph pairs with the cross-encoder. queries, rows and paragraphs hold the query, the row number of the chunk
+# and its text for each pair. Pairs that have been scored before (the same query and chunk, in this version of the library) are taken from
+# the rerank cache. The rest are sorted by length and scored in batches of rerankBatchSize, so that short and long paragraphs are not
+# batched together and little time is spent on padding. Returns the score of each pair, and how many pairs were scored (and taken from
+# the cache) and how long it took. These are returned rather than kept in a global, as several searches can be reranked at the same time.
+def rerankPairs(queries, rows, paragraphs):
+    start = time.perf_counter()
+
+    scores = np.zeros(len(rows), dtype=np.float32)
+    keys = [(libraryVersion, query, row) for query, row in zip(queries, rows)]
+    missing = []
+    for i, key in enumerate(keys):
+        found, score = SearchCache.getCached(rerankCache, key)
+        if found:
+            scores[i] = score
+        else:
+            missing.append(i)
+
+    if len(missing) > 0:
+        missing.sort(key=lambda i: len(queries[i]) + len(paragraphs[i])) # Similar lengths end up in the same batch.
+        with modelLock:
+            predicted = model.predict([[queries[i], paragraphs[i]] for i in missing], batch_size=rerankBatchSize, activation_fn=nn.Sigmoid())
+        for i, score in zip(missing, predicted):
+            scores[i] = score
+            SearchCache.putCached(rerankCache, keys[i], float(score))
+
+    stats = {'pairs': len(rows), 'cached': len(rows) - len(missing), 'batches': -(-len(missing) // rerankBatchSize),
+             'milliseconds': (time.perf_counter() - start) * 1000}
+    return scores, stats
+
+#####----- Highlight Answers -----#####
+# This function uses the QA model to find the part of each paragraph that best answers the query, so that it can be highlighted.
+# Answers that have been found before (for the same query and chunk, in this version of the library) are taken from the highlight cache.
+# The rest are found with a single call to the QA model, which reads highlightBatchSize paragraphs at a time, unless compute is False.
+# Returns a dictionary with the (start, end) of the answer in each paragraph, by row number, or None where no answer was found.
+def findHighlights(query, rows, paragraphs, compute=True):
+    highlights = {}
+    missing = []
+    for row, paragraph in zip(rows, paragraphs):
+        found, span = SearchCache.getCached(highlightCache, (libraryVersion, query, row))
+        if found:
+            highlights[row] = span
+        else:
+            missing.append((row, paragraph))
+
+    if compute and len(missing) > 0:
+        with modelLock:
+            answers = QAModel(question=[query] * len(missing),
+                              context=[paragraph for _, paragraph in missing],
+                              max_seq_len=512,  # TinyRoBERTa max capacity
+                              doc_stride=128,    # Overlap chunk window size
+                              handle_impossible_answer=True,
+                              batch_size=highlightBatchSize
+            )
+        if isinstance(answers, dict): # The QA model returns a single answer (rather than a list) for a single paragraph.
+            answers = [answers]
+        for (row, _), ans in zip(missing, answers):
+            highlights[row] = (ans['start'], ans['end']) if ans['answer'] else None
+            SearchCache.putCached(highlightCache, (libraryVersion, query, row), highlights[row])
+    return highlights
+
+# This function formats reranked search results (combined, a list of query/paragraph pairs with their scores and row numbers, see Search)
+# as markdown, highlighting the answer in each paragraph that has one in highlights (see findHighlights). A warning is added above the first
+# result that does not appear relevant, unless warn is False. The paragraph of each pair is replaced with its formatted text.
+def formatResults(combined, highlights, warn=True):
     sResults = "------------------------------------------------------<br>" # Initialize the variable that will present search results to the user.
     warningGiven = False # Initialize a variable to track whether a warning has already been given about the low relevancy of results (if applicable).
     relevanceWarn = '' # Initialize the warning message itself.
@@ -92,25 +514,13 @@ def Search(UInput, Results_slider, genAI): # Arguments are the user's query, the
     # For each query/paragraph pair (in order of decreasing similarity scores), get relevant information to present as a search result to the user.
     for idx, (pair, ce_score, original_idx) in enumerate(combined):
         
-        # If the answer is sufficiently relevant, use a QA model to find the most relevant part of the answer to highlight
-        if ce_score > 0.8:
-            ans = QAModel(question=pair[0],
-                          context=pair[1],
-                          max_seq_len=512,  # TinyRoBERTa max capacity
-                          doc_stride=128,    # Overlap chunk window size
-                          handle_impossible_answer=True
-            )
-            
-            # If the QA model identified an answer, insert tags that will be replaced with markdown highlights later
-            if ans['answer']:
-                start = ans['start']
-                end = ans['end']
-
-                # Insert unique tags that can be replaced by markdown after in-text markdown is stripped
-                pair[1] = pair[1][:start] + "89451486489 HLSTART 89451486489" + pair[1][start:end] + "89451486489 HLEND 89451486489" + pair[1][end:]
-            
-            del(ans) # Clear answer so it does not persist to future iterations
+        # If the QA model identified an answer, insert tags that will be replaced with markdown highlights later
+        span = highlights.get(original_idx)
+        if span is not None:
+            start, end = span
 
+            # Insert unique tags that can be replaced by markdown after in-text markdown is stripped
+            pair[1] = pair[1][:start] + "89451486489 HLSTART 89451486489" + pair[1][start:end] + "89451486489 HLEND 89451486489" + pair[1][end:]
 
         pdfPath = pdfTable['File_Path'].iloc[original_idx] # Retrieve the file path of the PDF where the paragraph in this pair was sourced.
         pageNum = pdfTable['Page'].iloc[original_idx] # Retrieve the page number.
@@ -132,66 +542,246 @@ def Search(UInput, Results_slider, genAI): # Arguments are the user's query, the
         pair[1] = pair[1].replace("89451486489 HLSTART 89451486489", hlTag).replace("89451486489 HLEND 89451486489", "</mark>")
             
         # If the similarity score of a result is below 0.8, provide a warning to the user in the search results. Since results are sorted in order of decreasing similarity, this only needs to be done once.
-        if (ce_score < 0.8) and (warningGiven == False):
+        if (ce_score < 0.8) and (warningGiven == False) and warn:
             relevanceWarn = r'⚠️ Warning: The following results do not appear to be very relevant to your query. ⚠️<br>'
             warningGiven = True
 
         else: relevanceWarn = '' # This ensures that the warning message does not persist into additional search results (only needs to be given once).
 
         # Concatenate the search results into one convenient package, to be presented to the user with markdown.
-        sResults += f'{relevanceWarn}***Preview {idx + 1}***<br>**Similarity Score:** {ce_score:.4f}<br>**File:** {pdfTable['File_Name'].iloc[original_idx]}<br>**Page:** {pdfTable['Page'].iloc[original_idx]}<br>**Link:** {URL}<br>**Paragraph:** {pair[1]}<br>------------------------------------------------------<br>'
+        libraryLine = f"**Library:** {os.path.basename(pdfTable['Library'].iloc[original_idx])}<br>" if len(libraryMounts) > 1 else '' # Only shown when several libraries are mounted.
+        sResults += f'{relevanceWarn}***Preview {idx + 1}***<br>**Similarity Score:** {ce_score:.4f}<br>{libraryLine}**File:** {pdfTable['File_Name'].iloc[original_idx]}<br>**Page:** {pdfTable['Page'].iloc[original_idx]}<br>**Link:** {URL}<br>**Paragraph:** {pair[1]}<br>------------------------------------------------------<br>'
 
-    # This code will use Retrieval Augmented Generation to create a summary of the top 5 search results.
-    # It is heavily based on the code provided in the Microsoft Phi 3.5 documentation: https://huggingface.co/microsoft/Phi-3.5-mini-instruct.
-    if genAI == True:
+    return sResults
+
+# Returns a copy of some search results (see formatResults), so that they can be formatted without changing the paragraphs.
+def copyResults(combined):
+    return [([pair[0], pair[1]], score, original_idx) for pair, score, original_idx in combined]
+
+#####----- Semantic Search -----#####
+# This function takes the user's query, retrieves the most relevant text passages from the
+# Encoded Library, then formats the results using markdown to present to the user.
+# Semantic search functionality is based on code provided in the Sentence-Transformers documentation.
+# See here for further details: https://www.sbert.net/examples/applications/semantic-search/README.html.
+# The number of clusters searched in large libraries (Probes_slider) trades accuracy for speed (see AnnIndex).
+# Search returns the finished results, while streamSearch yields the results again as each stage of the search finishes, so that they can be shown
+# straight away: first in the order found by the bi-encoder, then reranked by the cross-encoder, then with the answers highlighted, then summarized.
+# The search can be limited to the PDFs that match some filters, such as {'author': 'smith'} (see LibraryFilter for the filters that can be used).
+# If session (a dictionary, such as the GUI's state for one browser tab) is given, the results are kept in it so that the answers in the
+# results that were not highlighted can be highlighted later, when the user asks for them (see highlightMore).
+def Search(UInput, Results_slider, genAI, Probes_slider=AnnIndex.defaultProbes, filters=None): # Arguments are the user's query, the max number of results to return, whether to include a RAG summary, the search depth and the search filters.
+    for sResults in streamSearch(UInput, Results_slider, genAI, Probes_slider, filters):
+        pass
+    return sResults
+
+def streamSearch(UInput, Results_slider, genAI, Probes_slider=AnnIndex.defaultProbes, filters=None, session=None):
+    query = normalizeQuery(UInput)
+    trace = Metrics.startTrace('search', k=int(Results_slider), probes=int(Probes_slider), filtered=filters is not None and LibraryFilter.activeFilters(filters) is not None)
+
+    # Return the results straight away if the same search has already been done in this version of the library.
+    resultKey = ('Search', libraryVersion, query, int(Results_slider), int(Probes_slider), bool(genAI), rescoreResults, LibraryFilter.filterKey(filters))
+    found, cached = SearchCache.getCached(resultCache, resultKey)
+    if found:
+        sResults, shownResults = cached
+        if session is not None:
+            session.clear()
+            session.update(shownResults, highlights=dict(shownResults['highlights']))
+        print("\nQuery:", query, "(cached results)")
+        Metrics.finishTrace(trace, cached=True)
+        yield sResults
+        return
+    if session is not None:
+        session.clear() # Forget the last search until this one is finished.
+
+    # Find the rows of the PDFs that match the filters, if there are any. Only these rows are searched.
+    with Metrics.stage(trace, 'scope'):
+        scope = searchScope(filters)
+    if scope is not None:
+        print(f"\nSearching {len(scope)} paragraphs from PDFs where {LibraryFilter.describeFilters(filters)}.")
+        if len(scope) == 0:
+            Metrics.finishTrace(trace, cached=False, results=0)
+            yield f"No PDFs in the library match the search filters ({LibraryFilter.describeFilters(filters)})."
+            return
+
+    # Find the closest n sentences of the corpus for each query sentence based on cosine similarity.
+    with Metrics.stage(trace, 'encode') as record:
+        queryEmbedding = encodeQueries([query])[0]
+        record['items'] = 1
+    
+    # Use cosine similarity to find the rows with the highest k scores
+    with Metrics.stage(trace, 'retrieve') as record:
+        rows, similarity_scores = retrieve(queryEmbedding, int(Results_slider), int(Probes_slider), scope)
+        record['items'] = len(pdfTable) if scope is None else len(scope) # The rows that could be searched.
+    found = rows[0] >= 0 # Libraries with fewer than k records give fewer results.
+    indices, scores = rows[0][found], similarity_scores[0][found]
+    topK = len(indices)
+
+    # Print the query in the Command Prompt window for debugging.
+    print("\nQuery:", query, "\n------------------------------------------------------")
+    print(f"Top {topK} most similar paragraphs in document library:\n------------------------------------------------------ \n")
 
-        # Initialize the AI language model.
-        torch.random.manual_seed(0) 
-        SumModel = AutoModelForCausalLM.from_pretrained( 
-            "microsoft/Phi-3.5-mini-instruct",   
-            torch_dtype="auto",  
-            trust_remote_code=True)
+    # Initialize variables
+    pairs = []
+    original_indices = []
+
+    # Create pairs of the query and each paragraph determined to be relevant (based on top k), while keeping track of original indices.
+    with Metrics.stage(trace, 'read_text') as record:
+        for score, idx in zip(scores, indices):
+            paragraph = getParagraph(idx.item())
+            pairs.append([query, paragraph])
+            original_indices.append(idx.item())
+        record['items'] = len(pairs)
+
+    # Show the results in the order found by the bi-encoder while they are reranked.
+    with Metrics.stage(trace, 'format'):
+        preview = "*Reranking results...*<br>" + formatResults(copyResults(zip(pairs, scores.tolist(), original_indices)), {}, warn = False)
+    yield preview
+
+    # Predict the similarity of each query/paragraph pair using a cross-encoder.
+    with Metrics.stage(trace, 'rerank') as record:
+        cross_encoder_scores, rerankStats = rerankPairs([pair[0] for pair in pairs], original_indices, [pair[1] for pair in pairs])
+        record.update(items=rerankStats['pairs'], cached=rerankStats['cached'])
+    print(f"Reranked {rerankStats['pairs']} paragraphs ({rerankStats['cached']} cached) in {rerankStats['milliseconds']:.1f} ms.\n")
 
-        # Loads Microsoft Phi 3.5 Mini (very good at summarizing technical documents).
-        tokenizer = AutoTokenizer.from_pretrained("microsoft/Phi-3.5-mini-instruct") 
+    # Combine query/paragraph pairs, their similarity scores, and original indices into a list of tuples. Then sort by score in descending order
+    combined = list(zip(pairs, cross_encoder_scores, original_indices))
+    combined.sort(key=lambda x: x[1], reverse=True)
 
-        toSum = "" # Initialize a string that will later be passed to the AI to summarize the contents of.
+    # Use a QA model to find the most relevant part of each sufficiently relevant answer to highlight. The reranked results are shown
+    # first, with only the answers that are already known, if there are any more to find.
+    shown = combined[:deferredHighlights] if highlightMode == 'deferred' else combined # Only the first results are highlighted in the 'deferred' mode.
+    relevant = [(original_idx, pair[1]) for pair, ce_score, original_idx in shown if ce_score > highlightThreshold]
+    highlights = findHighlights(query, [row for row, _ in relevant], [paragraph for _, paragraph in relevant], compute = False)
+    if highlightMode != 'off' and len(highlights) < len(relevant):
+        with Metrics.stage(trace, 'format'):
+            preview = "*Highlighting answers...*<br>" + formatResults(copyResults(combined), highlights)
+        yield preview
+        missing = [(row, paragraph) for row, paragraph in relevant if row not in highlights]
+        with Metrics.stage(trace, 'highlight') as record:
+            highlights.update(findHighlights(query, [row for row, _ in missing], [paragraph for _, paragraph in missing]))
+            record['items'] = len(missing)
+
+    # Keep the results (before their paragraphs are formatted) so that more of them can be highlighted later (see highlightMore).
+    shownResults = {'version': libraryVersion, 'query': query, 'combined': copyResults(combined), 'highlights': highlights, 'summary': ''}
+
+    with Metrics.stage(trace, 'format'):
+        sResults = formatResults(combined, highlights)
+
+    # This code will use Retrieval Augmented Generation to create a summary of the search results (see Summarizer).
+    if genAI == True:
+        yield "*Summarizing results...*<br>" + sResults
 
-        # Create a summary of the top 5 search results for the AI.
+        # Create a summary of the search results for the AI. Results are passed to the AI in order of relevance, for as long as they fit in its token budget (see Summarizer.promptTokens).
+        toSum = []
         for idx, (pair, ce_score, original_idx) in enumerate(combined):
-            if idx >= 5:
-                break
-            pdfPath = pdfTable['File_Path'].iloc[original_idx]
-            pageNum = pdfTable['Page'].iloc[original_idx]
-
-            toSum += f"***Search Result {idx + 1}***<br>**Similarity Score:** {ce_score:.4f}<br>**File:** {pdfTable['File_Name'].iloc[original_idx]}<br>**Page:** {pdfTable['Page'].iloc[original_idx]}<br>**Paragraph:** {pair[1]}<br>------------------------------------------------------<br>"
-
-        # Pass the system prompt and a prompt asking the AI to summarize our top 5 search results.
-        messages = [ 
-            {"role": "system", "content": "You are a concise and truthful AI who answers in the style of a knowledgeable expert."}, 
-            {"role": "user", "content": f"Here is text you will summarize: {toSum} \n Summarize the above text as it relates to: {query}"}
-        ] 
-        
-        pipe = pipeline( 
-            "text-generation", 
-            model=SumModel, 
-            tokenizer=tokenizer, 
-        ) 
-        
-        generation_args = { 
-            "max_new_tokens": 500, # Sets maximum new tokens to a reasonable value.
-            "return_full_text": False, 
-            "temperature": 0.0, # A more deterministic response should be less likely to hallucinate.
-            "do_sample": False, 
-        } 
-        
-        genAIout = pipe(messages, **generation_args) 
+            toSum.append(f"***Search Result {idx + 1}***<br>**Similarity Score:** {ce_score:.4f}<br>**File:** {pdfTable['File_Name'].iloc[original_idx]}<br>**Page:** {pdfTable['Page'].iloc[original_idx]}<br>**Paragraph:** {pair[1]}<br>------------------------------------------------------<br>")
 
-        genAIout = genAIout[0].iloc['generated_text']
-        re.sub(r'\n', '<br>', genAIout) #Reformat for markdown
-        
-        sResults = f"**AI Summary**: {genAIout} <br> {sResults}"
+        # Show the summary above the results as it is written. The time spent showing each part of the summary is included in its stage.
+        with Metrics.stage(trace, 'summarize'):
+            for genAIout in Summarizer.streamSummary(query, toSum):
+                yield f"**AI Summary**: {genAIout.replace(chr(10), '<br>')} <br> {sResults}" # Reformat for markdown
+
+        shownResults['summary'] = f"**AI Summary**: {genAIout.replace(chr(10), '<br>')} <br> "
+        sResults = shownResults['summary'] + sResults
     
     print(sResults) # Print the search results to the Command Prompt window for reference.
 
-    return sResults # Return the search results to be displayed in the GUI.
+    SearchCache.putCached(resultCache, resultKey, (sResults, shownResults)) # Keep the results in case the same search is done again.
+    if session is not None:
+        session.update(shownResults, highlights=dict(highlights))
+    Metrics.finishTrace(trace, cached=False, results=topK)
+
+    yield sResults # Return the search results to be displayed in the GUI.
+
+# This function highlights the answers in the results of the last search kept in session (see streamSearch) that have not been highlighted
+# yet, such as the results after the first deferredHighlights in the 'deferred' mode. Only the next count results that are relevant enough
+# (see highlightThreshold) are highlighted each time (deferredHighlights by default), in the order they are shown. Returns the results
+# formatted again with the new highlights, or None if there is nothing left to highlight (or the library has changed since the search).
+def highlightMore(session, count=None):
+    if not session or session['version'] != libraryVersion:
+        return None
+    count = deferredHighlights if count is None else count
+    highlights = session['highlights']
+    missing = [(original_idx, pair[1]) for pair, ce_score, original_idx in session['combined']
+               if ce_score > highlightThreshold and original_idx not in highlights][:count]
+    if len(missing) == 0:
+        return None
+
+    trace = Metrics.startTrace('highlight_more', results=len(missing))
+    with Metrics.stage(trace, 'highlight') as record:
+        highlights.update(findHighlights(session['query'], [row for row, _ in missing], [paragraph for _, paragraph in missing]))
+        record['items'] = len(missing)
+    with Metrics.stage(trace, 'format'):
+        sResults = session['summary'] + formatResults(copyResults(session['combined']), highlights)
+    Metrics.finishTrace(trace)
+    return sResults
+
+#####----- Batch Search -----#####
+# This function searches the loaded library for many queries at once, for programs that use Factoid Finder without the GUI (such as evaluations).
+# Queries that have been searched before with the same settings are taken from the result cache. The rest are encoded together, every segment is searched for all of them at once (see retrieve), and all of the query/paragraph
+# pairs are scored by the cross-encoder together (see rerankPairs). Set rerank to False to skip the cross-encoder. filters limits every
+# query to the PDFs that match them (see LibraryFilter).
+# Returns a list with the results of each query, best first. Each result is a dictionary with the row number of the chunk (Chunk),
+# the bi-encoder and cross-encoder scores, and the file, page, library and text the chunk comes from.
+def searchMany(queries, k=10, probes=AnnIndex.defaultProbes, rerank=True, filters=None):
+    allQueries = [normalizeQuery(query) for query in queries]
+    allResults = [None] * len(allQueries)
+    trace = Metrics.startTrace('search_many', queries=len(allQueries), k=int(k), probes=int(probes), rerank=bool(rerank),
+                               filtered=filters is not None and LibraryFilter.activeFilters(filters) is not None)
+
+    # Use the cached results of any query that has already been searched in this version of the library.
+    keys = [('searchMany', libraryVersion, query, int(k), int(probes), bool(rerank), rescoreResults, LibraryFilter.filterKey(filters)) for query in allQueries]
+    for i, key in enumerate(keys):
+        found, cached = SearchCache.getCached(resultCache, key)
+        if found:
+            allResults[i] = [dict(result) for result in cached] # Copies, so that changes made by the caller do not change the cache.
+    missing = [i for i, results in enumerate(allResults) if results is None]
+    if len(missing) == 0:
+        Metrics.finishTrace(trace, cached=len(allQueries))
+        return allResults
+
+    queries = [allQueries[i] for i in missing]
+    with Metrics.stage(trace, 'scope'):
+        scope = searchScope(filters)
+    with Metrics.stage(trace, 'encode') as record:
+        queryEmbeddings = encodeQueries(queries)
+        record['items'] = len(queries)
+    with Metrics.stage(trace, 'retrieve') as record:
+        rows, similarity_scores = retrieve(queryEmbeddings, int(k), int(probes), scope)
+        record['items'] = len(queries)
+
+    # List every query/result pair, and read the text of each chunk once, however many queries found it.
+    hits = [(q, row, score) for q in range(len(queries)) for row, score in zip(rows[q].tolist(), similarity_scores[q].tolist()) if row >= 0]
+    with Metrics.stage(trace, 'read_text') as record:
+        paragraphs = {row: getParagraph(row) for row in sorted({row for _, row, _ in hits})}
+        record['items'] = len(paragraphs)
+
+    # Predict the similarity of every query/paragraph pair using the cross-encoder.
+    crossScores = [None] * len(hits)
+    if rerank and len(hits) > 0:
+        with Metrics.stage(trace, 'rerank') as record:
+            crossScores, rerankStats = rerankPairs([queries[q] for q, _, _ in hits], [row for _, row, _ in hits], [paragraphs[row] for _, row, _ in hits])
+            crossScores = crossScores.tolist()
+            record.update(items=rerankStats['pairs'], cached=rerankStats['cached'])
+
+    results = [[] for _ in queries]
+    for (q, row, score), crossScore in zip(hits, crossScores):
+        results[q].append({
+            'Chunk': row,
+            'Bi_Encoder_Score': score,
+            'Cross_Encoder_Score': crossScore,
+            'File_Name': pdfTable['File_Name'].iloc[row],
+            'File_Path': pdfTable['File_Path'].iloc[row],
+            'Page': str(pdfTable['Page'].iloc[row]), # The page label, which is not always a number (such as 'ii' or 'A-1').
+            'Library': pdfTable['Library'].iloc[row] if 'Library' in pdfTable.columns else libraryVersion[0],
+            'Paragraph': paragraphs[row],
+        })
+    if rerank: # Results are already in order of bi-encoder score, so they only need sorting by cross-encoder score.
+        for queryResults in results:
+            queryResults.sort(key=lambda result: result['Cross_Encoder_Score'], reverse=True)
+
+    for i, queryResults in zip(missing, results):
+        allResults[i] = queryResults
+        SearchCache.putCached(resultCache, keys[i], [dict(result) for result in queryResults])
+    Metrics.finishTrace(trace, cached=len(allQueries) - len(missing), results=len(hits))
+    return allResults
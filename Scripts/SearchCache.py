@@ -0,0 +1,54 @@
+'''
+This script provides the small in-memory caches used by QuickSearch, so that repeated queries do not have to be encoded, searched
+and reranked again. Each cache holds at most maxSize entries, dropping the least recently used entry when it is full, and entries
+older than ttl seconds are treated as missing (ttl can be None to keep entries until they are dropped).
+
+A cache is a dictionary made by newCache. It counts how often a key was found (hits) and not found (misses), which can be read with cacheStats.
+Caches can be used from several threads at once (such as by the GUI, which can run more than one search at a time).
+'''
+#####----- Import Packages -----#####
+import time # Critical - Records when each entry was added, so that old entries can expire.
+import threading # Critical - Stops two threads from changing a cache at the same time.
+from collections import OrderedDict # Critical - Keeps the entries in order of use, so that the least recently used entry can be dropped.
+
+#####----- Caches -----#####
+
+# Makes a new, empty cache that holds at most maxSize entries, each for at most ttl seconds.
+def newCache(maxSize, ttl=None):
+    return {'entries': OrderedDict(), 'maxSize': maxSize, 'ttl': ttl, 'hits': 0, 'misses': 0, 'lock': threading.Lock()}
+
+# Looks up a key in a cache. Returns whether it was found and, if so, its value.
+def getCached(cache, key):
+    with cache['lock']:
+        entry = cache['entries'].get(key)
+        if entry is not None and cache['ttl'] is not None and time.monotonic() - entry[0] > cache['ttl']:
+            del cache['entries'][key] # The entry has expired.
+            entry = None
+        if entry is None:
+            cache['misses'] += 1
+            return False, None
+        cache['entries'].move_to_end(key) # Mark the entry as the most recently used.
+        cache['hits'] += 1
+        return True, entry[1]
+
+# Adds a value to a cache, dropping the least recently used entries if the cache is full.
+def putCached(cache, key, value):
+    if cache['maxSize'] <= 0: # A cache with no room is turned off.
+        return
+    with cache['lock']:
+        cache['entries'][key] = (time.monotonic(), value)
+        cache['entries'].move_to_end(key)
+        while len(cache['entries']) > cache['maxSize']:
+            cache['entries'].popitem(last=False)
+
+# Removes every entry from a cache. The hit and miss counts are kept.
+def clearCache(cache):
+    with cache['lock']:
+        cache['entries'].clear()
+
+# Returns the number of entries in a cache, and how often keys were found (hits) and not found (misses) since it was made.
+def cacheStats(cache):
+    with cache['lock']:
+        lookups = cache['hits'] + cache['misses']
+        return {'size': len(cache['entries']), 'maxSize': cache['maxSize'], 'hits': cache['hits'], 'misses': cache['misses'],
+                'hitRate': cache['hits'] / lookups if lookups > 0 else 0.0}
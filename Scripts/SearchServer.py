@@ -0,0 +1,231 @@
+'''
+This script serves searches of the loaded Encoded Library as a local HTTP/JSON API, so that many users or programs can search at the same time.
+Searches that arrive within a few milliseconds of each other (batchWindow) are searched together with QuickSearch.searchMany, so their queries
+are encoded and their results reranked in shared batches. This is much faster than searching them one at a time when many arrive at once.
+
+Searches wait in a queue of at most maxQueue searches. When the queue is full, new searches are turned away straight away (HTTP 503) rather
+than waiting for longer and longer, so that clients know to slow down. The time each search spent waiting and being searched is returned
+with its results, and totals for the server are available from /metrics.
+
+    POST /search    {"query": "...", "k": 10, "probes": 32, "rerank": true, "filters": {"author": "smith"}}. Only the query is required.
+    GET  /health    Whether a library is loaded, the libraries being searched, and how many searches are waiting.
+    GET  /metrics   How many searches were served or turned away, the sizes of the batches, and latency percentiles.
+    GET  /stats     Latency percentiles of each stage of recent searches (such as encoding, reranking and highlighting), and of library loads (see Metrics).
+
+The server can be run on its own (python Scripts/SearchServer.py path/to/library), or alongside the GUI (see apiPort in Interface), where it
+searches whichever library is loaded in the GUI.
+'''
+#####----- Import Packages -----#####
+import sys # Critical - Reads the command line arguments.
+import json # Critical - Reads requests and writes responses.
+import time # Critical - Times each search.
+import queue # Critical - Holds the searches waiting to be batched.
+import threading # Critical - Runs the batching thread and the server.
+import collections # Critical - Keeps the latencies of the most recent searches.
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler # Critical - Serves the API, with a thread per connection.
+import numpy as np # Critical - Calculates the latency percentiles.
+import QuickSearch # Critical - Python script that handles queries and information retrieval.
+import AnnIndex # Critical - Provides the default search depth.
+import LibraryFilter # Critical - Checks search filters, and groups searches with the same filters.
+import Metrics # Critical - Provides the time taken by each stage of recent searches.
+from BatchSearch import makeRecord # Critical - Formats the results of each search.
+
+#####----- Settings -----#####
+host = '127.0.0.1' # The server only accepts connections from this computer. Use '0.0.0.0' to accept connections from other computers.
+port = 8765 # The port the server listens on.
+batchWindow = 0.01 # How many seconds to wait for more searches after the first search of a batch arrives.
+maxBatch = 64 # The most searches in one batch.
+maxQueue = 1024 # The most searches waiting at once. Searches that arrive when the queue is full are turned away.
+requestTimeout = 60 # How many seconds a search can take before the client is told it timed out.
+latencyWindow = 10000 # The number of recent searches the latency percentiles in /metrics are calculated from.
+
+#####----- Batching -----#####
+
+# This function makes a new search service: the queue of waiting searches, the metrics, and the thread that searches them in batches.
+# window, batchLimit and queueLimit default to batchWindow, maxBatch and maxQueue. Setting batchLimit to 1 searches one query at a time.
+def newService(window=None, batchLimit=None, queueLimit=None):
+    service = {'window': batchWindow if window is None else window, 'maxBatch': maxBatch if batchLimit is None else batchLimit,
+               'queue': queue.Queue(maxQueue if queueLimit is None else queueLimit), 'lock': threading.Lock(), 'running': True,
+               'served': 0, 'rejected': 0, 'failed': 0, 'batches': 0, 'batchSizes': collections.Counter(),
+               'latencies': collections.deque(maxlen=latencyWindow), 'started': time.time()}
+    service['thread'] = threading.Thread(target=runBatches, args=(service,), name='Search batcher', daemon=True)
+    service['thread'].start()
+    return service
+
+# Stops the batching thread of a service once the searches already waiting are done.
+def stopService(service):
+    service['running'] = False
+    service['queue'].put(None) # Wakes the thread if it is waiting for a search.
+
+# This function adds a search to the queue of a service, and waits for its results. settings holds the k, probes, rerank and filters of the search.
+# Returns the HTTP status and the response: the results and timings of the search, or an error message.
+def submitSearch(service, query, settings):
+    request = {'query': query, 'settings': settings, 'done': threading.Event(), 'queued': time.perf_counter()}
+    try:
+        service['queue'].put_nowait(request)
+    except queue.Full:
+        with service['lock']:
+            service['rejected'] += 1
+        return 503, {'error': 'The server is busy. Try again shortly.'}
+    if not request['done'].wait(requestTimeout):
+        return 504, {'error': f'The search did not finish within {requestTimeout} seconds.'}
+    if 'error' in request:
+        return 500, {'error': request['error']}
+    return 200, request['response']
+
+# This function is run by the batching thread of a service. It takes the first waiting search, then waits up to window seconds for more
+# (up to maxBatch searches), and searches them together. Searches with different settings are searched in separate groups.
+def runBatches(service):
+    while service['running']:
+        first = service['queue'].get()
+        if first is None:
+            continue
+        batch = [first]
+        deadline = time.perf_counter() + service['window']
+        while len(batch) < service['maxBatch']:
+            try:
+                request = service['queue'].get(timeout=max(0, deadline - time.perf_counter())) if service['window'] > 0 else service['queue'].get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                break
+            batch.append(request)
+
+        # Group the searches by their settings, as every query given to searchMany is searched with the same settings.
+        groups = collections.defaultdict(list)
+        for request in batch:
+            settings = request['settings']
+            groups[(settings['k'], settings['probes'], settings['rerank'], LibraryFilter.filterKey(settings['filters']))].append(request)
+        for group in groups.values():
+            searchGroup(service, group)
+
+# This function searches a group of searches with the same settings together, then passes each its results and wakes the thread waiting for it.
+def searchGroup(service, group):
+    start = time.perf_counter()
+    settings = group[0]['settings']
+    try:
+        if QuickSearch.pdfTable is None:
+            raise RuntimeError('No library is loaded.')
+        results = QuickSearch.searchMany([request['query'] for request in group], settings['k'], settings['probes'], settings['rerank'], settings['filters'])
+    except Exception as error:
+        with service['lock']:
+            service['failed'] += len(group)
+        for request in group:
+            request['error'] = str(error)
+            request['done'].set()
+        return
+    end = time.perf_counter()
+
+    with service['lock']:
+        service['batches'] += 1
+        service['batchSizes'][len(group)] += 1
+        for request, queryResults in zip(group, results):
+            latency = {'queue_ms': (start - request['queued']) * 1000, 'search_ms': (end - start) * 1000, 'total_ms': (end - request['queued']) * 1000}
+            request['response'] = makeRecord(None, request['query'], queryResults)
+            request['response'].pop('id')
+            request['response'].update({'batch_size': len(group), 'latency_ms': {name: round(value, 2) for name, value in latency.items()}})
+            service['latencies'].append((latency['queue_ms'], latency['search_ms'], latency['total_ms']))
+            service['served'] += 1
+    for request in group:
+        request['done'].set()
+
+# Returns the metrics of a service: how many searches were served, turned away or failed, the sizes of the batches, and latency percentiles.
+def serviceMetrics(service):
+    with service['lock']:
+        latencies = np.asarray(service['latencies']).reshape(-1, 3)
+        batchSizes = dict(sorted(service['batchSizes'].items()))
+        metrics = {'served': service['served'], 'rejected': service['rejected'], 'failed': service['failed'], 'batches': service['batches'],
+                   'waiting': service['queue'].qsize(), 'uptime_s': round(time.time() - service['started'], 1),
+                   'mean_batch_size': round(service['served'] / service['batches'], 2) if service['batches'] > 0 else 0.0,
+                   'batch_sizes': {str(size): count for size, count in batchSizes.items()}}
+    for column, name in enumerate(['queue_ms', 'search_ms', 'total_ms']):
+        if len(latencies) > 0:
+            metrics[name] = {label: round(float(np.percentile(latencies[:, column], percent)), 2) for label, percent in [('p50', 50), ('p95', 95), ('p99', 99), ('max', 100)]}
+    return metrics
+
+#####----- HTTP Server -----#####
+
+# Reads the settings of a search from the body of a request, using the defaults for any that are missing. Raises ValueError if any are invalid.
+def readSettings(body):
+    settings = {'k': int(body.get('k', 10)), 'probes': int(body.get('probes', AnnIndex.defaultProbes)), 'rerank': bool(body.get('rerank', True)),
+                'filters': body.get('filters') or None}
+    if not 1 <= settings['k'] <= 1000:
+        raise ValueError('k must be between 1 and 1000.')
+    if settings['filters'] is not None and not isinstance(settings['filters'], dict):
+        raise ValueError('filters must be an object, such as {"author": "smith"}.')
+    LibraryFilter.activeFilters(settings['filters']) # Raises ValueError for unknown filters.
+    return settings
+
+# Answers the requests sent to the server. Each connection is handled in its own thread, which waits while its search is batched.
+class SearchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Lets clients keep their connection open between searches.
+
+    def sendJson(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/health':
+            self.sendJson(200, {'ready': QuickSearch.pdfTable is not None, 'libraries': QuickSearch.loadedLibraries(), 'waiting': service['queue'].qsize()})
+        elif self.path == '/metrics':
+            self.sendJson(200, serviceMetrics(service))
+        elif self.path == '/stats':
+            self.sendJson(200, Metrics.metricsSummary())
+        else:
+            self.sendJson(404, {'error': 'Not found. Use POST /search, GET /health, GET /metrics or GET /stats.'})
+
+    def do_POST(self):
+        if self.path != '/search':
+            self.sendJson(404, {'error': 'Not found. Use POST /search, GET /health, GET /metrics or GET /stats.'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            query = QuickSearch.normalizeQuery(body.get('query') or '')
+            if not query:
+                raise ValueError('The request needs a "query".')
+            settings = readSettings(body)
+        except (ValueError, TypeError, AttributeError) as error:
+            self.sendJson(400, {'error': f'Invalid request: {error}'})
+            return
+        self.sendJson(*submitSearch(self.server.service, query, settings))
+
+    def log_message(self, format, *args): # Each search is not printed, as there can be thousands per second. See /metrics instead.
+        pass
+
+# This function starts the server in a background thread, with a new search service (see newService for the arguments).
+# Returns the server. Call stopServer to stop it.
+def startServer(serverHost=None, serverPort=None, window=None, batchLimit=None, queueLimit=None):
+    server = ThreadingHTTPServer((host if serverHost is None else serverHost, port if serverPort is None else serverPort), SearchHandler)
+    server.daemon_threads = True
+    server.service = newService(window, batchLimit, queueLimit)
+    threading.Thread(target=server.serve_forever, name='Search server', daemon=True).start()
+    print(f'Search API listening on http://{server.server_address[0]}:{server.server_address[1]}/search')
+    return server
+
+# Stops a server started by startServer.
+def stopServer(server):
+    server.shutdown()
+    server.server_close()
+    stopService(server.service)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python Scripts/SearchServer.py path/to/library [port]')
+        sys.exit(1)
+
+    print('Loading the AI models and the library...')
+    QuickSearch.initializeEmbedders()
+    QuickSearch.loadLibrary(sys.argv[1])
+    server = startServer(serverPort=int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stopServer(server)
@@ -0,0 +1,134 @@
+'''
+This script gets the GUI on screen as quickly as possible when the program starts. The scripts that need large packages (torch,
+sentence-transformers, transformers, pandas and pymupdf) are imported lazily, the first time they are used (see lazyImport), so the
+GUI does not wait for them. Once the GUI is being built, warmUp imports them and loads the AI models in a background thread, in the order
+they are needed: the packages and models used for searching come first, then those used to create and update libraries.
+
+The progress of the warm-up can be shown in the GUI (see readiness), and functions that need the search models can wait for them
+(see waitForModels). When the warm-up finishes, a report of how long each import and model took is saved in the Logs folder.
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import sys # Critical - Finds the scripts that have already been imported.
+import types # Critical - Makes the stand-ins for lazily imported scripts.
+import time # Critical - Times each import and model.
+import threading # Critical - Runs the warm-up in the background.
+import importlib # Critical - Imports scripts and packages by name.
+import traceback # Optional - Prints the details of anything that fails to load.
+from datetime import datetime # Optional - Makes a datetime string that is used to name the startup log.
+
+#####----- Settings -----#####
+# The packages and scripts imported by the warm-up, in order. Everything needed to search comes before the search models are loaded.
+searchImports = ['numpy', 'torch', 'pandas', 'transformers', 'sentence_transformers', 'QuickSearch']
+# The search models, in the order they are used by a search. Each is the name of the function in QuickSearch that loads it.
+searchModels = [('Bi-encoder', 'loadEmbedder'), ('Cross-encoder', 'loadCrossEncoder'), ('QA model', 'loadQAModel')]
+# The packages and scripts only needed to create and update libraries, imported once the search models are ready.
+libraryImports = ['pymupdf', 'EncodedLibrary', 'ExtractPDF', 'MergeLibraries', 'SyncLibrary', 'CompactLibrary']
+
+#####----- Startup State -----#####
+startTime = time.perf_counter() # When this script was first imported, which is close to when the program started.
+timings = [] # How long each step of the startup took, as (kind, name, seconds since startTime when it finished, seconds taken).
+stage = 'Starting' # What the warm-up is currently doing.
+errors = [] # The steps of the warm-up that failed.
+modelsReady = threading.Event() # Set once the search models have been loaded (or failed to load).
+warmUpDone = threading.Event() # Set once the warm-up has finished.
+
+#####----- Lazy Imports -----#####
+
+# This function returns a stand-in for a script or package, which imports it the first time one of its attributes is used (such as QuickSearch.Search)
+# and passes every use on to it. If it has already been imported, it is returned as is. The stand-in is kept out of sys.modules, as other
+# packages (such as torch) look through every imported module while they are being imported, which would import the script too early.
+def lazyImport(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    module = types.ModuleType(name, f'Stand-in for {name}, which is imported the first time it is used.')
+    module.__getattr__ = lambda attribute: getattr(importlib.import_module(name), attribute) # Only called for attributes the stand-in does not have.
+    return module
+
+# Records how long a step of the startup took.
+def record(kind, name, seconds):
+    timings.append((kind, name, time.perf_counter() - startTime, seconds))
+
+# Records when something happened (such as the GUI being built), measured from the start of the program.
+def mark(name):
+    record('Milestone', name, 0.0)
+
+# Imports a script or package (finishing the import of lazily imported ones), and records how long it took.
+def timedImport(name):
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    record('Import', name, time.perf_counter() - start)
+    return module
+
+#####----- Warm-up -----#####
+
+# This function imports the packages and scripts and loads the search models in the order set above. It is run in the background by startWarmUp.
+# Anything that fails is recorded and skipped, so that the rest can still be loaded.
+def warmUp():
+    global stage
+
+    for name in searchImports:
+        stage = f'Importing {name}'
+        try: timedImport(name)
+        except Exception:
+            errors.append(name)
+            traceback.print_exc()
+
+    for label, loaderName in searchModels:
+        stage = f'Loading the {label}'
+        start = time.perf_counter()
+        try:
+            getattr(sys.modules['QuickSearch'], loaderName)()
+            record('Model', label, time.perf_counter() - start)
+        except Exception:
+            errors.append(label)
+            traceback.print_exc()
+    modelsReady.set()
+
+    for name in libraryImports:
+        stage = f'Importing {name}'
+        try: timedImport(name)
+        except Exception:
+            errors.append(name)
+            traceback.print_exc()
+
+    stage = 'Ready'
+    warmUpDone.set()
+    writeReport()
+
+# Starts the warm-up in a background thread.
+def startWarmUp():
+    thread = threading.Thread(target=warmUp, name='Warm-up', daemon=True)
+    thread.start()
+    return thread
+
+# Waits until the search models have been loaded. Returns False if any of them failed to load.
+def waitForModels(timeout=None):
+    modelsReady.wait(timeout)
+    return modelsReady.is_set() and not any(label in errors for label, _ in searchModels)
+
+# Returns a short message describing the progress of the warm-up, for display in the GUI.
+def readiness():
+    if any(label in errors for label, _ in searchModels):
+        return '⚠️ Some of the AI models could not be loaded. See the Command Prompt window for details.'
+    if modelsReady.is_set():
+        return '✅ Ready to search.'
+    return f'⏳ Loading AI models in the background ({stage})...'
+
+# This function saves the startup timing report in the Logs folder, listing how long each import and model took.
+def writeReport():
+    formattedTime = datetime.now().strftime("%Y%m%d%H%M%S") # Format the current date and time as a string with only numbers
+    logPath = os.path.join('Logs', f'{formattedTime} - Startup Timing Log.txt') # Create a path at which the log will be saved.
+    lines = ['Factoid Finder startup timing', '', f'{"Step":<10} {"Name":<26} {"Finished at (s)":>16} {"Took (s)":>10}']
+    for kind, name, finished, seconds in timings:
+        lines.append(f'{kind:<10} {name:<26} {finished:>16.2f} {seconds:>10.2f}')
+    lines.append('')
+    lines.append(f'Failed to load: {", ".join(errors)}' if errors else 'Everything loaded successfully.')
+    try:
+        os.makedirs('Logs', exist_ok=True)
+        with open(logPath, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+        print(f'Startup finished in {time.perf_counter() - startTime:.1f} seconds. Timing report saved to {logPath}.')
+    except OSError:
+        print('The startup timing report could not be saved.')
+    return logPath
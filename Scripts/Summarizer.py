@@ -0,0 +1,151 @@
+'''
+This script uses a generative AI model (Microsoft Phi 3.5 Mini by default) to summarize the results of a search, as a basic form of
+Retrieval Augmented Generation. It is heavily based on the code provided in the Microsoft Phi 3.5 documentation:
+https://huggingface.co/microsoft/Phi-3.5-mini-instruct.
+
+The model is large, so it is only loaded the first time a summary is asked for, and is then kept in memory for the following searches.
+It is released again once it has not been used for idleUnload seconds. It can be loaded in reduced precision (see precision) to use
+less memory and run faster. The summary is streamed: streamSummary yields the text generated so far as each new token is produced.
+'''
+#####----- Import Packages -----#####
+import gc # Critical - Frees the memory of the model once it is released.
+import time # Critical - Tracks when the model was last used.
+import threading # Critical - Runs the model in the background while its output is streamed, and releases it when it is idle.
+import torch # Critical - Runs the generative AI model.
+from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer # Critical - Loads and runs the generative AI model.
+
+#####----- Settings -----#####
+modelName = "microsoft/Phi-3.5-mini-instruct" # Phi 3.5 Mini is very good at summarizing technical documents.
+# The precision the model is loaded in:
+# 'auto' uses the precision the model was saved in. 'float16' and 'bfloat16' halve the memory needed.
+# 'int8' converts the model's linear layers to 8-bit integers after loading it, which is usually the fastest option on a CPU.
+precision = 'auto'
+idleUnload = 600 # The model is released once it has not been used for this many seconds, to free its memory. None keeps it loaded.
+promptTokens = 2000 # The most tokens of search results that are passed to the model. Results are added in order until this is reached.
+maxNewTokens = 500 # Sets maximum new tokens to a reasonable value.
+
+#####----- Load and Release -----#####
+SumModel = None # The generative AI model, once loaded.
+tokenizer = None # The tokenizer of the model, once loaded.
+lastUsed = 0 # When the model was last used (from time.monotonic).
+activeSummaries = 0 # The number of summaries currently being generated. The model is never released while this is above 0.
+idleTimer = None # Releases the model once it has been idle for idleUnload seconds.
+modelLock = threading.Lock() # Stops the model from being loaded twice, or released while it is being loaded or used.
+
+# This function loads the model and tokenizer, unless they are already loaded.
+def loadSummarizer():
+    global SumModel
+    global tokenizer
+
+    with modelLock:
+        if SumModel is None:
+            print(f'Loading {modelName} for summaries...')
+            torch.random.manual_seed(0)
+            dtype = {'auto': "auto", 'float16': torch.float16, 'bfloat16': torch.bfloat16, 'int8': torch.float32}[precision]
+            model = AutoModelForCausalLM.from_pretrained(modelName, torch_dtype=dtype, trust_remote_code=True)
+            if precision == 'int8':
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            model.eval()
+            tokenizer = AutoTokenizer.from_pretrained(modelName)
+            SumModel = model
+    return SumModel, tokenizer
+
+# This function releases the model and tokenizer, freeing their memory. They are loaded again the next time a summary is asked for.
+def unloadSummarizer():
+    global SumModel
+    global tokenizer
+
+    with modelLock:
+        if SumModel is not None and activeSummaries == 0:
+            SumModel = None
+            tokenizer = None
+            gc.collect()
+            print(f'{modelName} released after being idle for {idleUnload} seconds.')
+
+# Releases the model if it has not been used since the idle timer was started. Otherwise, the timer is started again.
+def unloadIfIdle():
+    idle = time.monotonic() - lastUsed
+    if activeSummaries == 0 and idle >= idleUnload:
+        unloadSummarizer()
+    else:
+        startIdleTimer(max(1, idleUnload - idle))
+
+# Starts (or restarts) the timer that releases the model once it is idle.
+def startIdleTimer(delay=None):
+    global idleTimer
+    if idleUnload is None:
+        return
+    if idleTimer is not None:
+        idleTimer.cancel()
+    idleTimer = threading.Timer(idleUnload if delay is None else delay, unloadIfIdle)
+    idleTimer.daemon = True # The timer does not keep the program open.
+    idleTimer.start()
+
+#####----- Summarize -----#####
+
+# This function joins as many of the search results (passages, in order of relevance) as fit within promptTokens tokens.
+# The first result is always included, cut short if it is longer than the budget on its own.
+def buildContext(passages):
+    context = ""
+    used = 0
+    for passage in passages:
+        tokens = len(tokenizer.encode(passage, add_special_tokens=False))
+        if used + tokens > promptTokens:
+            if used == 0: # Cut the first result short, rather than leaving the model with nothing to summarize.
+                context = tokenizer.decode(tokenizer.encode(passage, add_special_tokens=False)[:promptTokens])
+            break
+        context += passage
+        used += tokens
+    return context
+
+# This function summarizes the search results (passages, in order of relevance) as they relate to the query. The model is loaded first
+# if it is not already. Yields the summary generated so far each time a new token is produced, ending with the full summary.
+def streamSummary(query, passages):
+    global lastUsed
+    global activeSummaries
+
+    with modelLock: # Counted first, so that the model cannot be released between loading and using it.
+        activeSummaries += 1
+    try:
+        model, _ = loadSummarizer()
+
+        # Pass the system prompt and a prompt asking the AI to summarize the search results.
+        messages = [
+            {"role": "system", "content": "You are a concise and truthful AI who answers in the style of a knowledgeable expert."},
+            {"role": "user", "content": f"Here is text you will summarize: {buildContext(passages)} \n Summarize the above text as it relates to: {query}"}
+        ]
+        # The prompt is returned as a dictionary (the token IDs and the attention mask), which is what every version of transformers passes to generate.
+        inputs = tokenizer.apply_chat_template(messages, add_generation_prompt=True, return_tensors="pt", return_dict=True).to(model.device)
+
+        # The model generates in the background, while the tokens it produces are read from the streamer. The streamer skips the prompt
+        # (the first inputs['input_ids'].shape[-1] tokens), so only the new tokens are shown.
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        generation_args = {
+            "max_new_tokens": maxNewTokens,
+            "do_sample": False, # A more deterministic response should be less likely to hallucinate.
+            "streamer": streamer,
+            **inputs,
+        }
+        errors = [] # The error that stopped the model, if it failed.
+        def generate():
+            try:
+                model.generate(**generation_args)
+            except BaseException as error: # Such as running out of memory. The streamer is ended so that it does not wait for tokens forever.
+                errors.append(error)
+                streamer.end()
+        generator = threading.Thread(target=generate, daemon=True)
+        generator.start()
+
+        summary = ""
+        for text in streamer:
+            summary += text
+            yield summary
+        generator.join()
+        if errors:
+            raise errors[0]
+        yield summary
+    finally:
+        with modelLock:
+            activeSummaries -= 1
+        lastUsed = time.monotonic()
+        startIdleTimer()
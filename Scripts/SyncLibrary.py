@@ -0,0 +1,154 @@
+'''
+This script syncs an Encoded Library with a folder of PDFs. It compares the PDFs in the folder with the manifest saved in the library
+(see EncodedLibrary), then only extracts and encodes the PDFs that are new or have changed, and removes the rows of PDFs that have been
+changed or deleted. The new rows are added to the library as a new segment, so the cost of a sync depends on how much has changed in the
+folder, not on the size of the library.
+'''
+#####----- Import Packages -----#####
+import os # Critical - Base Python package needed for many functions.
+import numpy as np # Critical - Makes empty embeddings arrays when there is nothing new to encode.
+import pandas as pd # Critical - Necessary for working with extracted PDF content and metadata.
+import datetime # Optional - Makes a datetime string that is used to name files.
+import ExtractPDF # Critical - Python script that handles PDF text extraction and encoding.
+import EncodedLibrary # Critical - Python script that saves and reads the Encoded Libraries.
+import EmbeddingCache # Critical - Python script that keeps the embeddings of every chunk encoded, so that the same text is never encoded twice.
+
+#####----- Compare Folder and Manifest -----#####
+
+# Normalizes a file path so that the same PDF is recognized however its path was typed.
+def normPath(path):
+    return os.path.normcase(os.path.abspath(path))
+
+# Makes a list of every PDF in a folder and its subdirectories, in the same way as ExtractPDF.makeList.
+def scanFolder(folder):
+    files = []
+    for root, dirs, filenames in os.walk(folder):
+        for file in filenames:
+            if file.endswith('.pdf'):
+                files.append(os.path.join(root, file))
+    return files
+
+# This function compares the PDFs in a folder with the manifest of a library. It returns four lists: PDFs that are new, PDFs that have changed,
+# manifest entries for PDFs that have been deleted from the folder, and manifest entries for PDFs that were touched but whose content is the same.
+def planSync(manifest, folder):
+    known = {normPath(path): path for path in manifest} # Match the paths in the manifest to the PDFs in the folder.
+    folderPrefix = os.path.join(normPath(folder), '')
+
+    new, changed, touched = [], [], []
+    found = set()
+    for file in scanFolder(folder):
+        key = known.get(normPath(file))
+        if key is None: # If the PDF is not in the manifest, it is new.
+            new.append(file)
+            continue
+
+        found.add(key)
+        entry = manifest[key]
+        stat = os.stat(file)
+        if stat.st_size == entry['size'] and stat.st_mtime == entry['mtime']: # If the size and modification time match, the PDF is unchanged.
+            continue
+
+        # Otherwise, check whether the content of the PDF has actually changed.
+        fileHash = EncodedLibrary.hashFile(file)
+        if fileHash == entry['hash']:
+            touched.append((key, stat))
+        else:
+            changed.append(key)
+
+    # PDFs that are in the manifest and were in this folder, but are no longer found, have been deleted.
+    removed = [path for path in manifest if path not in found and normPath(path).startswith(folderPrefix)]
+
+    return new, changed, removed, touched
+
+#####----- Sync -----#####
+
+# This function syncs an Encoded Library folder with a folder of PDFs. It returns the warning flag and the path to the sync log, like ExtractPDF.createLibrary.
+def syncFolder(libDir, folder, workers=None):
+    header = EncodedLibrary.readHeader(libDir)
+    manifest = EncodedLibrary.readOrBuildManifest(libDir, header) # If the library has no manifest, one is made from its rows.
+
+    new, changed, removed, touched = planSync(manifest, folder)
+    print(f'Sync found {len(new)} new, {len(changed)} changed and {len(removed)} deleted PDFs.')
+
+    # PDFs that were touched without being changed only need their size and modification time updated.
+    touchedEntries = {path: {'size': stat.st_size, 'mtime': stat.st_mtime} for path, stat in touched}
+
+    # PDFs that were skipped as copies of a PDF that has now been changed or deleted (see EncodedLibrary.findCopies) are extracted after all,
+    # so that their content stays in the library.
+    gone = set(removed + changed)
+    orphaned = [path for path, entry in manifest.items() if entry.get('copyOf') in gone and path not in gone and os.path.exists(path)]
+
+    # PDFs that are byte-for-byte copies of a PDF already in the library (or of another new PDF) are not extracted.
+    toExtract = new + changed + orphaned
+    infos = EncodedLibrary.fileInfos(toExtract)
+    copies = EncodedLibrary.findCopies(ExtractPDF.documentOrder(toExtract), infos, EncodedLibrary.fileOwners(manifest, gone))
+
+    # Extract, chunk and encode only the new and changed PDFs.
+    pdfLog = ''
+    extractErrCount = 0
+    noTextFiles = []
+    cacheStats = {'hits': 0, 'misses': 0}
+    if toExtract:
+        records, failedFiles = ExtractPDF.extractFiles([file for file in toExtract if file not in copies], workers)
+        for file in failedFiles:
+            print(f"Error: Could not extract text from {file}")
+            pdfLog += f"An error occurred while extracting text from {file}. \n"
+            extractErrCount += 1
+
+        pdfTable, noTextFiles = ExtractPDF.chunkTable(records)
+        del records
+        for file in noTextFiles:
+            print(f'Warning: No text was found in {file}. Is it machine-readable?')
+            pdfLog += f'Warning: No text was found in {file}. Is it machine-readable? \n'
+
+        # Remove the chunks that are duplicates of each other or of a chunk already in the library (except in the rows being replaced),
+        # using the key of every chunk saved with the library (see EncodedLibrary.libraryKeys), so no text of the library is read.
+        index = EncodedLibrary.dedupIndex(EncodedLibrary.libraryKeys(libDir, header, EncodedLibrary.manifestRows(manifest, gone)))
+        pdfTable = pdfTable[EncodedLibrary.dropDuplicates(index, list(EncodedLibrary.tableKeys(pdfTable)))].reset_index(drop=True)
+        del index
+        if len(pdfTable) > 0: # Chunks that were encoded before (such as the unchanged parts of a changed PDF) are loaded from the embedding cache.
+            cache = EmbeddingCache.openCache()
+            try:
+                libraryEmbeddings = ExtractPDF.cachedEncoder(cache, cacheStats, progress=True)(pdfTable['Content'].tolist())
+            finally:
+                EmbeddingCache.closeCache(cache)
+        else:
+            libraryEmbeddings = np.zeros((0, header['dimension']), dtype=header['dtype'])
+
+        # Record the new and changed PDFs, with the rows they own in the new segment.
+        newEntries = EncodedLibrary.buildManifest(toExtract, pdfTable, infos=infos, copies=copies, failed=failedFiles) # PDFs that failed are tried again next time.
+    else:
+        newEntries = {}
+        pdfTable = pd.DataFrame(columns=ExtractPDF.tableColumns + ['Split'])
+        libraryEmbeddings = np.zeros((0, header['dimension']), dtype=header['dtype'])
+
+    # Add the new rows as a new segment, and mark the old rows of changed and deleted PDFs as deleted.
+    if new or changed or removed or touched: # Only write to the library if something has changed.
+        EncodedLibrary.addSegment(libDir, pdfTable, libraryEmbeddings, newEntries, removed + changed, touchedEntries)
+
+    #####----- Generate a Log -----#####
+    formattedTime = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    logPath = os.path.join('Logs', f'{formattedTime} - Library Sync Log.txt')
+
+    logFull = f"""------------------ Summary of Library Sync ------------------
+Folder synced: {folder}
+Number of new PDFs: {len(new)}
+Number of changed PDFs: {len(changed)}
+Number of deleted PDFs: {len(removed)}
+Number of PDFs from which no text could be extracted: {len(noTextFiles)}
+Number of PDFs which caused unexpected errors: {extractErrCount}
+Number of PDFs skipped as copies of other PDFs: {len(copies)}
+Number of chunks added to library: {len(pdfTable)}
+Embedding cache: {EmbeddingCache.hitRate(cacheStats)}
+
+The encoded library is saved here: {libDir}
+
+Errors:
+
+{pdfLog}"""
+
+    with open(logPath, 'w') as file:
+        file.write(logFull)
+
+    warnFlag = len(noTextFiles) + extractErrCount != 0
+    return warnFlag, logPath